@@ -4,21 +4,103 @@
 封装通用文字识别和智能文档解析两个API
 """
 
-import base64
 import hashlib
 import hmac
-import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
 from datetime import datetime, timezone
-from urllib.parse import urlencode, quote
-import requests
+from functools import lru_cache
+from urllib.parse import quote
 
 from config import (
-    AK, SK, API_HOST, API_REGION, API_SERVICE,
+    AK, SK, API_SCHEME, API_HOST, API_REGION, API_SERVICE,
     OCR_NORMAL_ACTION, OCR_NORMAL_VERSION,
     OCR_PDF_ACTION, OCR_PDF_VERSION,
-    REQUEST_TIMEOUT, MAX_RETRIES, RETRY_DELAY
+    REQUEST_TIMEOUT, MAX_RETRIES, RETRY_DELAY, RETRY_MAX_DELAY,
+    RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN, FATAL_ERROR_CODES,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN,
+    HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_BUDGET_RATIO,
+    MAX_QPS, RATE_LIMIT_BURST, MAX_CONCURRENCY, RETRY_SPARE_WORKERS,
+    ADAPTIVE_RATE_ENABLED, ADAPTIVE_MAX_QPS, ADAPTIVE_MIN_QPS, ADAPTIVE_LATENCY_TARGET,
+    THROTTLE_ERROR_CODES,
+    HTTP_POOL_SIZE, HTTP_KEEPALIVE_EXPIRY, HTTP_USE_HTTP2,
+    IMAGE_OPTIMIZE, IMAGE_COLOR_MODE, IMAGE_MAX_DPI, IMAGE_SOURCE_DPI,
+    IMAGE_CROP_MARGIN, IMAGE_BILEVEL_THRESHOLD,
+    OCR_CACHE_ENABLED, OCR_CACHE_FILE, OCR_CACHE_MAX_BYTES
 )
+from ratelimit import TokenBucket, AdaptiveController, LatencyTracker
+from transport import Transport, TransportError, TransportTimeout
+from form_body import FormBody, build_form_body
+from response_cache import ResponseCache
+from records import loads
+from retry import (
+    RETRYABLE, THROTTLED, FATAL,
+    classify_error, backoff_delay, RetryBudget, CircuitBreaker
+)
+
+# 全局限流器：所有线程共享，保证整体QPS不超过配额
+rate_limiter = TokenBucket(MAX_QPS, RATE_LIMIT_BURST)
+
+# 自适应控制：根据限流错误、超时和延迟调整QPS与在途请求数
+rate_controller = AdaptiveController(
+    rate_limiter,
+    min_qps=ADAPTIVE_MIN_QPS,
+    max_qps=max(MAX_QPS, ADAPTIVE_MAX_QPS),
+    min_in_flight=1,
+    max_in_flight=MAX_CONCURRENCY,
+    latency_target=ADAPTIVE_LATENCY_TARGET,
+    enabled=ADAPTIVE_RATE_ENABLED,
+)
+
+# 重试预算与熔断器：所有线程共享
+retry_budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN)
+circuit_breaker = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN)
+
+# 对冲请求：按接口记录本次运行的成功延迟，超过分位数时补发副本
+latency_tracker = LatencyTracker()
+hedge_budget = RetryBudget(HEDGE_BUDGET_RATIO, 1)
+hedge_stats = {"hedged": 0, "hedge_wins": 0}
+_hedge_lock = threading.Lock()
+# 每个发送线程最多同时有主请求和一个副本
+_hedge_executor = ThreadPoolExecutor(max_workers=(MAX_CONCURRENCY + RETRY_SPARE_WORKERS) * 2) if HEDGE_ENABLED else None
+
+# 全局连接池：所有线程共享，复用TCP/TLS连接
+transport = Transport(HTTP_POOL_SIZE, HTTP_KEEPALIVE_EXPIRY, HTTP_USE_HTTP2)
+
+
+# 全局响应缓存：按内容寻址，所有脚本共用；置 response_cache.enabled = False 可绕过
+response_cache = ResponseCache(OCR_CACHE_FILE, OCR_CACHE_MAX_BYTES, OCR_CACHE_ENABLED)
+
+
+def get_transport_stats() -> dict:
+    """连接复用统计"""
+    return transport.stats()
+
+
+def get_cache_stats() -> dict:
+    """响应缓存命中统计"""
+    return response_cache.stats()
+
+
+def get_rate_stats() -> dict:
+    """自适应限流状态与调整记录"""
+    return rate_controller.stats()
+
+
+def get_retry_stats() -> dict:
+    """重试与熔断统计"""
+    return {
+        "retries": retry_budget.spent,
+        "retries_denied": retry_budget.denied,
+        "circuit_state": circuit_breaker.state,
+        "circuit_open_count": circuit_breaker.open_count,
+    }
+
+
+def get_hedge_stats() -> dict:
+    """对冲请求统计"""
+    return dict(hedge_stats, enabled=HEDGE_ENABLED)
 
 
 def hmac_sha256(key: bytes, msg: str) -> bytes:
@@ -31,10 +113,23 @@ def hash_sha256(content: str) -> str:
     return hashlib.sha256(content.encode('utf-8')).hexdigest()
 
 
-def create_authorization(action: str, version: str, body: str) -> tuple:
+@lru_cache(maxsize=8)
+def get_signing_key(short_date: str, region: str, service: str) -> bytes:
+    """
+    派生签名密钥（按 日期/区域/服务 缓存）
+    k_date→k_signing 整条HMAC链每天只需计算一次
+    """
+    k_date = hmac_sha256(SK.encode('utf-8'), short_date)
+    k_region = hmac_sha256(k_date, region)
+    k_service = hmac_sha256(k_region, service)
+    return hmac_sha256(k_service, "request")
+
+
+def create_authorization(action: str, version: str, body: str, hashed_payload: str = None) -> tuple:
     """
     创建API请求的Authorization头
-    返回: (authorization, x_date)
+    hashed_payload: 预先计算好的body哈希，为None时现场计算
+    返回: (authorization, x_date, query_string)
     """
     now = datetime.now(timezone.utc)
     x_date = now.strftime('%Y%m%dT%H%M%SZ')
@@ -49,7 +144,8 @@ def create_authorization(action: str, version: str, body: str) -> tuple:
     canonical_uri = "/"
     canonical_headers = f"content-type:application/x-www-form-urlencoded\nhost:{API_HOST}\nx-date:{x_date}\n"
     signed_headers = "content-type;host;x-date"
-    hashed_payload = hash_sha256(body)
+    if hashed_payload is None:
+        hashed_payload = hash_sha256(body)
 
     canonical_request = f"{method}\n{canonical_uri}\n{query_string}\n{canonical_headers}\n{signed_headers}\n{hashed_payload}"
 
@@ -59,10 +155,7 @@ def create_authorization(action: str, version: str, body: str) -> tuple:
     string_to_sign = f"{algorithm}\n{x_date}\n{credential_scope}\n{hash_sha256(canonical_request)}"
 
     # 计算签名
-    k_date = hmac_sha256(SK.encode('utf-8'), short_date)
-    k_region = hmac_sha256(k_date, API_REGION)
-    k_service = hmac_sha256(k_region, API_SERVICE)
-    k_signing = hmac_sha256(k_service, "request")
+    k_signing = get_signing_key(short_date, API_REGION, API_SERVICE)
     signature = hmac.new(k_signing, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
 
     # Authorization头
@@ -71,22 +164,97 @@ def create_authorization(action: str, version: str, body: str) -> tuple:
     return authorization, x_date, query_string
 
 
-def call_api(action: str, version: str, body_params: dict) -> dict:
+class PreparedRequest:
     """
-    调用火山引擎API
+    预处理好的请求：body已编码、已哈希，发送时只需签名
+    可在网络等待期间由预处理线程提前生成
+    image_stats: 图片优化统计（未启用优化时为None）
+    cache_key: 响应缓存键（不可缓存时为None）
+    cached_response: 缓存命中时的响应，此时body为None，不需要发送
+    """
+    __slots__ = ("action", "version", "body", "image_stats", "cache_key", "cached_response")
+
+    def __init__(self, action: str, version: str, body: FormBody, image_stats: dict = None,
+                 cache_key: str = None, cached_response: dict = None):
+        self.action = action
+        self.version = version
+        self.body = body
+        self.image_stats = image_stats
+        self.cache_key = cache_key
+        self.cached_response = cached_response
+
+    @property
+    def upload_bytes(self) -> int:
+        """上传字节数（缓存命中时为0）"""
+        return self.body.length if self.body is not None else 0
+
+
+def _cache_key(action: str, version: str, body_params: dict, image_path: str,
+               image_field: str, optimize: bool, image_data: bytes = None) -> str:
+    """单张图片请求的响应缓存键"""
+    key_params = dict(body_params, image_field=image_field)
+    if optimize:
+        # 优化参数不同，上传的图片就不同
+        key_params["optimize"] = [IMAGE_COLOR_MODE, IMAGE_MAX_DPI, IMAGE_SOURCE_DPI,
+                                  IMAGE_CROP_MARGIN, IMAGE_BILEVEL_THRESHOLD]
+    return ResponseCache.make_key(image_path, action, version, key_params, image_data)
+
+
+def prepare_request(action: str, version: str, body_params: dict,
+                    image_path: str = None, image_field: str = "image_base64",
+                    optimize: bool = False, use_cache: bool = True,
+                    image_data: bytes = None) -> PreparedRequest:
+    """
+    编码并哈希请求body（CPU密集部分，不涉及网络）
+    指定image_path时图片流式编码到body末尾的 image_field 字段，
+    指定image_data时直接使用内存中的图片（如Phase 0渲染出的页面，不需要先写文件）
+    optimize为True时先做图片优化（灰度、降分辨率、裁边、重新压缩）
+    use_cache为True时先查响应缓存，命中则不再读图编码
+    """
+    has_image = image_path is not None or image_data is not None
+    cache_key = None
+    if has_image and use_cache and response_cache.enabled:
+        cache_key = _cache_key(action, version, body_params, image_path, image_field, optimize, image_data)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return PreparedRequest(action, version, None, cache_key=cache_key, cached_response=cached)
+
+    if has_image and optimize:
+        from image_optimize import optimize_image
+        optimized, image_stats = optimize_image(image_path, image_data)
+        body = build_form_body(body_params, image_field, image_data=optimized)
+        return PreparedRequest(action, version, body, image_stats, cache_key)
+
+    if image_data is not None:
+        body = build_form_body(body_params, image_field, image_data=image_data)
+    else:
+        body = build_form_body(body_params, image_field if image_path else None, image_path)
+    return PreparedRequest(action, version, body, cache_key=cache_key)
 
-    Args:
-        action: API名称 (OCRNormal / OCRPdf)
-        version: API版本
-        body_params: Body参数字典
+
+def send_prepared(prepared: PreparedRequest) -> dict:
+    """
+    发送预处理好的请求（含重试），缓存命中时直接返回缓存的响应
 
     Returns:
         API响应JSON
     """
-    body = urlencode(body_params)
-    authorization, x_date, query_string = create_authorization(action, version, body)
-
-    url = f"https://{API_HOST}/?{query_string}"
+    if prepared.cached_response is not None:
+        return prepared.cached_response
+
+    result = _send_with_retry(prepared)
+    if prepared.cache_key and result.get("code") == 10000:
+        response_cache.put(prepared.cache_key, prepared.action, result)
+    return result
+
+
+def _send_once(prepared: PreparedRequest):
+    """签名并发送一次请求，返回 transport.Response"""
+    # 签名只用到body哈希，开销很小，每次发送时重新生成时间戳
+    authorization, x_date, query_string = create_authorization(
+        prepared.action, prepared.version, None, prepared.body.sha256
+    )
+    url = f"{API_SCHEME}://{API_HOST}/?{query_string}"
     headers = {
         "Content-Type": "application/x-www-form-urlencoded",
         "Host": API_HOST,
@@ -94,49 +262,180 @@ def call_api(action: str, version: str, body_params: dict) -> dict:
         "Authorization": authorization
     }
 
-    # 重试机制
-    last_error = None
-    for attempt in range(MAX_RETRIES):
-        try:
-            resp = requests.post(url, headers=headers, data=body, timeout=REQUEST_TIMEOUT)
-            result = resp.json()
+    # 每次发送使用新的读取器，body缓冲区不拷贝
+    return transport.post(url, headers=headers, data=prepared.body.reader(), timeout=REQUEST_TIMEOUT)
 
-            # 检查是否成功
-            if result.get("code") == 10000:
-                return result
 
-            # API返回错误
-            error_info = result.get("ResponseMetadata", {}).get("Error", {})
-            error_code = error_info.get("Code", result.get("code"))
-            error_msg = error_info.get("Message", result.get("message", ""))
+def _is_success_response(resp) -> bool:
+    try:
+        return loads(resp.content).get("code") == 10000
+    except (ValueError, AttributeError):
+        return False
 
-            # 某些错误不需要重试
-            if error_code in [50205, 50207]:  # 文件大小/格式错误
-                return result
 
-            last_error = f"{error_code}: {error_msg}"
+def _send_hedged(prepared: PreparedRequest):
+    """
+    发送一次请求；超过该接口本次运行的历史延迟分位数仍未返回时，
+    在预算和限流允许的情况下补发一个副本，取先成功的一个，另一个取消或丢弃
+    """
+    if not HEDGE_ENABLED or latency_tracker.count(prepared.action) < HEDGE_MIN_SAMPLES:
+        return _send_once(prepared)
+
+    hedge_delay = latency_tracker.percentile(prepared.action, HEDGE_PERCENTILE)
+    primary = _hedge_executor.submit(_send_once, prepared)
+    try:
+        return primary.result(timeout=hedge_delay)
+    except FutureTimeout:
+        pass
+
+    # 对冲副本不占在途名额，但必须拿到预算和限流令牌（不等待），保证不突破QPS上限
+    if not hedge_budget.try_spend() or not rate_limiter.try_acquire():
+        return primary.result()
+    hedge = _hedge_executor.submit(_send_once, prepared)
+    with _hedge_lock:
+        hedge_stats["hedged"] += 1
+
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None and _is_success_response(future.result()):
+                # 未开始的直接取消；已在发送中的无法中断，结果丢弃
+                for other in pending:
+                    other.cancel()
+                if future is hedge:
+                    with _hedge_lock:
+                        hedge_stats["hedge_wins"] += 1
+                return future.result()
+
+    # 都没有成功，按主请求的结果走正常的重试流程
+    return primary.result()
+
+
+def _error_code(result: dict):
+    """提取响应中的错误码与错误信息"""
+    error_info = result.get("ResponseMetadata", {}).get("Error", {})
+    error_code = error_info.get("Code", result.get("code"))
+    error_msg = error_info.get("Message", result.get("message", ""))
+    return error_code, error_msg
+
+
+def _send_with_retry(prepared: PreparedRequest) -> dict:
+    """
+    发送请求，按错误类型决定是否重试
 
-        except requests.exceptions.Timeout:
+    - 可重试（超时、连接错误、5xx）与限流错误：指数退避+抖动后重试，消耗全局重试预算
+    - 致命错误（文件/参数/签名错误、非5xx的无法解析响应）：立即返回
+    - 退避等待发生在释放在途名额之后，不影响其他请求
+    """
+    retry_budget.on_request()
+    hedge_budget.on_request()
+    last_error = None
+    for attempt in range(MAX_RETRIES):
+        circuit_breaker.wait_ready()
+        rate_controller.acquire()
+        outcome = "error"
+        kind = RETRYABLE
+        result = None
+        start = time.monotonic()
+        try:
+            resp = _send_hedged(prepared)
+            try:
+                result = loads(resp.content)
+            except ValueError:
+                # 网关5xx返回的HTML可以重试，其他无法解析的响应重试也没有意义
+                kind = RETRYABLE if resp.status_code >= 500 else FATAL
+                last_error = f"响应解析失败 (HTTP {resp.status_code})"
+                result = None
+            else:
+                # 检查是否成功
+                if result.get("code") == 10000:
+                    outcome = "success"
+                    kind = None
+                    latency_tracker.record(prepared.action, time.monotonic() - start)
+                    return result
+
+                # API返回错误
+                error_code, error_msg = _error_code(result)
+                kind = classify_error(error_code, resp.status_code, THROTTLE_ERROR_CODES, FATAL_ERROR_CODES)
+                # 服务端正常处理后返回的业务错误不是拥塞信号
+                outcome = "throttled" if kind == THROTTLED else "success"
+                last_error = f"{error_code}: {error_msg}"
+
+        except TransportTimeout:
+            outcome = "timeout"
             last_error = "请求超时"
-        except requests.exceptions.RequestException as e:
+        except TransportError as e:
             last_error = f"请求异常: {str(e)}"
-        except json.JSONDecodeError:
-            last_error = "响应解析失败"
+        finally:
+            rate_controller.release(prepared.action, outcome, time.monotonic() - start)
+            # 只有可重试类失败说明端点有问题；限流、业务错误都说明端点在正常工作
+            if kind == RETRYABLE:
+                circuit_breaker.on_failure()
+            else:
+                circuit_breaker.on_success()
+
+        if kind == FATAL:
+            # 某些错误不需要重试
+            return result if result is not None else {"code": -1, "message": last_error}
 
-        # 重试前等待
+        # 重试前退避（不占用在途名额）
         if attempt < MAX_RETRIES - 1:
-            time.sleep(RETRY_DELAY * (attempt + 1))
+            if not retry_budget.try_spend():
+                last_error = f"{last_error}（重试预算已耗尽）"
+                break
+            time.sleep(backoff_delay(attempt, kind, RETRY_DELAY, RETRY_MAX_DELAY))
 
     # 所有重试都失败
-    return {"code": -1, "message": f"重试{MAX_RETRIES}次后失败: {last_error}"}
+    return {"code": -1, "message": f"重试{attempt + 1}次后失败: {last_error}"}
+
+
+def call_api(action: str, version: str, body_params: dict) -> dict:
+    """
+    调用火山引擎API
+
+    Args:
+        action: API名称 (OCRNormal / OCRPdf)
+        version: API版本
+        body_params: Body参数字典
+
+    Returns:
+        API响应JSON
+    """
+    return send_prepared(prepare_request(action, version, body_params))
+
+
+def prepare_ocr_normal(image_path: str = None, optimize: bool = IMAGE_OPTIMIZE,
+                       use_cache: bool = True, image_data: bytes = None) -> PreparedRequest:
+    """预处理通用文字识别请求（读图、编码、哈希），图片可以是文件或内存数据"""
+    return prepare_request(OCR_NORMAL_ACTION, OCR_NORMAL_VERSION, {}, image_path,
+                           optimize=optimize, use_cache=use_cache, image_data=image_data)
+
+
+def _pdf_body_params(table_mode: str) -> dict:
+    return {
+        "version": "v3",
+        "file_type": "image",
+        "table_mode": table_mode,
+        "filter_header": "true"
+    }
+
+
+def prepare_ocr_pdf(image_path: str = None, table_mode: str = "markdown",
+                    optimize: bool = IMAGE_OPTIMIZE, use_cache: bool = True,
+                    image_data: bytes = None) -> PreparedRequest:
+    """预处理智能文档解析请求（读图、编码、哈希），图片可以是文件或内存数据"""
+    return prepare_request(OCR_PDF_ACTION, OCR_PDF_VERSION, _pdf_body_params(table_mode), image_path,
+                           optimize=optimize, use_cache=use_cache, image_data=image_data)
 
 
-def ocr_normal(image_path: str) -> dict:
+def ocr_normal(image_path: str, prepared: PreparedRequest = None) -> dict:
     """
     通用文字识别
 
     Args:
         image_path: 图片文件路径
+        prepared: prepare_ocr_normal() 预先生成的请求，为None时现场生成
 
     Returns:
         {
@@ -146,15 +445,10 @@ def ocr_normal(image_path: str) -> dict:
             "raw_response": {...}  # 原始响应
         }
     """
-    # 读取图片
-    with open(image_path, 'rb') as f:
-        image_base64 = base64.b64encode(f.read()).decode()
+    if prepared is None:
+        prepared = prepare_ocr_normal(image_path)
 
-    body_params = {
-        "image_base64": image_base64,
-    }
-
-    result = call_api(OCR_NORMAL_ACTION, OCR_NORMAL_VERSION, body_params)
+    result = send_prepared(prepared)
 
     if result.get("code") == 10000:
         data = result.get("data", {})
@@ -162,6 +456,7 @@ def ocr_normal(image_path: str) -> dict:
             "success": True,
             "line_texts": data.get("line_texts", []),
             "line_probs": data.get("line_probs", []),
+            "cached": prepared.cached_response is not None,
             "raw_response": result
         }
     else:
@@ -174,13 +469,14 @@ def ocr_normal(image_path: str) -> dict:
         }
 
 
-def ocr_pdf(image_path: str, table_mode: str = "markdown") -> dict:
+def ocr_pdf(image_path: str, table_mode: str = "markdown", prepared: PreparedRequest = None) -> dict:
     """
     智能文档解析
 
     Args:
         image_path: 图片文件路径
         table_mode: 表格输出格式 ("markdown" / "html")
+        prepared: prepare_ocr_pdf() 预先生成的请求，为None时现场生成
 
     Returns:
         {
@@ -191,46 +487,27 @@ def ocr_pdf(image_path: str, table_mode: str = "markdown") -> dict:
             "raw_response": {...}
         }
     """
-    # 读取图片
-    with open(image_path, 'rb') as f:
-        image_base64 = base64.b64encode(f.read()).decode()
+    if prepared is None:
+        prepared = prepare_ocr_pdf(image_path, table_mode)
 
-    body_params = {
-        "image_base64": image_base64,
-        "version": "v3",
-        "file_type": "image",
-        "table_mode": table_mode,
-        "filter_header": "true"
-    }
+    result = send_prepared(prepared)
+    return _pdf_result(result, prepared.cached_response is not None)
 
-    result = call_api(OCR_PDF_ACTION, OCR_PDF_VERSION, body_params)
 
-    if result.get("code") == 10000:
-        data = result.get("data", {})
-        markdown = data.get("markdown", "")
+def _decode_detail(detail) -> list:
+    """解析detail字段（JSON字符串或已解析的列表），失败返回空列表"""
+    if not detail:
+        return []
+    try:
+        pages = loads(detail) if isinstance(detail, str) else detail
+    except ValueError:
+        return []
+    return pages if isinstance(pages, list) else []
 
-        # 解析detail获取textblocks
-        textblocks = []
-        has_table = False
-        detail = data.get("detail", "")
-        if detail:
-            try:
-                detail_json = json.loads(detail) if isinstance(detail, str) else detail
-                if isinstance(detail_json, list) and len(detail_json) > 0:
-                    textblocks = detail_json[0].get("textblocks", [])
-                    # 检查是否有表格
-                    has_table = any(block.get("label") == "table" for block in textblocks)
-            except (json.JSONDecodeError, KeyError, IndexError):
-                pass
 
-        return {
-            "success": True,
-            "markdown": markdown,
-            "textblocks": textblocks,
-            "has_table": has_table,
-            "raw_response": result
-        }
-    else:
+def _pdf_result(result: dict, cached: bool) -> dict:
+    """把单页智能文档解析响应转换为 ocr_pdf() 的返回格式"""
+    if result.get("code") != 10000:
         return {
             "success": False,
             "error": result.get("message", "未知错误"),
@@ -240,6 +517,21 @@ def ocr_pdf(image_path: str, table_mode: str = "markdown") -> dict:
             "raw_response": result
         }
 
+    data = result.get("data", {})
+    pages = _decode_detail(data.get("detail", ""))
+    textblocks = []
+    if pages and isinstance(pages[0], dict):
+        textblocks = pages[0].get("textblocks", [])
+    return {
+        "success": True,
+        "markdown": data.get("markdown", ""),
+        "textblocks": textblocks,
+        # 检查是否有表格
+        "has_table": any(block.get("label") == "table" for block in textblocks),
+        "cached": cached,
+        "raw_response": result
+    }
+
 
 # 测试
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+结果文件的原子写入与校验
+- 先写同目录下的临时文件，刷盘后改名覆盖，中途崩溃只会留下旧文件或临时文件，不会出现半个文件
+- 改名后目录项的刷盘按 ATOMIC_DIR_FSYNC_INTERVAL 批量进行（进程退出时补刷），逐个文件刷目录太慢
+- 写入时边写边计算内容哈希，改名前登记为待定、改名后确认，读取时校验；
+  改名前后中断时新旧两个哈希都认，不会把完好的文件判为损坏
+- 某个目录第一次写入时，清理已退出进程留下的临时文件
+"""
+
+import atexit
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from config import ATOMIC_FSYNC, ATOMIC_DIR_FSYNC_INTERVAL
+from manifest import page_manifest, file_sha256
+from records import loads
+
+# 临时文件名：<目标文件名>.<进程号>.<线程号>.tmp
+TMP_PATTERN = re.compile(r'.+\.(\d+)\.\d+\.tmp')
+
+_lock = threading.Lock()
+_pending_dirs = set()
+_cleaned_dirs = set()
+_last_dir_sync = time.monotonic()
+
+
+class ChecksumError(ValueError):
+    """文件内容与写入时登记的哈希不一致"""
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _cleanup_tmp(directory: str):
+    """删除已退出进程留下的临时文件（每个目录每个进程只检查一次）"""
+    with _lock:
+        if directory in _cleaned_dirs:
+            return
+        _cleaned_dirs.add(directory)
+    with os.scandir(directory) as it:
+        names = [entry.name for entry in it if entry.name.endswith(".tmp")]
+    for name in names:
+        match = TMP_PATTERN.fullmatch(name)
+        if match and not _pid_alive(int(match.group(1))):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def fsync_dir(directory: str):
+    """把目录项（新建、改名）刷到磁盘，不支持目录fsync的系统忽略"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def flush():
+    """立即刷新所有待刷盘的目录"""
+    global _last_dir_sync
+    with _lock:
+        directories = list(_pending_dirs)
+        _pending_dirs.clear()
+        _last_dir_sync = time.monotonic()
+    for directory in directories:
+        fsync_dir(directory)
+
+
+class _HashingWriter(io.RawIOBase):
+    """写入时同时计算SHA256；写入位置被移回前面（如 zipfile 回写文件头）后改为写完再读文件计算"""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._hasher = hashlib.sha256()
+        self._size = 0
+        self._sequential = True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return self._raw.seekable()
+
+    def write(self, data):
+        written = self._raw.write(data)
+        if self._sequential and written:
+            self._hasher.update(memoryview(data)[:written])
+            self._size += written
+        return written
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        position = self._raw.seek(offset, whence)
+        if position != self._size:
+            self._sequential = False
+        return position
+
+    def tell(self):
+        return self._raw.tell()
+
+    def fileno(self):
+        return self._raw.fileno()
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+        super().close()
+
+    def hexdigest(self) -> str:
+        """内容哈希，无法边写边计算时返回None"""
+        return self._hasher.hexdigest() if self._sequential else None
+
+
+def _dir_written(directory: str):
+    with _lock:
+        _pending_dirs.add(directory)
+        due = time.monotonic() - _last_dir_sync >= ATOMIC_DIR_FSYNC_INTERVAL
+    if due:
+        flush()
+
+
+atexit.register(flush)
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = 'w', checksum: bool = True, **kwargs):
+    """
+    以临时文件打开，with 块正常结束后刷盘并改名为 path；出现异常时删除临时文件，原文件不变
+
+    Args:
+        mode: 'w' 文本 / 'wb' 二进制
+        checksum: 登记内容哈希，供 read_bytes / read_json / verify 校验
+        kwargs: 文本模式的 encoding（默认 'utf-8'）、errors、newline
+    """
+    if mode not in ('w', 'wb'):
+        raise ValueError(f"atomic_open 只支持 'w' / 'wb': {mode}")
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    _cleanup_tmp(directory)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        raw = _HashingWriter(open(tmp_path, 'wb', buffering=0))
+        f = io.BufferedWriter(raw)
+        if mode == 'w':
+            f = io.TextIOWrapper(f, encoding=kwargs.get('encoding', 'utf-8'), errors=kwargs.get('errors'),
+                                 newline=kwargs.get('newline'))
+        with f:
+            yield f
+            f.flush()
+            if ATOMIC_FSYNC:
+                os.fsync(f.fileno())
+        if checksum:
+            digest = raw.hexdigest() or file_sha256(tmp_path)
+            # 先登记为待定再改名：改名后、确认前中断时，新文件按待定哈希校验通过
+            page_manifest.set_checksum(path, digest, pending=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    _dir_written(directory)
+    if checksum:
+        page_manifest.set_checksum(path, digest)
+
+
+def write_bytes(path: str, data: bytes, checksum: bool = True):
+    with atomic_open(path, 'wb', checksum=checksum) as f:
+        f.write(data)
+
+
+def checksum(path: str) -> str:
+    """
+    文件登记的内容哈希，没有登记时返回None
+    有待定哈希（改名前后中断）时读文件确认是新内容还是旧内容
+    """
+    path = os.path.abspath(path)
+    expected, pending = page_manifest.checksums(path)
+    if pending is None or not os.path.exists(path):
+        return expected
+    if file_sha256(path) == pending:
+        page_manifest.set_checksum(path, pending)
+        return pending
+    return expected
+
+
+def verify(path: str, data: bytes = None):
+    """
+    校验文件内容与写入时登记的哈希，没有登记（旧版本或手工写入的文件）时不校验
+    内容与改名前登记的待定哈希一致时（改名后中断），确认新哈希
+
+    Raises:
+        ChecksumError: 内容不一致
+    """
+    path = os.path.abspath(path)
+    expected, pending = page_manifest.checksums(path)
+    if expected is None and pending is None:
+        return
+    digest = hashlib.sha256(data).hexdigest() if data is not None else file_sha256(path)
+    if digest == expected:
+        return
+    if digest == pending:
+        page_manifest.set_checksum(path, pending)
+        return
+    # 只有待定哈希时，文件仍是改名前的旧文件（没有登记过）
+    if expected is not None:
+        raise ChecksumError(f"文件校验失败（写入时中断或已损坏），请重新生成: {path}")
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        data = f.read()
+    verify(path, data)
+    return data
+
+
+def read_json(path: str):
+    """
+    读取并校验JSON文件
+
+    Raises:
+        ChecksumError: 内容与登记的哈希不一致
+        ValueError: 不是完整的JSON（例如旧版本写入时中断）
+    """
+    return loads(read_bytes(path))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+增量构建
+每个产物（一页的合并内容、一套考试的Markdown章节、最终文件）登记它全部输入的内容哈希，
+输入没变时直接复用上次的结果，只重建受影响的部分
+
+    graph = BuildGraph("phase5", sources=[__file__])
+    content = graph.build(f"page:{page_num}", [ocr_result, table_result], lambda: merge(...))
+    graph.build("file:final", [graph.output_hash(f"page:{n}") for n in pages], write_final,
+                outputs=[FINAL_OUTPUT_FILE])
+
+- 输入可以是任意可JSON序列化的值；依赖其他产物时传 output_hash()，上游重建但结果不变时下游不受影响
+- sources 中的源码文件内容也计入每个产物的输入哈希，修改生成逻辑后自动全部重建
+- outputs 中的文件缺失、校验失败（atomic_io）或在构建之外被改写过时也会重建
+- 输入哈希和结果存放在页面清单的 builds 表中，按键逐个查询，不会把整个构建图读进内存
+"""
+
+import hashlib
+import os
+
+from manifest import page_manifest, file_sha256
+from atomic_io import verify, checksum
+from records import dumps, loads
+
+
+def _jsonable(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"无法计算哈希的输入类型: {type(value).__name__}")
+
+
+def content_hash(value) -> str:
+    """任意可JSON序列化的值的内容哈希（字典按键排序，集合按元素排序）"""
+    return hashlib.sha256(dumps(value, sort_keys=True, default=_jsonable)).hexdigest()
+
+
+def _files_intact(paths) -> bool:
+    for path in paths:
+        if not os.path.exists(path):
+            return False
+        try:
+            verify(path)
+        except (OSError, ValueError):
+            return False
+    return True
+
+
+def _checksums(paths) -> list:
+    return [checksum(path) for path in paths]
+
+
+class BuildGraph:
+    """
+    一组产物的增量构建
+
+    Args:
+        namespace: 构建图名称（各脚本各用一个）
+        sources: 生成逻辑所在的源码文件
+    """
+
+    def __init__(self, namespace: str, sources: list = ()):
+        self.namespace = namespace
+        self._salt = [file_sha256(path) for path in sources]
+        self.rebuilt = []
+        self.reused = 0
+
+    def build(self, key: str, inputs, func, outputs: list = ()):
+        """
+        构建一个产物：输入哈希与上次相同、且 outputs 中的文件完好时返回上次的结果，否则执行 func()
+
+        Args:
+            key: 产物名，如 "page:12" / "exam:2023-11-exam" / "file:final"
+            inputs: 产物的全部输入
+            func: 构建函数，返回值需可JSON序列化（只写文件的产物返回None）
+            outputs: func 写出的文件
+        """
+        # 输出文件登记的哈希一并计入，其他途径（如流式流水线）改写过这些文件时重建
+        input_hash = content_hash([self._salt, inputs, _checksums(outputs)])
+        node = page_manifest.build_node(self.namespace, key)
+        if node is not None and node[0] == input_hash and _files_intact(outputs):
+            self.reused += 1
+            return self.result(key)
+
+        value = func()
+        # func 写出了新的输出文件，按新登记的哈希记录
+        input_hash = content_hash([self._salt, inputs, _checksums(outputs)])
+        data = dumps(value, default=_jsonable)
+        output = data.decode('utf-8')
+        output_hash = hashlib.sha256(data).hexdigest()
+        page_manifest.put_build_node(self.namespace, key, input_hash, output_hash, output)
+        self.rebuilt.append(key)
+        return value
+
+    def output_hash(self, key: str) -> str:
+        """产物结果的哈希，作为下游产物的输入"""
+        node = page_manifest.build_node(self.namespace, key)
+        return node[1] if node else None
+
+    def result(self, key: str):
+        """产物上次构建的结果，没有时返回None"""
+        output = page_manifest.build_output(self.namespace, key)
+        return loads(output) if output is not None else None
+
+    def summary(self) -> str:
+        return f"重建 {len(self.rebuilt)} 项, 复用 {self.reused} 项"
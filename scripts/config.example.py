@@ -17,7 +17,8 @@ AK = "your_access_key_here"
 SK = "your_secret_key_here"
 
 # ==================== API配置 ====================
-API_HOST = "visual.volcengineapi.com"
+API_SCHEME = "https"  # 连接本地模拟服务（mock_server.py）时改为 "http"
+API_HOST = "visual.volcengineapi.com"  # 模拟服务如 "127.0.0.1:8090"
 API_REGION = "cn-north-1"
 API_SERVICE = "cv"
 
@@ -37,9 +38,10 @@ IMAGE_DIR = os.path.join(PROJECT_ROOT, "PDF_image")
 
 # 输出路径
 OUTPUT_DIR = os.path.join(PROJECT_ROOT, "output")
-RAW_OCR_DIR = os.path.join(OUTPUT_DIR, "raw_ocr")        # 通用OCR原始结果
+RAW_OCR_DIR = os.path.join(OUTPUT_DIR, "raw_ocr")        # 旧版本的逐页通用OCR结果（自动导入页面清单）
 TABLE_OCR_DIR = os.path.join(OUTPUT_DIR, "table_ocr")    # 表格页智能解析结果
 PROCESSED_DIR = os.path.join(OUTPUT_DIR, "processed")    # 处理后的结果
+RAW_STORE_DIR = os.path.join(OUTPUT_DIR, "raw_responses")  # API原始响应（压缩，按内容寻址）
 
 # 报告路径
 REPORTS_DIR = os.path.join(PROJECT_ROOT, "reports")
@@ -48,14 +50,77 @@ REPORTS_DIR = os.path.join(PROJECT_ROOT, "reports")
 # 并发控制
 MAX_QPS = 8  # 最大QPS（留2个余量，API限制10）
 REQUEST_INTERVAL = 1.0 / MAX_QPS  # 请求间隔（秒）
+MAX_CONCURRENCY = 8  # 同时在途的请求数（QPS由令牌桶单独限制）
+RATE_LIMIT_BURST = 1  # 令牌桶容量（允许的瞬时突发请求数）
+# 自适应限流（AIMD）：遇到限流/超时降速，运行平稳时逐步提速到API上限
+ADAPTIVE_RATE_ENABLED = True
+ADAPTIVE_MAX_QPS = 10  # API真实QPS上限
+ADAPTIVE_MIN_QPS = 1
+ADAPTIVE_LATENCY_TARGET = 0  # p90延迟目标（秒），0表示按观测到的最低p50自动推算
+THROTTLE_ERROR_CODES = [50429, 50430]  # 限流错误码（QPS超限 / 并发超限）
+PREFETCH_PAGES = 4  # 提前读图、编码、哈希的页数
+PREPARE_WORKERS = 2  # 请求预处理线程数
+
+# HTTP连接池
+HTTP_POOL_SIZE = MAX_CONCURRENCY  # 连接池大小（不小于并发数）
+HTTP_KEEPALIVE_EXPIRY = 30  # 空闲连接保留时间（秒，仅HTTP/2后端生效）
+HTTP_USE_HTTP2 = False  # 启用HTTP/2（需要 pip install httpx[http2]）
 
 # 重试配置
-MAX_RETRIES = 3
-RETRY_DELAY = 2  # 重试延迟（秒）
+MAX_RETRIES = 3  # 每个请求最多发送次数
+RETRY_DELAY = 2  # 退避基数（秒），第n次重试在 [0, RETRY_DELAY * 2^n] 内随机等待
+RETRY_MAX_DELAY = 30  # 单次退避上限（秒）
+RETRY_BUDGET_RATIO = 0.2  # 全局重试预算：重试次数不超过请求数的20%
+RETRY_BUDGET_MIN = 10  # 起步预算（允许的重试次数）
+RETRY_SPARE_WORKERS = 4  # 额外工作线程，退避等待时不占用在途名额
+FATAL_ERROR_CODES = [50205, 50207]  # 不重试的错误码（文件大小/格式错误）
+
+# 对冲请求：请求耗时超过本次运行该接口的历史分位数时补发一个副本，取先成功的结果
+HEDGE_ENABLED = False
+HEDGE_PERCENTILE = 95  # 触发对冲的延迟分位数
+HEDGE_MIN_SAMPLES = 20  # 积累足够样本后才开始对冲
+HEDGE_BUDGET_RATIO = 0.05  # 对冲请求不超过请求数的5%（且必须拿到限流令牌）
+
+# 熔断：连续失败过多时暂停派发
+CIRCUIT_FAILURE_THRESHOLD = 10  # 连续失败次数
+CIRCUIT_COOLDOWN = 30  # 暂停时长（秒）
+
+# 流式流水线（main.py --stream）：阶段之间的队列长度（页）
+STREAM_QUEUE_SIZE = 16
 
 # 超时配置
 REQUEST_TIMEOUT = 120  # 请求超时（秒）
 
+# 响应缓存（按图片内容+请求参数寻址，所有脚本共用）
+OCR_CACHE_ENABLED = True
+OCR_CACHE_FILE = os.path.join(OUTPUT_DIR, "ocr_cache.sqlite")
+OCR_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 缓存上限（2GB），超出按LRU淘汰
+
+# ==================== PDF转图片配置（Phase 0） ====================
+# 指定PDF时 main.py 先多进程渲染页面（需要 pip install pymupdf 或 pypdfium2）
+SOURCE_PDF = None              # 扫描版PDF路径，也可用 main.py --pdf 指定
+RASTER_DPI = 300               # 渲染分辨率
+RASTER_COLORSPACE = "gray"     # "gray" 灰度 / "rgb" 彩色
+RASTER_WORKERS = 0             # 渲染进程数，0为CPU核数
+RASTER_SAVE_IMAGES = False     # 同时保存PNG到IMAGE_DIR（Phase 3 会按需渲染表格页；ocr_pdf_all.py 需要全部图片时先执行 Phase 0）
+
+# ==================== 图片预处理配置 ====================
+# 上传前压缩图片（需要 pip install pillow）
+IMAGE_OPTIMIZE = False
+IMAGE_COLOR_MODE = "gray"      # "gray" 灰度 / "bilevel" 二值 / "keep" 保持原色
+IMAGE_MAX_DPI = 200            # 分辨率上限（超过则缩小）
+IMAGE_SOURCE_DPI = 300         # 图片未记录DPI时假定的分辨率
+IMAGE_CROP_MARGIN = True       # 裁掉空白边距
+IMAGE_BILEVEL_THRESHOLD = 160  # 二值化阈值（0-255）
+
+# 空白页/重复页跳过：OCR前计算墨迹覆盖率和感知哈希（需要 pip install pillow numpy）
+PAGE_SKIP_ENABLED = True
+PAGE_INK_THRESHOLD = 128  # 灰度低于此值的像素算作墨迹
+PAGE_BLANK_INK_RATIO = 0.002  # 墨迹覆盖率低于此值视为空白页
+PAGE_HASH_SIZE = 16  # dHash边长，哈希共 PAGE_HASH_SIZE² 位
+PAGE_DUPLICATE_DISTANCE = 16  # 哈希汉明距离不超过此值的页作为重复页候选
+PAGE_DUPLICATE_CORRELATION = 0.9  # 候选页缩略图相关系数不低于此值才视为重复（1为完全相同）
+
 # ==================== 水印过滤配置 ====================
 # 根据你的PDF源文件中的水印内容自定义
 WATERMARK_KEYWORDS = [
@@ -81,9 +146,25 @@ TABLE_SHORT_LINE_LENGTH = 12   # 短行长度定义
 TABLE_DIGIT_RATIO = 0.08       # 数字比例阈值
 
 # ==================== 输出配置 ====================
+# 原始响应压缩级别（zstd 1-22，未安装zstandard时回退zlib，取值上限9）
+RAW_STORE_COMPRESS_LEVEL = 3
+
+# 页面清单与结果存储（图片大小/修改时间/内容哈希，各阶段完成状态和逐页结果），代替逐页JSON文件
+MANIFEST_DB = os.path.join(OUTPUT_DIR, "pipeline.db")
+# 任务租约时长（秒）：处理中的页超过此时长没有登记结果，视为进程已中断，下次运行重新处理
+# 应大于单页最长处理时间（REQUEST_TIMEOUT × MAX_RETRIES 加上退避等待）
+JOB_LEASE_SECONDS = 600
+
+# OCR文本行列式导出（python line_table.py，.npz 或 .parquet）
+LINES_EXPORT_FILE = os.path.join(PROCESSED_DIR, "ocr_lines.npz")
+
+# 结果文件先写临时文件再原子改名（atomic_io），读取时按写入时登记的哈希校验
+ATOMIC_FSYNC = True  # 改名前把文件内容刷到磁盘
+ATOMIC_DIR_FSYNC_INTERVAL = 5.0  # 目录项批量刷盘间隔（秒），0为每次写入后立即刷盘
+
 # 最终JSON输出文件
 FINAL_OUTPUT_FILE = os.path.join(PROCESSED_DIR, "questions_final.json")
 
 # 确保目录存在
-for dir_path in [RAW_OCR_DIR, TABLE_OCR_DIR, PROCESSED_DIR, REPORTS_DIR]:
+for dir_path in [TABLE_OCR_DIR, PROCESSED_DIR, RAW_STORE_DIR, REPORTS_DIR]:
     os.makedirs(dir_path, exist_ok=True)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+请求body构建模块
+将图片流式地base64编码并百分号转义，写入一块预分配的缓冲区，同时增量计算SHA256
+
+原流程每张图片至少产生4份完整拷贝：
+    读文件 → base64字符串 → urlencode转义后的新字符串 → 哈希前再encode一次
+这里按块处理，整张图片只在最终缓冲区中存在一份
+"""
+
+import binascii
+import hashlib
+import os
+from urllib.parse import urlencode
+
+# 每次读取的原始字节数（3的倍数，保证分块base64可直接拼接）
+READ_CHUNK_SIZE = 3 * 64 * 1024
+
+
+class FormBody:
+    """
+    已编码的 application/x-www-form-urlencoded 请求body
+
+    Attributes:
+        buffer: 底层缓冲区（只有前 length 个字节有效）
+        length: body字节数（即上传字节数）
+        sha256: body的SHA256十六进制摘要（用于签名）
+    """
+    __slots__ = ("buffer", "length", "sha256")
+
+    def __init__(self, buffer: bytearray, length: int, sha256: str):
+        self.buffer = buffer
+        self.length = length
+        self.sha256 = sha256
+
+    def view(self) -> memoryview:
+        """body内容的只读视图（不拷贝）"""
+        return memoryview(self.buffer)[:self.length].toreadonly()
+
+    def reader(self) -> "BodyReader":
+        """返回一个新的流式读取器，每次发送（含重试）各用一个"""
+        return BodyReader(self.view())
+
+    def __len__(self):
+        return self.length
+
+
+class BodyReader:
+    """
+    只读的类文件对象，供HTTP库分块发送body而不做整体拷贝
+    实现 __len__ 以便HTTP库设置 Content-Length
+    """
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def read(self, size: int = -1) -> memoryview:
+        if size is None or size < 0:
+            size = len(self._view) - self._pos
+        chunk = self._view[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        return chunk
+
+    def __len__(self):
+        return len(self._view) - self._pos
+
+
+def _escape_base64(chunk: bytes) -> bytes:
+    """
+    对base64片段做表单转义
+    '+' 必须转义（否则服务端解码为空格），'=' 仅出现在末尾填充；
+    '/' 在表单值中无需转义，保留原样以减少上传体积
+    """
+    if b'+' in chunk:
+        chunk = chunk.replace(b'+', b'%2B')
+    if b'=' in chunk:
+        chunk = chunk.replace(b'=', b'%3D')
+    return chunk
+
+
+def build_form_body(params: dict, file_field: str = None, image_path: str = None,
+                    image_data: bytes = None) -> FormBody:
+    """
+    构建表单body
+
+    Args:
+        params: 普通参数（体积小，直接urlencode）
+        file_field: 图片字段名（如 "image_base64"），放在body末尾
+        image_path: 图片文件路径（流式读取）
+        image_data: 内存中的图片数据（与image_path二选一）
+
+    Returns:
+        FormBody
+    """
+    prefix = urlencode(params)
+    if file_field:
+        prefix = f"{prefix}&{file_field}=" if prefix else f"{file_field}="
+    prefix = prefix.encode('ascii')
+
+    if image_path is not None:
+        raw_size = os.path.getsize(image_path)
+    elif image_data is not None:
+        raw_size = len(image_data)
+    else:
+        raw_size = 0
+
+    # 预分配：base64长度 + 约1/16的转义余量（'+'出现概率约1/64，每个多2字节）
+    b64_size = (raw_size + 2) // 3 * 4
+    buffer = bytearray(len(prefix) + b64_size + b64_size // 16 + 16)
+    out = memoryview(buffer)
+    hasher = hashlib.sha256()
+    pos = 0
+
+    def write(data: bytes):
+        nonlocal out, pos
+        end = pos + len(data)
+        if end > len(buffer):
+            # 转义超出预估（极少见），扩容
+            out.release()
+            buffer.extend(bytes(end - len(buffer) + len(data)))
+            out = memoryview(buffer)
+        out[pos:end] = data
+        hasher.update(data)
+        pos = end
+
+    write(prefix)
+
+    if image_path is not None:
+        read_buffer = bytearray(READ_CHUNK_SIZE)
+        read_view = memoryview(read_buffer)
+        with open(image_path, 'rb') as f:
+            while True:
+                # 读满整块（块长为3的倍数，各块的base64才能直接拼接）
+                n = 0
+                while n < READ_CHUNK_SIZE:
+                    got = f.readinto(read_view[n:])
+                    if not got:
+                        break
+                    n += got
+                if not n:
+                    break
+                write(_escape_base64(binascii.b2a_base64(read_view[:n], newline=False)))
+                if n < READ_CHUNK_SIZE:
+                    break
+        read_view.release()
+    elif image_data is not None:
+        data_view = memoryview(image_data)
+        for start in range(0, len(data_view), READ_CHUNK_SIZE):
+            write(_escape_base64(binascii.b2a_base64(data_view[start:start + READ_CHUNK_SIZE], newline=False)))
+        data_view.release()
+
+    out.release()
+    return FormBody(buffer, pos, hasher.hexdigest())
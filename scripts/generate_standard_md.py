@@ -3,11 +3,14 @@
 生成标准格式的Markdown文档
 """
 
-import json
 import re
 import os
 from datetime import datetime
 
+from atomic_io import atomic_open
+from build_graph import BuildGraph
+from page_index import PageIndex
+
 # 路径配置
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_DIR = os.path.dirname(SCRIPT_DIR)
@@ -110,14 +113,61 @@ def get_section_type(text: str) -> str:
     return None
 
 
+def render_exam(exam: dict, pages) -> str:
+    """生成一套考试/答案的Markdown章节（pages 为 PageIndex 或 {页码: 页面}，只读取本套考试的页）"""
+    md_parts = []
+    anchor = f"{exam['exam_id']}-{'ans' if exam['is_answer'] else 'exam'}"
+    full_title = f"{exam['year']}年{int(exam['month'])}月公共营养师三级" + \
+                 ("统考真题答案解析" if exam['is_answer'] else "统考真题")
+
+    md_parts.append(f"## {full_title} {{#{anchor}}}\n\n")
+
+    current_section = None
+
+    for page_num in exam['pages']:
+        page = pages.get(page_num, {})
+        content = page.get('markdown', '') or '\n'.join(page.get('text', []))
+
+        if not content.strip():
+            continue
+
+        # 跳过目录页内容
+        if is_toc_page(content):
+            continue
+
+        # 检测题型变化
+        section = get_section_type(content)
+        if section and section != current_section:
+            current_section = section
+            section_names = {
+                "single": "单项选择题",
+                "multiple": "多项选择题",
+                "judge": "判断题",
+                "case": "案例分析题"
+            }
+            md_parts.append(f"\n### {section_names.get(section, section)}\n\n")
+
+        # 表格页保持原样
+        if page.get('is_table_page'):
+            md_parts.append(content + "\n\n")
+        else:
+            # 格式化普通内容
+            formatted = format_question_block(content)
+            md_parts.append(formatted + "\n")
+
+    md_parts.append("\n---\n\n")
+    return ''.join(md_parts)
+
+
 def generate_standard_md():
     """生成标准格式Markdown"""
     print("读取数据...")
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    with PageIndex(INPUT_FILE) as pages:
+        _generate_standard_md(pages)
 
-    pages = {p['page_num']: p for p in data['pages']}
-    exams = data['exams']
+
+def _generate_standard_md(pages: PageIndex):
+    exams = pages.exams
 
     print(f"共 {len(pages)} 页，{len(exams)} 套考试")
 
@@ -168,56 +218,31 @@ def generate_standard_md():
 
     md_parts.append("\n---\n\n")
 
-    # 正文内容
+    # 正文内容（每套考试一个章节，页面内容没变的章节复用上次的结果，需要重新生成时才读取页面）
+    graph = BuildGraph("standard_md", sources=[__file__])
+    section_keys = []
     for exam in exam_list:
-        anchor = f"{exam['exam_id']}-{'ans' if exam['is_answer'] else 'exam'}"
-        full_title = f"{exam['year']}年{int(exam['month'])}月公共营养师三级" + \
-                     ("统考真题答案解析" if exam['is_answer'] else "统考真题")
-
-        md_parts.append(f"## {full_title} {{#{anchor}}}\n\n")
-
-        current_section = None
-
-        for page_num in exam['pages']:
-            page = pages.get(page_num, {})
-            content = page.get('markdown', '') or '\n'.join(page.get('text', []))
-
-            if not content.strip():
-                continue
-
-            # 跳过目录页内容
-            if is_toc_page(content):
-                continue
-
-            # 检测题型变化
-            section = get_section_type(content)
-            if section and section != current_section:
-                current_section = section
-                section_names = {
-                    "single": "单项选择题",
-                    "multiple": "多项选择题",
-                    "judge": "判断题",
-                    "case": "案例分析题"
-                }
-                md_parts.append(f"\n### {section_names.get(section, section)}\n\n")
-
-            # 表格页保持原样
-            if page.get('is_table_page'):
-                md_parts.append(content + "\n\n")
-            else:
-                # 格式化普通内容
-                formatted = format_question_block(content)
-                md_parts.append(formatted + "\n")
-
-        md_parts.append("\n---\n\n")
+        key = f"exam:{exam['exam_id']}-{'ans' if exam['is_answer'] else 'exam'}"
+        section_keys.append(key)
+        md_parts.append(graph.build(key, [exam, [pages.page_hash(p) for p in exam['pages']]],
+                                    lambda: render_exam(exam, pages)))
 
     # 合并并清理
     final_md = ''.join(md_parts)
     final_md = re.sub(r'\n{4,}', '\n\n\n', final_md)
     final_md = re.sub(r'(\n-{3,}\n){2,}', '\n---\n\n', final_md)
 
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        f.write(final_md)
+    def write():
+        with atomic_open(OUTPUT_FILE) as f:
+            f.write(final_md)
+
+    # 生成时间不计入输入，各章节和目录都没变时不重写文件
+    graph.build("file:standard_md", [len(pages), exam_list, [graph.output_hash(k) for k in section_keys]],
+                write, outputs=[OUTPUT_FILE])
+    print(f"增量构建: {graph.summary()}")
+    if "file:standard_md" not in graph.rebuilt:
+        print(f"内容没有变化，沿用: {OUTPUT_FILE}")
+        return
 
     print(f"\n标准Markdown已生成: {OUTPUT_FILE}")
     print(f"文件大小: {os.path.getsize(OUTPUT_FILE) / 1024:.1f} KB")
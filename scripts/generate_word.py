@@ -3,7 +3,6 @@
 生成带目录索引的Word文档
 """
 
-import json
 import re
 import os
 from datetime import datetime
@@ -15,6 +14,10 @@ from docx.enum.style import WD_STYLE_TYPE
 from docx.oxml.ns import qn
 from docx.oxml import OxmlElement
 
+from atomic_io import atomic_open
+from build_graph import BuildGraph
+from page_index import PageIndex
+
 # 路径配置
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_DIR = os.path.dirname(SCRIPT_DIR)
@@ -194,42 +197,14 @@ def add_content_to_doc(doc, content, is_table_page=False):
 def generate_word():
     """生成Word文档"""
     print("读取数据...")
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    pages = {p['page_num']: p for p in data['pages']}
-    exams = data['exams']
-
-    print(f"共 {len(pages)} 页，{len(exams)} 套考试")
-
-    # 创建文档
-    doc = Document()
-
-    # 设置页面边距
-    for section in doc.sections:
-        section.top_margin = Cm(2.5)
-        section.bottom_margin = Cm(2.5)
-        section.left_margin = Cm(2.5)
-        section.right_margin = Cm(2.5)
+    with PageIndex(INPUT_FILE) as pages:
+        _generate_word(pages)
 
-    # 添加标题
-    title = doc.add_heading('公共营养师三级历年真题及答案解析', 0)
-    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
 
-    # 添加文档信息
-    info = doc.add_paragraph()
-    info.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    run = info.add_run(f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M')}")
-    set_chinese_font(run, font_size=10)
+def _generate_word(pages: PageIndex):
+    exams = pages.exams
 
-    doc.add_paragraph()
-
-    # 添加目录
-    toc_title = doc.add_heading('目录', 1)
-    add_toc(doc)
-
-    # 添加分页符
-    doc.add_page_break()
+    print(f"共 {len(pages)} 页，{len(exams)} 套考试")
 
     # 整理考试数据
     exam_list = []
@@ -259,36 +234,75 @@ def generate_word():
     # 按年月排序
     exam_list.sort(key=lambda x: (x['year'], x['month'], x['is_answer']), reverse=True)
 
-    print(f"处理 {len(exam_list)} 套考试/答案...")
+    def write():
+        # 创建文档
+        doc = Document()
 
-    # 正文内容
-    for idx, exam in enumerate(exam_list):
-        print(f"  [{idx+1}/{len(exam_list)}] {exam['title']}")
+        # 设置页面边距
+        for section in doc.sections:
+            section.top_margin = Cm(2.5)
+            section.bottom_margin = Cm(2.5)
+            section.left_margin = Cm(2.5)
+            section.right_margin = Cm(2.5)
 
-        # 添加考试标题（Heading 1，会被目录索引）
-        doc.add_heading(exam['title'], 1)
+        # 添加标题
+        title = doc.add_heading('公共营养师三级历年真题及答案解析', 0)
+        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
 
-        for page_num in exam['pages']:
-            page = pages.get(page_num, {})
-            content = page.get('markdown', '') or '\n'.join(page.get('text', []))
+        # 添加文档信息
+        info = doc.add_paragraph()
+        info.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        run = info.add_run(f"生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M')}")
+        set_chinese_font(run, font_size=10)
 
-            if not content.strip():
-                continue
+        doc.add_paragraph()
 
-            # 跳过目录页内容
-            if is_toc_page(content):
-                continue
+        # 添加目录
+        toc_title = doc.add_heading('目录', 1)
+        add_toc(doc)
+
+        # 添加分页符
+        doc.add_page_break()
+
+        print(f"处理 {len(exam_list)} 套考试/答案...")
+
+        # 正文内容
+        for idx, exam in enumerate(exam_list):
+            print(f"  [{idx+1}/{len(exam_list)}] {exam['title']}")
+
+            # 添加考试标题（Heading 1，会被目录索引）
+            doc.add_heading(exam['title'], 1)
 
-            # 添加内容
-            is_table_page = page.get('is_table_page', False)
-            add_content_to_doc(doc, content, is_table_page)
+            for page_num in exam['pages']:
+                page = pages.get(page_num, {})
+                content = page.get('markdown', '') or '\n'.join(page.get('text', []))
 
-        # 每套考试后添加分页符（除了最后一套）
-        if idx < len(exam_list) - 1:
-            doc.add_page_break()
+                if not content.strip():
+                    continue
 
-    # 保存文档
-    doc.save(OUTPUT_FILE)
+                # 跳过目录页内容
+                if is_toc_page(content):
+                    continue
+
+                # 添加内容
+                is_table_page = page.get('is_table_page', False)
+                add_content_to_doc(doc, content, is_table_page)
+
+            # 每套考试后添加分页符（除了最后一套）
+            if idx < len(exam_list) - 1:
+                doc.add_page_break()
+
+        # 保存文档
+        with atomic_open(OUTPUT_FILE, 'wb') as f:
+            doc.save(f)
+
+    # Word文档无法局部更新：页面内容、考试列表都没变时跳过整个文档的生成
+    graph = BuildGraph("word", sources=[__file__])
+    graph.build("file:word", [len(pages), exam_list, [[pages.page_hash(p) for p in e['pages']] for e in exam_list]],
+                write, outputs=[OUTPUT_FILE])
+    if not graph.rebuilt:
+        print(f"内容没有变化，沿用: {OUTPUT_FILE}")
+        return
 
     file_size = os.path.getsize(OUTPUT_FILE) / 1024
     print(f"\nWord文档已生成: {OUTPUT_FILE}")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+OCR文本行列式导出
+把所有页的文本行展开成一张列式表（每行一条），全书范围的分析可以直接做向量化运算，
+不必逐页解析JSON：置信度分布、水印出现频率等
+表格检测用的逐页特征由 table_features.py 计算并缓存在页面清单中
+
+列：
+    page        int32    页码
+    line        int32    行在页内的序号（水印过滤前）
+    prob        float32  置信度（缺失为NaN）
+    watermark   bool     是否为水印行（Phase 1 过滤掉的行）
+    char_len    int32    字符数
+    digit_count int32    数字字符数
+    text        UTF-8字节拼接存放，text_offsets[i]:text_offsets[i+1] 为第i行
+
+默认保存为NumPy .npz；输出文件名以 .parquet 结尾时用Parquet格式（需要 pip install pyarrow）
+
+使用方法:
+    python line_table.py                      # 导出到 LINES_EXPORT_FILE 并打印统计
+    python line_table.py --output lines.parquet
+"""
+
+
+import numpy as np
+
+from config import LINES_EXPORT_FILE, WATERMARK_KEYWORDS
+from manifest import page_manifest
+from raw_store import load_raw
+from atomic_io import atomic_open, verify
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+NUMERIC_COLUMNS = ("page", "line", "prob", "watermark", "char_len", "digit_count")
+
+
+class LineTable:
+    """
+    列式文本行表（按页码、行号排序）
+    数值列为NumPy数组，文本按UTF-8拼接成一个字节数组加偏移量
+    """
+    __slots__ = NUMERIC_COLUMNS + ("text_data", "text_offsets")
+
+    def __init__(self, page, line, prob, watermark, char_len, digit_count, text_data, text_offsets):
+        self.page = page
+        self.line = line
+        self.prob = prob
+        self.watermark = watermark
+        self.char_len = char_len
+        self.digit_count = digit_count
+        self.text_data = text_data
+        self.text_offsets = text_offsets
+
+    def __len__(self):
+        return len(self.page)
+
+    def text(self, i: int) -> str:
+        return self.text_data[self.text_offsets[i]:self.text_offsets[i + 1]].tobytes().decode('utf-8')
+
+    def texts(self, rows=None) -> list:
+        """解码文本，rows 为行下标或布尔掩码，默认全部"""
+        indices = range(len(self)) if rows is None else np.arange(len(self))[rows]
+        return [self.text(i) for i in indices]
+
+    def page_index(self) -> tuple:
+        """(页码数组, 行范围偏移)：第k页的行为 offsets[k]:offsets[k+1]"""
+        pages, starts = np.unique(self.page, return_index=True)
+        return pages, np.append(starts, len(self)).astype(np.int64)
+
+    @classmethod
+    def from_rows(cls, rows: list) -> "LineTable":
+        """从 [(页码, 行号, 文本, 置信度, 是否水印), ...] 构建"""
+        encoded = [text.encode('utf-8') for _, _, text, _, _ in rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(
+            page=np.array([r[0] for r in rows], dtype=np.int32),
+            line=np.array([r[1] for r in rows], dtype=np.int32),
+            prob=np.array([np.nan if r[3] is None else r[3] for r in rows], dtype=np.float32),
+            watermark=np.array([r[4] for r in rows], dtype=bool),
+            char_len=np.array([len(r[2]) for r in rows], dtype=np.int32),
+            digit_count=np.array([sum(c.isdigit() for c in r[2]) for r in rows], dtype=np.int32),
+            text_data=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            text_offsets=offsets,
+        )
+
+
+def _page_rows(page_num: int, record: dict) -> list:
+    """
+    一页的文本行
+    优先用原始响应（含水印行，文本与置信度一一对应），没有时退回过滤后的结果
+    """
+    raw = None
+    if record.get("raw_id"):
+        try:
+            raw = load_raw(record["raw_id"])
+        except (FileNotFoundError, RuntimeError, ValueError):
+            raw = None
+
+    if raw is not None:
+        data = raw.get("data") or {}
+        texts = data.get("line_texts", [])
+        probs = data.get("line_probs", [])
+        watermark = [any(kw in text for kw in WATERMARK_KEYWORDS) for text in texts]
+    else:
+        texts = record.get("line_texts", [])
+        probs = record.get("line_probs", [])
+        watermark = [False] * len(texts)
+
+    if len(probs) != len(texts):
+        probs = [None] * len(texts)
+    return [(page_num, i, text, prob, wm) for i, (text, prob, wm) in enumerate(zip(texts, probs, watermark))]
+
+
+def build_line_table(stage: str = "ocr") -> LineTable:
+    """从页面清单的OCR结果构建列式表"""
+    rows = []
+    for page_num, record in page_manifest.records(stage).items():
+        if record.get("success"):
+            rows.extend(_page_rows(page_num, record))
+    return LineTable.from_rows(rows)
+
+
+def save_line_table(table: LineTable, path: str = LINES_EXPORT_FILE):
+    if path.endswith(".parquet"):
+        if pyarrow is None:
+            raise RuntimeError("Parquet格式需要安装 pyarrow: pip install pyarrow")
+        columns = {name: getattr(table, name) for name in NUMERIC_COLUMNS}
+        columns["text"] = pyarrow.LargeStringArray.from_buffers(
+            len(table), pyarrow.py_buffer(table.text_offsets), pyarrow.py_buffer(table.text_data))
+        with atomic_open(path, 'wb') as f:
+            pyarrow.parquet.write_table(pyarrow.table(columns), f)
+    else:
+        with atomic_open(path, 'wb') as f:
+            np.savez(f, text_data=table.text_data, text_offsets=table.text_offsets,
+                     **{name: getattr(table, name) for name in NUMERIC_COLUMNS})
+
+
+def load_line_table(path: str = LINES_EXPORT_FILE) -> LineTable:
+    verify(path)
+    if path.endswith(".parquet"):
+        if pyarrow is None:
+            raise RuntimeError("Parquet格式需要安装 pyarrow: pip install pyarrow")
+        arrow_table = pyarrow.parquet.read_table(path).combine_chunks()
+        text = arrow_table.column("text").chunk(0).cast(pyarrow.large_string())
+        _, offsets, data = text.buffers()
+        offsets = np.frombuffer(offsets, dtype=np.int64)[text.offset:text.offset + len(text) + 1]
+        columns = {name: arrow_table.column(name).to_numpy() for name in NUMERIC_COLUMNS}
+        return LineTable(**columns, text_data=np.frombuffer(data, dtype=np.uint8),
+                         text_offsets=offsets)
+
+    with np.load(path) as npz:
+        return LineTable(**{name: npz[name] for name in NUMERIC_COLUMNS + ("text_data", "text_offsets")})
+
+
+def print_summary(table: LineTable):
+    """打印置信度分布和水印统计"""
+    pages, _ = table.page_index()
+    print(f"共 {len(pages)} 页, {len(table)} 行, 其中水印行 {int(table.watermark.sum())}")
+
+    probs = table.prob[~np.isnan(table.prob)]
+    if len(probs):
+        counts, edges = np.histogram(probs, bins=[0, 0.5, 0.8, 0.9, 0.95, 0.99, 1.0001])
+        print("置信度分布:")
+        for count, low, high in zip(counts, edges[:-1], edges[1:]):
+            print(f"  [{low:.2f}, {min(high, 1):.2f}{']' if high > 1 else ')'}: {count}")
+
+    if table.watermark.any():
+        texts, counts = np.unique(np.array(table.texts(table.watermark), dtype=object), return_counts=True)
+        print("出现最多的水印行:")
+        for i in np.argsort(-counts)[:10]:
+            print(f"  {counts[i]:5d}  {texts[i]}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="OCR文本行列式导出")
+    parser.add_argument("--output", default=LINES_EXPORT_FILE, help="输出文件（.npz 或 .parquet）")
+    args = parser.parse_args()
+
+    line_table = build_line_table()
+    save_line_table(line_table, args.output)
+    print(f"已导出: {args.output}")
+    print_summary(line_table)
@@ -5,9 +5,12 @@ OCR题库生成项目 - 主执行脚本
 
 使用方法:
     python main.py              # 执行所有阶段
+    python main.py --pdf book.pdf  # 从PDF开始（Phase 1 边渲染边识别）
+    python main.py --stream     # 流式执行，各阶段按页并行推进
     python main.py --phase 1    # 只执行Phase 1
     python main.py --phase 1-3  # 执行Phase 1到3
     python main.py --dry-run    # 仅显示计划
+    python main.py --retry-failed  # 只补做失败的页和表格组
 """
 
 import argparse
@@ -17,6 +20,8 @@ import os
 # 确保能导入同目录下的模块
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from config import SOURCE_PDF, RASTER_DPI, RASTER_COLORSPACE, RASTER_WORKERS, RASTER_SAVE_IMAGES
+
 
 def print_banner():
     """打印项目横幅"""
@@ -25,6 +30,7 @@ def print_banner():
 ║           OCR 题库生成项目 - 公共营养师三级真题                 ║
 ║                      火山引擎 OCR API                         ║
 ╠══════════════════════════════════════════════════════════════╣
+║  Phase 0: PDF转图片（多进程渲染）                              ║
 ║  Phase 1: 批量通用OCR识别                                     ║
 ║  Phase 2: 表格页检测                                          ║
 ║  Phase 3: 智能文档解析（表格页）                               ║
@@ -35,14 +41,28 @@ def print_banner():
     print(banner)
 
 
-def run_phase1(dry_run=False, start_page=None, end_page=None):
-    """运行Phase 1: 批量通用OCR"""
+def run_phase0(pdf_path, raster_options, start_page=None, end_page=None):
+    """运行Phase 0: PDF转图片"""
+    print("\n" + "=" * 60)
+    print("Phase 0: PDF转图片")
+    print("=" * 60)
+
+    from rasterize import rasterize_pdf
+    rasterize_pdf(pdf_path, raster_options["dpi"], raster_options["colorspace"],
+                  raster_options["workers"], start_page=start_page, end_page=end_page)
+
+
+def run_phase1(dry_run=False, start_page=None, end_page=None, pdf_path=None, raster_options=None,
+               retry_failed=False, only_stale=False):
+    """运行Phase 1: 批量通用OCR（指定PDF时边渲染边识别）"""
     print("\n" + "=" * 60)
     print("Phase 1: 批量通用OCR识别")
     print("=" * 60)
 
     from phase1_batch_ocr import run_batch_ocr
-    run_batch_ocr(start_page=start_page, end_page=end_page, dry_run=dry_run)
+    run_batch_ocr(start_page=start_page, end_page=end_page, dry_run=dry_run,
+                  pdf_path=pdf_path, raster_options=raster_options,
+                  retry_failed=retry_failed, only_stale=only_stale)
 
 
 def run_phase2():
@@ -55,14 +75,14 @@ def run_phase2():
     run_table_detection()
 
 
-def run_phase3():
-    """运行Phase 3-4: 智能文档解析"""
+def run_phase3(retry_failed=False, pdf_path=None, raster_options=None):
+    """运行Phase 3-4: 智能文档解析（指定PDF时缺少图片的表格页按需渲染）"""
     print("\n" + "=" * 60)
     print("Phase 3-4: 智能文档解析（表格页）")
     print("=" * 60)
 
     from phase3_parse_tables import run_table_parsing
-    run_table_parsing()
+    run_table_parsing(retry_failed=retry_failed, pdf_path=pdf_path, raster_options=raster_options)
 
 
 def run_phase5():
@@ -95,6 +115,11 @@ def main():
   python main.py --phase 1-3        # 执行Phase 1到3
   python main.py --phase 1 --dry-run # Phase 1 仅显示计划
   python main.py --phase 1 --start 1 --end 50  # Phase 1 处理页1-50
+  python main.py --pdf book.pdf     # 从PDF开始，Phase 1 边渲染边识别
+  python main.py --phase 0 --pdf book.pdf --dpi 200  # 只把PDF渲染为图片
+  python main.py --stream           # 流式执行（OCR、表格检测、表格解析、合并同时进行）
+  python main.py --phase 1 --retry-failed  # 重新识别上次失败的页
+  python main.py --phase 1 --only-stale    # 只重新识别图片已更新的页
         """
     )
 
@@ -111,18 +136,79 @@ def main():
     parser.add_argument(
         "--start",
         type=int,
-        help="起始页码（仅对Phase 1有效）"
+        help="起始页码（对Phase 0、1和--stream有效）"
     )
     parser.add_argument(
         "--end",
         type=int,
-        help="结束页码（仅对Phase 1有效）"
+        help="结束页码（对Phase 0、1和--stream有效）"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="绕过OCR响应缓存，强制重新调用API"
+    )
+    parser.add_argument(
+        "--pdf",
+        type=str,
+        default=SOURCE_PDF,
+        help="扫描版PDF路径，指定后不需要预先转换图片"
+    )
+    parser.add_argument(
+        "--dpi",
+        type=int,
+        default=RASTER_DPI,
+        help="PDF渲染分辨率"
+    )
+    parser.add_argument(
+        "--colorspace",
+        choices=["gray", "rgb"],
+        default=RASTER_COLORSPACE,
+        help="PDF渲染颜色空间"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="流式执行所有阶段：各阶段通过有界队列按页衔接，不再等上一阶段全部完成"
+    )
+    parser.add_argument(
+        "--no-save-images",
+        action="store_true",
+        help="Phase 1 边渲染边识别时不保存页面图片（Phase 3 按需渲染表格页）"
+    )
+
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="重新处理上次失败的页和表格组（默认只处理未处理、中断和图片已更新的）"
+    )
+    parser.add_argument(
+        "--only-stale",
+        action="store_true",
+        help="Phase 1 只重新识别图片已更新的页"
     )
 
     args = parser.parse_args()
 
     print_banner()
 
+    if args.no_cache:
+        from api import response_cache
+        response_cache.enabled = False
+
+    if args.stream:
+        from pipeline import run_pipeline
+        raster_options = {
+            "dpi": args.dpi,
+            "colorspace": args.colorspace,
+            "workers": RASTER_WORKERS,
+            # 表格页的图片由表格解析阶段按需渲染
+            "save_images": RASTER_SAVE_IMAGES and not args.no_save_images,
+        }
+        run_pipeline(start_page=args.start, end_page=args.end, pdf_path=args.pdf,
+                     raster_options=raster_options, retry_failed=args.retry_failed, only_stale=args.only_stale)
+        return
+
     # 确定要执行的阶段
     if args.phase:
         phases = parse_phase_range(args.phase)
@@ -131,19 +217,36 @@ def main():
 
     print(f"将执行阶段: {phases}")
 
+    raster_options = {
+        "dpi": args.dpi,
+        "colorspace": args.colorspace,
+        "workers": RASTER_WORKERS,
+        "save_images": RASTER_SAVE_IMAGES and not args.no_save_images,
+    }
+
     # 执行各阶段
     for phase in phases:
-        if phase == 1:
+        if phase == 0:
+            if not args.pdf:
+                print("Phase 0 需要指定 --pdf")
+                return
+            run_phase0(args.pdf, raster_options, start_page=args.start, end_page=args.end)
+        elif phase == 1:
             run_phase1(
                 dry_run=args.dry_run,
                 start_page=args.start,
-                end_page=args.end
+                end_page=args.end,
+                # Phase 0 已单独执行时从图片文件读取
+                pdf_path=args.pdf if 0 not in phases else None,
+                raster_options=raster_options,
+                retry_failed=args.retry_failed,
+                only_stale=args.only_stale
             )
         elif phase == 2:
             run_phase2()
         elif phase in [3, 4]:
             if 3 in phases or 4 in phases:
-                run_phase3()
+                run_phase3(retry_failed=args.retry_failed, pdf_path=args.pdf, raster_options=raster_options)
                 # 标记已执行，避免重复
                 if 4 in phases:
                     phases.remove(4)
@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+"""
+页面清单与结果存储
+SQLite中记录每页图片的路径、大小、修改时间、内容哈希，各阶段的完成状态，以及逐页结果记录。
+各阶段从清单取页面列表、已处理页和结果，不再各自扫描目录、逐个打开小文件
+
+- 图片目录每个进程只扫描一次，大小和修改时间没变的文件不重新计算哈希
+- 结果随状态一起写入（mark），可以一次读出整个阶段，也可以按页码查询
+- 旧版本留下的逐页JSON文件在第一次查询该阶段时导入
+- 每个 (页, 阶段) 是一个任务：记录状态、尝试次数、最后一次错误和耗时。
+  处理前先领取租约（claim），进程崩溃后租约到期，下次运行重新处理这些页；
+  多个进程同时处理同一本书时，不会重复处理其他进程正在处理的页
+
+查看单页结果 / 阶段任务统计（失败页及错误信息）:
+    python manifest.py ocr 12
+    python manifest.py ocr
+"""
+
+import hashlib
+import json
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from config import IMAGE_DIR, OUTPUT_DIR, RAW_OCR_DIR, MANIFEST_DB, JOB_LEASE_SECONDS
+from records import dumps_str, loads, STAGE_RECORDS
+
+# 页面图片文件名
+IMAGE_NAME_FORMAT = "三级历年真题及解析_{:02d}.png"
+IMAGE_NAME_PATTERN = re.compile(r'三级历年真题及解析_(\d+)\.png')
+
+# 阶段名 -> (旧版本输出目录, 文件名模式)，用于导入逐页JSON文件
+LEGACY_OUTPUTS = {
+    "ocr": (RAW_OCR_DIR, re.compile(r'page_(\d+)\.json')),
+    "pdf_ocr": (os.path.join(OUTPUT_DIR, "pdf_ocr"), re.compile(r'page_(\d+)\.json')),
+}
+
+# 按块读取图片计算哈希
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 任务表在旧版本基础上增加的列（打开旧数据库时自动补上）
+JOB_COLUMNS = {
+    "attempts": "INTEGER DEFAULT 0",   # 领取次数
+    "last_error": "TEXT",              # 最后一次失败的错误信息
+    "started_at": "REAL",              # 最后一次领取的时间
+    "duration": "REAL",                # 最后一次处理耗时（秒）
+    "lease_owner": "TEXT",             # 持有租约的进程
+    "lease_expires": "REAL",           # 租约到期时间
+}
+
+# 当前进程的租约持有者标识
+JOB_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+# 任务状态（job_states）
+JOB_STATE_NAMES = {
+    "done": "已完成",
+    "failed": "失败",
+    "stale": "图片已更新",
+    "interrupted": "中断",
+    "leased": "其他进程处理中",
+    "new": "未处理",
+}
+
+
+def file_sha256(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class PageManifest:
+    """
+    页面清单（线程安全）
+
+    Args:
+        db_path: 数据库文件路径
+        image_dir: 页面图片目录
+    """
+
+    def __init__(self, db_path: str, image_dir: str = IMAGE_DIR):
+        self.db_path = db_path
+        self.image_dir = image_dir
+        self._lock = threading.Lock()
+        self._conn = None
+        self._synced = False
+        self._imported = set()
+
+    def _connect(self):
+        """首次使用时打开数据库（调用方需持有锁）"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    page_num INTEGER PRIMARY KEY,
+                    filename TEXT,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    sha256 TEXT
+                )
+            """)
+            # input_hash: 产生该结果时图片的内容哈希，与 pages.sha256 不同说明图片已更新
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS stages (
+                    page_num INTEGER,
+                    stage TEXT,
+                    status TEXT,
+                    input_hash TEXT,
+                    updated_at REAL,
+                    PRIMARY KEY (page_num, stage)
+                )
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(stages)")}
+            for name, definition in JOB_COLUMNS.items():
+                if name not in columns:
+                    self._conn.execute(f"ALTER TABLE stages ADD COLUMN {name} {definition}")
+            # 各阶段的逐页结果（紧凑JSON），代替每页一个JSON文件
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS records (
+                    stage TEXT,
+                    page_num INTEGER,
+                    data TEXT,
+                    PRIMARY KEY (stage, page_num)
+                ) WITHOUT ROWID
+            """)
+            # features: 由结果计算出的逐页特征（table_features），结果重写时整行替换，特征随之作废
+            if "features" not in {row[1] for row in self._conn.execute("PRAGMA table_info(records)")}:
+                self._conn.execute("ALTER TABLE records ADD COLUMN features TEXT")
+            # 增量构建（build_graph）各产物的输入哈希和结果
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS builds (
+                    namespace TEXT,
+                    key TEXT,
+                    input_hash TEXT,
+                    output_hash TEXT,
+                    output TEXT,
+                    updated_at REAL,
+                    PRIMARY KEY (namespace, key)
+                ) WITHOUT ROWID
+            """)
+            # 原子写入的结果文件（atomic_io）的内容哈希，读取时校验
+            # pending: 改名前登记的新内容哈希，改名后转为 sha256（两步之间中断时两者都认）
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    path TEXT PRIMARY KEY,
+                    sha256 TEXT,
+                    updated_at REAL
+                )
+            """)
+            if "pending" not in {row[1] for row in self._conn.execute("PRAGMA table_info(artifacts)")}:
+                self._conn.execute("ALTER TABLE artifacts ADD COLUMN pending TEXT")
+        return self._conn
+
+    # ==================== 图片 ====================
+
+    def _sync_images(self, conn):
+        """增量同步图片目录（调用方需持有锁）"""
+        known = {row[0]: row[1:] for row in conn.execute("SELECT page_num, filename, size, mtime_ns FROM pages")}
+        entries = []
+        if os.path.isdir(self.image_dir):
+            with os.scandir(self.image_dir) as it:
+                entries = [entry for entry in it if IMAGE_NAME_PATTERN.fullmatch(entry.name)]
+
+        seen = set()
+        for entry in entries:
+            page_num = int(IMAGE_NAME_PATTERN.fullmatch(entry.name).group(1))
+            # 同一页有带/不带前导零两个文件时，用带前导零的
+            if page_num in seen and entry.name != IMAGE_NAME_FORMAT.format(page_num):
+                continue
+            seen.add(page_num)
+            stat = entry.stat()
+            if known.get(page_num) == (entry.name, stat.st_size, stat.st_mtime_ns):
+                continue
+            conn.execute(
+                "INSERT OR REPLACE INTO pages (page_num, filename, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?)",
+                (page_num, entry.name, stat.st_size, stat.st_mtime_ns, file_sha256(entry.path))
+            )
+        removed = known.keys() - seen
+        conn.executemany("DELETE FROM pages WHERE page_num = ?", [(p,) for p in removed])
+        conn.commit()
+        self._synced = True
+
+    def _pages_conn(self):
+        """返回已同步图片目录的连接（调用方需持有锁）"""
+        conn = self._connect()
+        if not self._synced:
+            self._sync_images(conn)
+        return conn
+
+    def refresh(self):
+        """图片目录有变化（例如Phase 0刚渲染完）时，下次查询重新扫描"""
+        with self._lock:
+            self._synced = False
+
+    def image_files(self) -> list:
+        """所有页面图片 [(页码, 文件名), ...]，按页码排序"""
+        with self._lock:
+            return self._pages_conn().execute("SELECT page_num, filename FROM pages ORDER BY page_num").fetchall()
+
+    def image_path(self, page_num: int) -> str:
+        """页码对应的图片路径，不存在时返回None"""
+        with self._lock:
+            conn = self._pages_conn()
+            row = conn.execute("SELECT filename FROM pages WHERE page_num = ?", (page_num,)).fetchone()
+            if row:
+                return os.path.join(self.image_dir, row[0])
+
+            # 扫描之后才写出的图片（流式模式边渲染边保存）
+            filename = IMAGE_NAME_FORMAT.format(page_num)
+            path = os.path.join(self.image_dir, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return None
+            conn.execute(
+                "INSERT OR REPLACE INTO pages (page_num, filename, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?)",
+                (page_num, filename, stat.st_size, stat.st_mtime_ns, file_sha256(path))
+            )
+            conn.commit()
+            return path
+
+    def image_hash(self, page_num: int) -> str:
+        """页面图片的内容哈希"""
+        with self._lock:
+            row = self._pages_conn().execute("SELECT sha256 FROM pages WHERE page_num = ?", (page_num,)).fetchone()
+        return row[0] if row else None
+
+    # ==================== 阶段状态与结果 ====================
+
+    def _import_legacy(self, conn, stage: str):
+        """该阶段还没有结果记录时，导入旧版本留下的逐页JSON文件（调用方需持有锁）"""
+        if stage in self._imported:
+            return
+        self._imported.add(stage)
+        if stage not in LEGACY_OUTPUTS:
+            return
+        if conn.execute("SELECT 1 FROM records WHERE stage = ? LIMIT 1", (stage,)).fetchone():
+            return
+
+        directory, pattern = LEGACY_OUTPUTS[stage]
+        if not os.path.isdir(directory):
+            return
+        stage_rows = []
+        record_rows = []
+        for filename in os.listdir(directory):
+            match = pattern.fullmatch(filename)
+            if not match:
+                continue
+            try:
+                with open(os.path.join(directory, filename), 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            page_num = int(match.group(1))
+            stage_rows.append((page_num, stage, "done" if record.get("success") else "failed", time.time()))
+            record_rows.append((page_num, stage, _dumps(record)))
+        conn.executemany("INSERT OR REPLACE INTO stages (page_num, stage, status, updated_at) VALUES (?, ?, ?, ?)",
+                         stage_rows)
+        conn.executemany("INSERT OR REPLACE INTO records (page_num, stage, data) VALUES (?, ?, ?)", record_rows)
+        conn.commit()
+        if record_rows:
+            print(f"[清单] 导入 {stage} 阶段已有结果 {len(record_rows)} 页（{directory}）")
+
+    def _stage_conn(self, stage: str):
+        """返回已导入旧结果的连接（调用方需持有锁）"""
+        conn = self._connect()
+        self._import_legacy(conn, stage)
+        return conn
+
+    def claim(self, page_num: int, stage: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """
+        领取一页在某阶段的任务：状态置为 running，尝试次数加1，租约 lease_seconds 秒后到期
+        其他进程持有未到期的租约时返回False（判断与写入在同一条语句中完成）
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._stage_conn(stage)
+            cursor = conn.execute("""
+                INSERT INTO stages (page_num, stage, status, attempts, started_at, lease_owner, lease_expires, updated_at)
+                VALUES (?, ?, 'running', 1, ?, ?, ?, ?)
+                ON CONFLICT (page_num, stage) DO UPDATE SET
+                    status = 'running',
+                    attempts = COALESCE(attempts, 0) + 1,
+                    started_at = excluded.started_at,
+                    lease_owner = excluded.lease_owner,
+                    lease_expires = excluded.lease_expires,
+                    updated_at = excluded.updated_at
+                WHERE status != 'running' OR lease_owner = excluded.lease_owner OR lease_expires <= excluded.started_at
+            """, (page_num, stage, now, JOB_OWNER, now + lease_seconds, now))
+            conn.commit()
+        return cursor.rowcount > 0
+
+    def mark(self, page_num: int, stage: str, status: str, record: dict = None, error: str = None):
+        """
+        登记一页在某阶段的结果，释放租约
+
+        Args:
+            status: "done" 成功 / "failed" 失败
+            record: 该页的结果记录，与状态在同一事务中写入
+            error: 失败原因
+        """
+        # 按阶段的记录类型检查，字段与定义不一致时在写入前报错
+        if record is not None and stage in STAGE_RECORDS:
+            STAGE_RECORDS[stage].check(record)
+        data = _dumps(record) if record is not None else None
+        with self._lock:
+            conn = self._stage_conn(stage)
+            row = conn.execute("SELECT sha256 FROM pages WHERE page_num = ?", (page_num,)).fetchone()
+            conn.execute("""
+                INSERT INTO stages (page_num, stage, status, input_hash, last_error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (page_num, stage) DO UPDATE SET
+                    status = excluded.status,
+                    input_hash = excluded.input_hash,
+                    last_error = excluded.last_error,
+                    duration = CASE WHEN status = 'running' THEN excluded.updated_at - started_at ELSE duration END,
+                    lease_owner = NULL,
+                    lease_expires = NULL,
+                    updated_at = excluded.updated_at
+            """, (page_num, stage, status, row[0] if row else None, error, time.time()))
+            if data is not None:
+                conn.execute("INSERT OR REPLACE INTO records (page_num, stage, data) VALUES (?, ?, ?)",
+                             (page_num, stage, data))
+            conn.commit()
+
+    def forget(self, page_num: int, stage: str):
+        """删除一页在某阶段的状态和结果，下次运行会重新处理"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM stages WHERE page_num = ? AND stage = ?", (page_num, stage))
+            conn.execute("DELETE FROM records WHERE page_num = ? AND stage = ?", (page_num, stage))
+            conn.commit()
+
+    def completed(self, stage: str) -> set:
+        """某阶段已有结果（含失败）的页码"""
+        with self._lock:
+            rows = self._stage_conn(stage).execute(
+                "SELECT page_num FROM stages WHERE stage = ? AND status IN ('done', 'failed')", (stage,)).fetchall()
+        return {row[0] for row in rows}
+
+    def is_completed(self, page_num: int, stage: str) -> bool:
+        with self._lock:
+            row = self._stage_conn(stage).execute(
+                "SELECT 1 FROM stages WHERE page_num = ? AND stage = ? AND status IN ('done', 'failed')",
+                (page_num, stage)).fetchone()
+        return row is not None
+
+    def job_states(self, stage: str, pages: list) -> dict:
+        """
+        各页在某阶段的任务状态 {页码: 状态}，状态见 JOB_STATE_NAMES
+        结果产生时的图片哈希与当前不同为 stale；running 且租约已到期为 interrupted（进程崩溃或被终止）
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._stage_conn(stage)
+            if not self._synced:
+                self._sync_images(conn)
+            rows = conn.execute("""
+                SELECT s.page_num, s.status, s.input_hash, s.lease_expires, p.sha256
+                FROM stages s LEFT JOIN pages p ON p.page_num = s.page_num
+                WHERE s.stage = ?
+            """, (stage,)).fetchall()
+        jobs = {row[0]: row[1:] for row in rows}
+
+        states = {}
+        for page_num in pages:
+            job = jobs.get(page_num)
+            if job is None:
+                states[page_num] = "new"
+                continue
+            status, input_hash, lease_expires, current_hash = job
+            if status == "running":
+                states[page_num] = "interrupted" if (lease_expires or 0) <= now else "leased"
+            elif input_hash and current_hash and input_hash != current_hash:
+                states[page_num] = "stale"
+            else:
+                states[page_num] = status
+        return states
+
+    def job_summary(self, stage: str) -> dict:
+        """某阶段任务统计：各状态页数、总尝试次数、平均耗时、失败页及最后一次错误"""
+        with self._lock:
+            rows = self._stage_conn(stage).execute(
+                "SELECT page_num, status, attempts, last_error, duration FROM stages WHERE stage = ? ORDER BY page_num",
+                (stage,)).fetchall()
+        durations = [row[4] for row in rows if row[4] is not None]
+        return {
+            "status_counts": dict(Counter(row[1] for row in rows)),
+            "attempts": sum(row[2] or 0 for row in rows),
+            "avg_duration_seconds": sum(durations) / len(durations) if durations else None,
+            "failed": [{"page_num": page_num, "attempts": attempts, "last_error": last_error}
+                       for page_num, status, attempts, last_error, _ in rows if status == "failed"],
+        }
+
+    def record(self, page_num: int, stage: str) -> dict:
+        """读取一页的结果记录，没有时返回None"""
+        with self._lock:
+            row = self._stage_conn(stage).execute(
+                "SELECT data FROM records WHERE stage = ? AND page_num = ?", (stage, page_num)).fetchone()
+        return loads(row[0]) if row else None
+
+    def records(self, stage: str) -> dict:
+        """读取某阶段全部结果记录 {页码: 记录}，按页码排序（一次查询）"""
+        with self._lock:
+            rows = self._stage_conn(stage).execute(
+                "SELECT page_num, data FROM records WHERE stage = ? ORDER BY page_num", (stage,)).fetchall()
+        return {page_num: loads(data) for page_num, data in rows}
+
+    def iter_records(self, stage: str, batch_size: int = 256):
+        """按页码顺序逐条读取某阶段的结果记录 (页码, 记录)，每次只取一批，内存占用与页数无关"""
+        last = -1
+        while True:
+            with self._lock:
+                rows = self._stage_conn(stage).execute(
+                    "SELECT page_num, data FROM records WHERE stage = ? AND page_num > ? "
+                    "ORDER BY page_num LIMIT ?", (stage, last, batch_size)).fetchall()
+            for page_num, data in rows:
+                yield page_num, loads(data)
+            if len(rows) < batch_size:
+                return
+            last = rows[-1][0]
+
+    def record_features(self, stage: str, pages: list = None) -> dict:
+        """
+        读取结果记录旁缓存的特征 {页码: 特征}，还没有计算过的页为None
+
+        Args:
+            pages: 只读取这些页，默认全部
+        """
+        with self._lock:
+            conn = self._stage_conn(stage)
+            if pages is None:
+                rows = conn.execute(
+                    "SELECT page_num, features FROM records WHERE stage = ? ORDER BY page_num", (stage,)).fetchall()
+            else:
+                rows = []
+                for page_num in pages:
+                    rows.extend(conn.execute("SELECT page_num, features FROM records WHERE stage = ? AND page_num = ?",
+                                             (stage, page_num)))
+        return {page_num: loads(features) if features else None for page_num, features in rows}
+
+    def set_record_features(self, stage: str, features: dict):
+        """把特征 {页码: 特征} 缓存到对应的结果记录旁（没有结果记录的页忽略）"""
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("UPDATE records SET features = ? WHERE stage = ? AND page_num = ?",
+                             [(dumps_str(value), stage, page_num) for page_num, value in features.items()])
+            conn.commit()
+
+    # ==================== 结果文件校验 ====================
+
+    def set_checksum(self, path: str, sha256: str, pending: bool = False):
+        """
+        登记文件的内容哈希
+        pending 为True时只登记为待定（改名之前），原有的哈希保留，直到改名后再次调用
+        """
+        with self._lock:
+            conn = self._connect()
+            if pending:
+                conn.execute("""
+                    INSERT INTO artifacts (path, pending, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT (path) DO UPDATE SET pending = excluded.pending, updated_at = excluded.updated_at
+                """, (path, sha256, time.time()))
+            else:
+                conn.execute("INSERT OR REPLACE INTO artifacts (path, sha256, pending, updated_at) VALUES (?, ?, NULL, ?)",
+                             (path, sha256, time.time()))
+            conn.commit()
+
+    def checksums(self, path: str) -> tuple:
+        """文件登记的 (内容哈希, 待定哈希)，没有登记时为 (None, None)"""
+        with self._lock:
+            row = self._connect().execute("SELECT sha256, pending FROM artifacts WHERE path = ?", (path,)).fetchone()
+        return tuple(row) if row else (None, None)
+
+    # ==================== 增量构建 ====================
+
+    def build_node(self, namespace: str, key: str) -> tuple:
+        """产物的 (输入哈希, 输出哈希)，没有时返回None"""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT input_hash, output_hash FROM builds WHERE namespace = ? AND key = ?",
+                (namespace, key)).fetchone()
+        return tuple(row) if row else None
+
+    def build_output(self, namespace: str, key: str) -> str:
+        """产物的结果JSON，没有时返回None"""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT output FROM builds WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+        return row[0] if row else None
+
+    def put_build_node(self, namespace: str, key: str, input_hash: str, output_hash: str, output: str):
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO builds (namespace, key, input_hash, output_hash, output, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (namespace, key, input_hash, output_hash, output, time.time()))
+            conn.commit()
+
+
+def needs_run(state: str, retry_failed: bool = False, only_stale: bool = False) -> bool:
+    """
+    按任务状态判断是否需要处理
+    默认处理未处理、中断和图片已更新的页；retry_failed 时加上失败的页；only_stale 时只处理图片已更新的页
+    """
+    if retry_failed and state == "failed":
+        return True
+    if only_stale:
+        return state == "stale"
+    return state in ("new", "interrupted", "stale")
+
+
+def format_job_states(states: dict) -> str:
+    """任务状态计数，如：已完成 120, 失败 3, 未处理 40"""
+    counts = Counter(states.values())
+    return ", ".join(f"{name} {counts[state]}" for state, name in JOB_STATE_NAMES.items() if counts[state])
+
+
+def _dumps(record: dict) -> str:
+    return dumps_str(record)
+
+
+page_manifest = PageManifest(MANIFEST_DB)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="查看页面结果记录和任务状态")
+    parser.add_argument("stage", help="阶段名，如 ocr / pdf_ocr / table")
+    parser.add_argument("page", type=int, nargs="?", help="页码，不指定时显示该阶段的任务统计")
+    args = parser.parse_args()
+
+    if args.page is None:
+        print(json.dumps(page_manifest.job_summary(args.stage), ensure_ascii=False, indent=2))
+    else:
+        print(json.dumps(page_manifest.record(args.page, args.stage), ensure_ascii=False, indent=2))
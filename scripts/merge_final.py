@@ -8,16 +8,13 @@ import os
 from pathlib import Path
 from datetime import datetime
 
-def merge_files():
-    base_dir = Path('/Users/yunchang/Documents/GitHub/PDF_OCR_json')
-    final_dir = base_dir / 'output' / 'final'
-    output_file = base_dir / 'output' / '公共营养师三级历年真题_最终版.md'
-
-    # 获取所有验证文件（排除报告文件）
-    files = sorted([f for f in final_dir.glob('*.md') if not f.name.startswith('standardization')])
+from atomic_io import atomic_open
+from build_graph import BuildGraph
+from manifest import file_sha256
 
-    print(f"找到 {len(files)} 个文件待合并")
 
+def write_merged(files: list, output_file: Path):
+    """合并文件并写出"""
     # 合并内容
     merged_content = []
 
@@ -61,9 +58,28 @@ def merge_files():
         merged_content.append("\n\n---\n\n")
 
     # 写入合并文件
-    with open(output_file, 'w', encoding='utf-8') as f:
+    with atomic_open(output_file) as f:
         f.write(''.join(merged_content))
 
+
+def merge_files():
+    base_dir = Path('/Users/yunchang/Documents/GitHub/PDF_OCR_json')
+    final_dir = base_dir / 'output' / 'final'
+    output_file = base_dir / 'output' / '公共营养师三级历年真题_最终版.md'
+
+    # 获取所有验证文件（排除报告文件）
+    files = sorted([f for f in final_dir.glob('*.md') if not f.name.startswith('standardization')])
+
+    print(f"找到 {len(files)} 个文件待合并")
+
+    # 各文件内容都没变时不重新合并
+    graph = BuildGraph("merge_final", sources=[__file__])
+    graph.build("file:final_md", [[f.name, file_sha256(str(f))] for f in files],
+                lambda: write_merged(files, output_file), outputs=[str(output_file)])
+    if not graph.rebuilt:
+        print(f"\n内容没有变化，沿用: {output_file}")
+        return output_file
+
     print(f"\n合并完成！输出文件: {output_file}")
     print(f"文件大小: {output_file.stat().st_size / 1024:.1f} KB")
 
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+火山引擎OCR本地模拟服务
+实现 api.call_api 使用的 OCRNormal / OCRPdf 请求与响应约定，用于离线压测并发、重试和限流
+
+模拟内容：
+- 校验签名（使用 config.py 中的 AK/SK）
+- 可配置的延迟分布（对数正态）
+- QPS限流（50429）与并发限制（50430）
+- 注入错误：文件过大（50205）、格式错误（50207）、服务端500、超时（挂起不响应）
+- OCRPdf 支持 file_type=pdf 的多页请求，detail 按页返回
+
+使用方法:
+    python mock_server.py --port 8090 --qps 10
+
+然后在 config.py 中设置:
+    API_SCHEME = "http"
+    API_HOST = "127.0.0.1:8090"
+
+GET /stats 返回服务端统计，POST /reset 清空统计
+"""
+
+import argparse
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+from config import AK, SK, API_REGION, API_SERVICE
+from ratelimit import TokenBucket
+
+AUTH_PATTERN = re.compile(
+    r'HMAC-SHA256 Credential=([^/]+)/(\d{8})/([^/]+)/([^/]+)/request, '
+    r'SignedHeaders=([^,]+), Signature=([0-9a-f]+)'
+)
+
+
+class MockSettings:
+    """模拟服务配置"""
+
+    def __init__(self, args):
+        self.qps = args.qps
+        self.max_concurrency = args.max_concurrency
+        self.latency_median = {"OCRNormal": args.latency_median, "OCRPdf": args.pdf_latency_median}
+        self.latency_sigma = args.latency_sigma
+        self.max_body_bytes = int(args.max_body_mb * 1024 * 1024)
+        self.error_rate = args.error_rate
+        self.server_error_rate = args.server_error_rate
+        self.timeout_rate = args.timeout_rate
+        self.hang_seconds = args.hang_seconds
+        self.verify_signature = not args.no_verify
+        self.lines_per_page = args.lines_per_page
+
+
+class MockState:
+    """服务端计数（线程安全）"""
+
+    def __init__(self, settings: MockSettings):
+        self.settings = settings
+        self.bucket = TokenBucket(settings.qps, max(1, settings.qps)) if settings.qps else None
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.in_flight = 0
+            self.counters = {
+                "requests": 0, "success": 0, "throttled_qps": 0, "throttled_concurrency": 0,
+                "signature_errors": 0, "size_errors": 0, "format_errors": 0,
+                "injected_errors": 0, "server_errors": 0, "hangs": 0,
+                "max_in_flight": 0, "bytes_received": 0,
+            }
+            self.started = time.time()
+
+    def count(self, key: str, n: int = 1):
+        with self.lock:
+            self.counters[key] += n
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            data = dict(self.counters)
+            elapsed = time.time() - self.started
+        data["elapsed_seconds"] = elapsed
+        data["observed_qps"] = data["requests"] / elapsed if elapsed else 0
+        return data
+
+
+def sign(short_date: str, x_date: str, query_string: str, host: str, hashed_payload: str,
+         signed_headers: str) -> str:
+    """按客户端相同的算法计算签名"""
+    canonical_headers = f"content-type:application/x-www-form-urlencoded\nhost:{host}\nx-date:{x_date}\n"
+    canonical_request = f"POST\n/\n{query_string}\n{canonical_headers}\n{signed_headers}\n{hashed_payload}"
+    credential_scope = f"{short_date}/{API_REGION}/{API_SERVICE}/request"
+    string_to_sign = (f"HMAC-SHA256\n{x_date}\n{credential_scope}\n"
+                      f"{hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()}")
+    key = SK.encode('utf-8')
+    for msg in (short_date, API_REGION, API_SERVICE, "request"):
+        key = hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+    return hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def fake_lines(seed: bytes, count: int) -> list:
+    """根据图片内容生成确定性的假文本行"""
+    rng = random.Random(hashlib.sha256(seed).digest())
+    lines = []
+    for i in range(count):
+        if i % 6 == 0:
+            lines.append(f"{i // 6 + 1}.下列关于营养素的说法正确的是（）")
+        else:
+            lines.append(f"{'ABCD'[i % 6 - 1] if i % 6 <= 4 else ''}.选项内容{rng.randint(0, 999)}")
+    return lines
+
+
+def ocr_normal_response(image: bytes, settings: MockSettings) -> dict:
+    lines = fake_lines(image, settings.lines_per_page)
+    return {
+        "code": 10000,
+        "message": "Success",
+        "request_id": uuid.uuid4().hex,
+        "data": {
+            "line_texts": lines,
+            "line_probs": [round(0.9 + (i % 10) / 100, 3) for i in range(len(lines))],
+        },
+    }
+
+
+def pdf_page_count(data: bytes) -> int:
+    """统计PDF页数（只识别 /Type /Page 对象，够用于Pillow生成的PDF）"""
+    return len(re.findall(rb"/Type\s*/Page\b(?!s)", data))
+
+
+def ocr_pdf_response(image: bytes, settings: MockSettings, form: dict) -> dict:
+    if form.get("file_type", ["image"])[0] == "pdf":
+        page_start = int(form.get("page_start", ["0"])[0])
+        total = pdf_page_count(image)
+        page_num = int(form.get("page_num", [str(total)])[0])
+        page_ids = list(range(page_start, min(total, page_start + page_num)))
+    else:
+        page_ids = [0]
+
+    pages = []
+    markdown_parts = []
+    for page_id in page_ids:
+        lines = fake_lines(image + str(page_id).encode(), settings.lines_per_page)
+        textblocks = [{"label": "text", "text": line} for line in lines]
+        textblocks.append({"label": "table", "text": "| 食物名称 | 次/日 |\n|---|---|\n| 大米 | 2 |"})
+        pages.append({"page_id": page_id, "textblocks": textblocks})
+        markdown_parts.append("\n\n".join(block["text"] for block in textblocks))
+    return {
+        "code": 10000,
+        "message": "Success",
+        "request_id": uuid.uuid4().hex,
+        "data": {
+            "markdown": "\n\n".join(markdown_parts),
+            "detail": json.dumps(pages, ensure_ascii=False),
+        },
+    }
+
+
+def error_response(code: int, message: str) -> dict:
+    return {"code": code, "message": message, "request_id": uuid.uuid4().hex, "data": None}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/stats":
+            self._send_json(200, self.state.snapshot())
+        else:
+            self._send_json(404, {"message": "not found"})
+
+    def do_POST(self):
+        state = self.state
+        settings = state.settings
+        parsed = urlparse(self.path)
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        if parsed.path == "/reset":
+            state.reset()
+            self._send_json(200, {"reset": True})
+            return
+
+        state.count("requests")
+        state.count("bytes_received", length)
+        query = parse_qs(parsed.query)
+        action = query.get("Action", [""])[0]
+
+        # 签名校验
+        if settings.verify_signature and not self._check_signature(parsed.query, body):
+            state.count("signature_errors")
+            self._send_json(401, {"ResponseMetadata": {"Action": action, "Error": {
+                "Code": "SignatureDoesNotMatch", "Message": "signature mismatch"}}})
+            return
+
+        if action not in ("OCRNormal", "OCRPdf"):
+            self._send_json(400, {"ResponseMetadata": {"Action": action, "Error": {
+                "Code": "InvalidActionOrVersion", "Message": f"unknown action {action}"}}})
+            return
+
+        # QPS限流
+        if state.bucket and not state.bucket.try_acquire():
+            state.count("throttled_qps")
+            self._send_json(200, error_response(50429, "Request Has Reached API Limit"))
+            return
+
+        # 并发限制
+        with state.lock:
+            if settings.max_concurrency and state.in_flight >= settings.max_concurrency:
+                state.counters["throttled_concurrency"] += 1
+                throttled = True
+            else:
+                throttled = False
+                state.in_flight += 1
+                state.counters["max_in_flight"] = max(state.counters["max_in_flight"], state.in_flight)
+        if throttled:
+            self._send_json(200, error_response(50430, "Request Has Reached API Concurrent Limit"))
+            return
+
+        try:
+            self._handle_ocr(action, body)
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+
+    def _check_signature(self, query_string: str, body: bytes) -> bool:
+        match = AUTH_PATTERN.match(self.headers.get("Authorization", ""))
+        if not match:
+            return False
+        access_key, short_date, _, _, signed_headers, signature = match.groups()
+        x_date = self.headers.get("X-Date", "")
+        if access_key != AK or not x_date.startswith(short_date):
+            return False
+        expected = sign(short_date, x_date, query_string, self.headers.get("Host", ""),
+                        hashlib.sha256(body).hexdigest(), signed_headers)
+        return hmac.compare_digest(expected, signature)
+
+    def _handle_ocr(self, action: str, body: bytes):
+        state = self.state
+        settings = state.settings
+
+        # 模拟处理耗时
+        median = settings.latency_median[action]
+        latency = random.lognormvariate(0, settings.latency_sigma) * median if median else 0
+
+        roll = random.random()
+        if roll < settings.timeout_rate:
+            # 挂起，触发客户端超时
+            state.count("hangs")
+            time.sleep(settings.hang_seconds)
+            self._send_json(200, error_response(50500, "Internal Error"))
+            return
+        roll -= settings.timeout_rate
+
+        time.sleep(latency)
+
+        if roll < settings.server_error_rate:
+            state.count("server_errors")
+            payload = b"<html><body>502 Bad Gateway</body></html>"
+            self.send_response(502)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        roll -= settings.server_error_rate
+
+        if roll < settings.error_rate:
+            state.count("injected_errors")
+            self._send_json(200, error_response(50500, "Internal Error"))
+            return
+
+        if len(body) > settings.max_body_bytes:
+            state.count("size_errors")
+            self._send_json(200, error_response(50205, "image size exceeds limit"))
+            return
+
+        form = parse_qs(body.decode('ascii', errors='replace'))
+        try:
+            image = base64.b64decode(form.get("image_base64", [""])[0], validate=True)
+        except (binascii.Error, ValueError):
+            image = b""
+        if not image:
+            state.count("format_errors")
+            self._send_json(200, error_response(50207, "image decode error"))
+            return
+
+        if action == "OCRNormal":
+            payload = ocr_normal_response(image, settings)
+        else:
+            payload = ocr_pdf_response(image, settings, form)
+        state.count("success")
+        self._send_json(200, payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="火山引擎OCR本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--qps", type=float, default=10, help="QPS上限，超出返回50429（0为不限）")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="并发上限，超出返回50430（0为不限）")
+    parser.add_argument("--latency-median", type=float, default=0.8, help="OCRNormal延迟中位数（秒）")
+    parser.add_argument("--pdf-latency-median", type=float, default=2.0, help="OCRPdf延迟中位数（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="对数正态分布sigma，越大长尾越重")
+    parser.add_argument("--max-body-mb", type=float, default=10, help="请求体上限（MB），超出返回50205")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回50500的概率")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="随机返回502非JSON响应的概率")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="随机挂起的概率")
+    parser.add_argument("--hang-seconds", type=float, default=150, help="挂起时长（秒）")
+    parser.add_argument("--lines-per-page", type=int, default=30, help="每页返回的文本行数")
+    parser.add_argument("--no-verify", action="store_true", help="不校验签名")
+    args = parser.parse_args()
+
+    MockHandler.state = MockState(MockSettings(args))
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    print(f"模拟OCR服务已启动: http://{args.host}:{args.port}")
+    print(f"  QPS上限: {args.qps or '不限'}, 并发上限: {args.max_concurrency or '不限'}")
+    print(f"  延迟中位数: OCRNormal {args.latency_median}s / OCRPdf {args.pdf_latency_median}s")
+    print(f"在 config.py 中设置 API_SCHEME = \"http\", API_HOST = \"{args.host}:{args.port}\"")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+并发OCR客户端
+保持N个请求同时在途，结果按完成顺序返回
+QPS和网络在途数由 api 模块的自适应控制器统一限制，这里只负责调度
+请求预处理（读图、编码、哈希）在独立线程中提前进行，与网络等待重叠
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import MAX_CONCURRENCY, PREFETCH_PAGES, PREPARE_WORKERS, RETRY_SPARE_WORKERS
+
+
+class OCRClient:
+    """
+    线程池OCR客户端
+
+    用法:
+        client = OCRClient()
+        for item, result in client.map_unordered(process, items):
+            save(result)  # 结果一完成就落盘
+
+        # 带预处理：prepare(item) 提前 prefetch 个执行，结果作为 func 的第二个参数
+        client.map_unordered(send, items, prepare=prepare)
+    """
+
+    def __init__(self, max_in_flight: int = MAX_CONCURRENCY, prefetch: int = PREFETCH_PAGES,
+                 spare_workers: int = RETRY_SPARE_WORKERS):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.prefetch = max(1, int(prefetch))
+        # 额外的工作线程：某个请求退避等待时，其他页可以顶上它让出的在途名额
+        self.workers = self.max_in_flight + max(0, int(spare_workers))
+
+    def map_unordered(self, func, items, prepare=None):
+        """
+        对每个item调用 func(item)，最多 workers 个同时执行
+        （实际网络在途数由 api 模块限制在 max_in_flight 以内）
+
+        Args:
+            func: 处理函数；指定prepare时签名为 func(item, prepared)
+            items: 待处理项
+            prepare: 可选的预处理函数，在预处理线程中提前执行
+
+        Yields:
+            (item, result)，按完成顺序
+        """
+        items = iter(items)
+        pending = {}
+        # 已提交预处理的项（保持输入顺序），最多领先 prefetch 个
+        prefetched = deque()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor, \
+                ThreadPoolExecutor(max_workers=PREPARE_WORKERS) as prepare_executor:
+            def fill_prefetch():
+                while len(prefetched) < self.prefetch:
+                    item = next(items, _END)
+                    if item is _END:
+                        return
+                    prefetched.append((item, prepare_executor.submit(prepare, item)))
+
+            def submit_next():
+                if prepare is None:
+                    for item in items:
+                        pending[executor.submit(func, item)] = item
+                        return True
+                    return False
+
+                fill_prefetch()
+                if not prefetched:
+                    return False
+                item, prepare_future = prefetched.popleft()
+                pending[executor.submit(lambda: func(item, prepare_future.result()))] = item
+                fill_prefetch()
+                return True
+
+            # 先填满在途窗口
+            for _ in range(self.workers):
+                if not submit_next():
+                    break
+
+            try:
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        item = pending.pop(future)
+                        # 补充一个新请求，保持窗口满载
+                        submit_next()
+                        yield item, future.result()
+            finally:
+                # 异常或提前退出时取消尚未开始的任务
+                for future in pending:
+                    future.cancel()
+                for _, prepare_future in prefetched:
+                    prepare_future.cancel()
+
+
+_END = object()
@@ -5,37 +5,26 @@
 """
 
 import os
-import re
-import json
 import time
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from config import (
-    IMAGE_DIR, OUTPUT_DIR, MAX_QPS, WATERMARK_KEYWORDS
+    IMAGE_DIR, OUTPUT_DIR, MAX_CONCURRENCY, WATERMARK_KEYWORDS
 )
-from api import ocr_pdf
-
-# 输出目录
-PDF_OCR_DIR = os.path.join(OUTPUT_DIR, "pdf_ocr")
-os.makedirs(PDF_OCR_DIR, exist_ok=True)
+from api import ocr_pdf, prepare_ocr_pdf, response_cache
+from ocr_client import OCRClient
+from raw_store import save_raw
+from manifest import page_manifest
+from atomic_io import atomic_open
+from build_graph import BuildGraph
 
 # 输出文件
 OUTPUT_MD = os.path.join(OUTPUT_DIR, "公共营养师三级历年真题_文档解析版.md")
 
 
 def get_all_images():
-    """获取所有页面图片"""
-    pattern = re.compile(r'三级历年真题及解析_(\d+)\.png')
-    images = []
-
-    for filename in os.listdir(IMAGE_DIR):
-        match = pattern.match(filename)
-        if match:
-            page_num = int(match.group(1))
-            images.append((page_num, os.path.join(IMAGE_DIR, filename)))
-
-    return sorted(images, key=lambda x: x[0])
+    """获取所有页面图片（从页面清单查询）"""
+    return [(page_num, os.path.join(IMAGE_DIR, filename)) for page_num, filename in page_manifest.image_files()]
 
 
 def filter_watermark(text):
@@ -48,25 +37,23 @@ def filter_watermark(text):
     return '\n'.join(filtered)
 
 
-def process_page(page_num, image_path):
-    """处理单页"""
-    cache_file = os.path.join(PDF_OCR_DIR, f"page_{page_num}.json")
-
-    # 检查缓存
-    if os.path.exists(cache_file):
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+def prepare_page(page_num, image_path):
+    """预处理单页请求（已缓存的页不需要）"""
+    if page_manifest.is_completed(page_num, "pdf_ocr"):
+        return None
+    return prepare_ocr_pdf(image_path)
 
-    # 调用API
-    result = ocr_pdf(image_path)
 
+def save_page(page_num, result):
+    """过滤水印并保存单页结果（写入页面清单的结果存储）"""
     if result['success']:
         markdown = filter_watermark(result['markdown'])
         data = {
             'page_num': page_num,
             'success': True,
             'markdown': markdown,
-            'has_table': result['has_table']
+            'has_table': result['has_table'],
+            'raw_id': save_raw(result.get('raw_response'))
         }
     else:
         data = {
@@ -77,12 +64,22 @@ def process_page(page_num, image_path):
         }
 
     # 保存缓存
-    with open(cache_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    page_manifest.mark(page_num, "pdf_ocr", "done" if data['success'] else "failed", record=data)
 
     return data
 
 
+def process_page(page_num, image_path, prepared=None):
+    """处理单页"""
+    # 检查缓存
+    cached = page_manifest.record(page_num, "pdf_ocr")
+    if cached is not None:
+        return cached
+
+    # 调用API
+    return save_page(page_num, ocr_pdf(image_path, prepared=prepared))
+
+
 def main():
     print("智能文档解析 - 全量处理")
     print("=" * 50)
@@ -91,7 +88,7 @@ def main():
     print(f"共 {len(images)} 页待处理")
 
     # 检查已处理的页数
-    processed = len([f for f in os.listdir(PDF_OCR_DIR) if f.endswith('.json')])
+    processed = len(page_manifest.completed("pdf_ocr"))
     print(f"已缓存 {processed} 页")
 
     results = []
@@ -100,9 +97,14 @@ def main():
 
     start_time = time.time()
 
-    # 逐页处理（控制QPS）
-    for i, (page_num, image_path) in enumerate(images):
-        result = process_page(page_num, image_path)
+    # 并发处理（QPS由api模块的令牌桶控制）
+    client = OCRClient(MAX_CONCURRENCY)
+    tasks = client.map_unordered(
+        lambda task, prepared: process_page(*task, prepared=prepared),
+        images,
+        prepare=lambda task: prepare_page(*task),
+    )
+    for i, ((page_num, _), result) in enumerate(tasks):
         results.append(result)
 
         if result['success']:
@@ -120,9 +122,6 @@ def main():
                   f"- 成功:{success_count} 失败:{fail_count} "
                   f"- 剩余约 {remaining/60:.1f} 分钟")
 
-        # QPS控制
-        time.sleep(1.0 / MAX_QPS)
-
     elapsed = time.time() - start_time
     print(f"\n处理完成: {success_count} 成功, {fail_count} 失败")
     print(f"耗时: {elapsed/60:.1f} 分钟")
@@ -130,24 +129,32 @@ def main():
     # 按页码排序
     results.sort(key=lambda x: x['page_num'])
 
-    # 生成Markdown
-    print("\n生成Markdown文档...")
-    with open(OUTPUT_MD, 'w', encoding='utf-8') as f:
-        f.write("# 公共营养师三级历年真题及答案解析\n\n")
-        f.write(f"> **生成时间**：{datetime.now().strftime('%Y-%m-%d %H:%M')}  \n")
-        f.write("> **数据来源**：火山引擎智能文档解析  \n\n")
-        f.write("---\n\n")
-
-        for result in results:
-            page_num = result['page_num']
-            f.write(f"<!-- 第 {page_num} 页 -->\n\n")
-
-            if result['success']:
-                f.write(result['markdown'])
-            else:
-                f.write(f"[识别失败: {result.get('error', '未知错误')}]\n")
-
-            f.write("\n\n")
+    # 生成Markdown（各页结果都没变时不重写）
+    def write():
+        print("\n生成Markdown文档...")
+        with atomic_open(OUTPUT_MD) as f:
+            f.write("# 公共营养师三级历年真题及答案解析\n\n")
+            f.write(f"> **生成时间**：{datetime.now().strftime('%Y-%m-%d %H:%M')}  \n")
+            f.write("> **数据来源**：火山引擎智能文档解析  \n\n")
+            f.write("---\n\n")
+
+            for result in results:
+                page_num = result['page_num']
+                f.write(f"<!-- 第 {page_num} 页 -->\n\n")
+
+                if result['success']:
+                    f.write(result['markdown'])
+                else:
+                    f.write(f"[识别失败: {result.get('error', '未知错误')}]\n")
+
+                f.write("\n\n")
+
+    graph = BuildGraph("pdf_ocr_all", sources=[__file__])
+    graph.build("file:markdown", [[r['page_num'], r['success'], r.get('markdown'), r.get('error')] for r in results],
+                write, outputs=[OUTPUT_MD])
+    if not graph.rebuilt:
+        print(f"\n内容没有变化，沿用: {OUTPUT_MD}")
+        return
 
     file_size = os.path.getsize(OUTPUT_MD) / 1024
     print(f"\n已生成: {OUTPUT_MD}")
@@ -155,4 +162,13 @@ def main():
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="智能文档解析 - 全量处理")
+    parser.add_argument("--no-cache", action="store_true", help="绕过OCR响应缓存")
+    args = parser.parse_args()
+
+    if args.no_cache:
+        response_cache.enabled = False
+
     main()
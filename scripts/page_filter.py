@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+OCR前的空白页/重复页检查
+- 墨迹覆盖率低于阈值的页视为空白页，不调用API
+- 感知哈希（dHash）相近、且缩略图高度相关的页视为重复扫描，直接复用先识别的那一页的结果
+
+依赖: pip install pillow numpy
+"""
+
+import io
+import threading
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+
+from config import (
+    PAGE_INK_THRESHOLD, PAGE_BLANK_INK_RATIO, PAGE_HASH_SIZE, PAGE_DUPLICATE_DISTANCE,
+    PAGE_DUPLICATE_CORRELATION
+)
+
+# 计算墨迹覆盖率时忽略的边缘比例（扫描件边缘常有阴影、黑边）
+EDGE_MARGIN = 0.03
+
+# 重复页复核用的缩略图尺寸（约A4比例），以及对齐时搜索的最大偏移（像素）
+THUMB_SIZE = (256, 362)
+THUMB_SHIFT = 1
+
+
+def available() -> bool:
+    """是否安装了 pillow 和 numpy"""
+    return np is not None
+
+
+def page_signature(image_path: str = None, image_data: bytes = None) -> tuple:
+    """
+    计算页面特征
+
+    Returns:
+        (墨迹覆盖率, dHash, 缩略图)
+        dHash 为 PAGE_HASH_SIZE*PAGE_HASH_SIZE 位，按位打包成 uint8 数组
+        缩略图为 THUMB_SIZE 的灰度数组，用于复核哈希相近的页
+    """
+    img = Image.open(io.BytesIO(image_data) if image_data is not None else image_path)
+    gray = img.convert("L")
+
+    pixels = np.asarray(gray)
+    h, w = pixels.shape
+    dy, dx = int(h * EDGE_MARGIN), int(w * EDGE_MARGIN)
+    body = pixels[dy:h - dy, dx:w - dx]
+    ink_ratio = float(np.count_nonzero(body < PAGE_INK_THRESHOLD)) / max(1, body.size)
+
+    # dHash：缩小到 (n+1) x n，比较水平相邻像素的明暗
+    n = PAGE_HASH_SIZE
+    small = np.asarray(gray.resize((n + 1, n), Image.BOX), dtype=np.int16)
+    bits = small[:, 1:] > small[:, :-1]
+    thumb = np.asarray(gray.resize(THUMB_SIZE, Image.BOX))
+    return ink_ratio, np.packbits(bits.ravel()), thumb
+
+
+def thumb_correlation(a, b) -> float:
+    """
+    两张缩略图的归一化互相关系数（1为完全相同）
+    在 ±THUMB_SHIFT 像素内平移对齐，容忍重新编码、轻微错位
+    """
+    a = a.astype(np.float32)
+    a -= a.mean()
+    a_norm = np.sqrt((a * a).sum())
+    best = -1.0
+    for dy in range(-THUMB_SHIFT, THUMB_SHIFT + 1):
+        for dx in range(-THUMB_SHIFT, THUMB_SHIFT + 1):
+            shifted = np.roll(b, (dy, dx), axis=(0, 1)).astype(np.float32)
+            shifted -= shifted.mean()
+            norm = a_norm * np.sqrt((shifted * shifted).sum())
+            if norm:
+                best = max(best, float((a * shifted).sum() / norm))
+    return best
+
+
+class PageSkip:
+    """
+    预检查判定不需要调用API的页
+    reason: "blank" 空白页 / "duplicate" 重复页
+    """
+    __slots__ = ("reason", "ink_ratio", "duplicate_of", "correlation")
+
+    def __init__(self, reason: str, ink_ratio: float, duplicate_of: int = None, correlation: float = None):
+        self.reason = reason
+        self.ink_ratio = ink_ratio
+        self.duplicate_of = duplicate_of
+        self.correlation = correlation
+
+
+class PageFilter:
+    """
+    空白页/重复页过滤（线程安全）
+
+    check() 在预处理线程中调用；先到达的页作为原件登记。
+    之后哈希距离不超过 max_distance、且缩略图相关系数不低于 min_correlation 的页判为重复，
+    等待原件识别完成后复用其结果
+    """
+
+    def __init__(self, blank_ratio: float = PAGE_BLANK_INK_RATIO,
+                 max_distance: int = PAGE_DUPLICATE_DISTANCE,
+                 min_correlation: float = PAGE_DUPLICATE_CORRELATION):
+        self.blank_ratio = blank_ratio
+        self.max_distance = max_distance
+        self.min_correlation = min_correlation
+        self._lock = threading.Lock()
+        self._hashes = np.zeros((0, (PAGE_HASH_SIZE * PAGE_HASH_SIZE + 7) // 8), dtype=np.uint8)
+        self._pages = []
+        self._thumbs = []
+        self._results = {}
+        self._events = {}
+
+    def check(self, page_num: int, image_path: str = None, image_data: bytes = None) -> PageSkip:
+        """检查一页，需要正常识别时返回None"""
+        ink_ratio, dhash, thumb = page_signature(image_path, image_data)
+        if ink_ratio < self.blank_ratio:
+            return PageSkip("blank", ink_ratio)
+
+        with self._lock:
+            if self._pages:
+                # 与所有已登记页的汉明距离（向量化）；同一本书的文字页缩小后很相似，
+                # 哈希相近的再比对缩略图，避免版式相同、内容不同的页被误判
+                distances = np.unpackbits(self._hashes ^ dhash, axis=1).sum(axis=1)
+                for i in np.flatnonzero(distances <= self.max_distance):
+                    correlation = thumb_correlation(self._thumbs[i], thumb)
+                    if correlation >= self.min_correlation:
+                        return PageSkip("duplicate", ink_ratio, self._pages[i], correlation)
+
+            self._hashes = np.vstack([self._hashes, dhash])
+            self._pages.append(page_num)
+            self._thumbs.append(thumb)
+            self._events[page_num] = threading.Event()
+        return None
+
+    def publish(self, page_num: int, result: dict):
+        """原件识别完成后登记结果，唤醒等待它的重复页"""
+        event = self._events.get(page_num)
+        if event is not None:
+            self._results[page_num] = result
+            event.set()
+
+    def wait_result(self, page_num: int, timeout: float) -> dict:
+        """等待原件的识别结果，超时或原件识别失败时返回None"""
+        event = self._events.get(page_num)
+        if event is None or not event.wait(timeout):
+            return None
+        result = self._results.get(page_num)
+        return result if result and result.get("success") else None
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+最终JSON的页面索引
+Phase 5 写 questions_final.json 时同时写 questions_final.index.json：
+每页在JSON文件中的字节偏移、长度和内容哈希，以及考试结构、验证警告和元数据。
+读取方只解析索引，页面内容按需从JSON文件中切出来解析，渲染一套考试不必解析整本书
+
+    with PageIndex(FINAL_OUTPUT_FILE) as pages:
+        for exam in pages.exams:
+            page = pages.get(exam["start_page"], {})
+
+- 索引登记JSON文件的大小和内容哈希（atomic_io），两者不一致时索引作废，退回整体读取
+- 每页读取时校验内容哈希
+- 只读打开、按偏移读取，多个进程可以各自打开同一个文件并行渲染
+"""
+
+import hashlib
+import mmap
+import os
+
+from atomic_io import atomic_open, read_json, checksum, ChecksumError
+from records import dumps, loads
+
+
+def index_path(json_path: str) -> str:
+    """questions_final.json -> questions_final.index.json"""
+    root, _ = os.path.splitext(json_path)
+    return root + ".index.json"
+
+
+def write_index(json_path: str, entries: list, header: dict):
+    """
+    写页面索引（JSON文件完成改名之后调用）
+
+    Args:
+        entries: [[页码, 字节偏移, 字节长度, sha256], ...]
+        header: 最终JSON中除 pages 以外的部分
+    """
+    index = dict(header)
+    index["json_size"] = os.path.getsize(json_path)
+    index["json_sha256"] = checksum(json_path)
+    index["pages"] = entries
+    with atomic_open(index_path(json_path), 'wb') as f:
+        f.write(dumps(index))
+
+
+class PageIndex:
+    """
+    按页码随机读取最终JSON中的页面
+
+    没有索引（旧版本生成的文件）或索引与JSON文件不一致时整体读取JSON，接口不变
+    """
+
+    def __init__(self, json_path: str):
+        self.json_path = json_path
+        self._file = None
+        self._map = None
+        self._pages = None  # 整体读取时的 {页码: 页面}
+        self._entries = {}
+
+        index = self._load_index()
+        if index is None:
+            print(f"没有可用的页面索引，整体读取（重新运行 Phase 5 生成索引）: {json_path}")
+            data = read_json(json_path)
+            self._pages = {p['page_num']: p for p in data['pages']}
+            self.exams = data['exams']
+            self.validation_warnings = data.get('validation_warnings', [])
+            self.metadata = data.get('metadata', {})
+            return
+
+        self.exams = index['exams']
+        self.validation_warnings = index.get('validation_warnings', [])
+        self.metadata = index.get('metadata', {})
+        self._entries = {page_num: (offset, length, sha256) for page_num, offset, length, sha256 in index['pages']}
+
+    def _load_index(self):
+        path = index_path(self.json_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            index = read_json(path)
+        except ValueError:
+            return None
+        expected = checksum(self.json_path)
+        if index.get("json_size") != os.path.getsize(self.json_path) or \
+                (expected is not None and index.get("json_sha256") != expected):
+            return None
+        return index
+
+    def __len__(self):
+        return len(self._pages) if self._pages is not None else len(self._entries)
+
+    def __contains__(self, page_num):
+        return page_num in (self._pages if self._pages is not None else self._entries)
+
+    def page_nums(self) -> list:
+        return sorted(self._pages if self._pages is not None else self._entries)
+
+    def page_hash(self, page_num: int) -> str:
+        """页面内容的哈希（作为增量构建的输入，不需要解析页面），没有该页时返回None"""
+        if self._pages is not None:
+            page = self._pages.get(page_num)
+            if page is None:
+                return None
+            return hashlib.sha256(dumps(page, sort_keys=True)).hexdigest()
+        entry = self._entries.get(page_num)
+        return entry[2] if entry else None
+
+    def get(self, page_num: int, default=None) -> dict:
+        """读取并解析一页，没有该页时返回 default"""
+        if self._pages is not None:
+            return self._pages.get(page_num, default)
+        entry = self._entries.get(page_num)
+        if entry is None:
+            return default
+        offset, length, sha256 = entry
+        if self._map is None:
+            self._file = open(self.json_path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._map[offset:offset + length]
+        if hashlib.sha256(data).hexdigest() != sha256:
+            raise ChecksumError(f"页 {page_num} 的内容与索引不一致，请重新运行 Phase 5: {self.json_path}")
+        return loads(data)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -6,31 +6,28 @@ Phase 1: 批量通用OCR识别
 
 import json
 import os
-import re
 import time
+from collections import deque
 from datetime import datetime
 
 from config import (
-    IMAGE_DIR, RAW_OCR_DIR, REPORTS_DIR,
-    REQUEST_INTERVAL, WATERMARK_KEYWORDS
+    IMAGE_DIR, REPORTS_DIR,
+    MAX_QPS, MAX_CONCURRENCY, WATERMARK_KEYWORDS, PAGE_SKIP_ENABLED, REQUEST_TIMEOUT
 )
-from api import ocr_normal
+from api import (
+    ocr_normal, prepare_ocr_normal, response_cache,
+    get_transport_stats, get_cache_stats, get_rate_stats, get_retry_stats, get_hedge_stats
+)
+from ocr_client import OCRClient
+from raw_store import save_raw
+from manifest import page_manifest, needs_run, format_job_states
+from atomic_io import atomic_open
+from page_filter import PageFilter, PageSkip, available as page_filter_available
 
 
 def get_image_files():
     """获取所有图片文件，按页码排序"""
-    files = []
-    pattern = re.compile(r'三级历年真题及解析_(\d+)\.png')
-
-    for filename in os.listdir(IMAGE_DIR):
-        match = pattern.match(filename)
-        if match:
-            page_num = int(match.group(1))
-            files.append((page_num, filename))
-
-    # 按页码排序
-    files.sort(key=lambda x: x[0])
-    return files
+    return page_manifest.image_files()
 
 
 def filter_watermark(lines: list) -> list:
@@ -44,12 +41,73 @@ def filter_watermark(lines: list) -> list:
     return filtered
 
 
-def process_single_image(page_num: int, filename: str) -> dict:
+def prepare_single_image(page_num: int, filename: str, image_data: bytes = None,
+                         page_filter: PageFilter = None):
+    """
+    预处理单张图片的请求（读图、编码、哈希），在网络等待期间提前执行
+    image_data 为Phase 0渲染出的页面数据时不读图片文件
+    指定 page_filter 时先检查空白页/重复页，需要跳过时返回 PageSkip
+    """
+    if page_filter is not None:
+        image_path = None if image_data is not None else os.path.join(IMAGE_DIR, filename)
+        skip = page_filter.check(page_num, image_path, image_data)
+        if skip is not None:
+            return skip
+    if image_data is not None:
+        return prepare_ocr_normal(image_data=image_data)
+    return prepare_ocr_normal(os.path.join(IMAGE_DIR, filename))
+
+
+def skipped_page_result(page_num: int, filename: str, skip: PageSkip, page_filter: PageFilter) -> dict:
+    """
+    跳过的页直接生成结果：空白页为空文本，重复页复制原件的结果
+    原件识别失败时返回None，由调用方照常识别
+    """
+    if skip.reason == "blank":
+        return {
+            "page_num": page_num,
+            "filename": filename,
+            "success": True,
+            "timestamp": datetime.now().isoformat(),
+            "skipped": "blank",
+            "ink_ratio": skip.ink_ratio,
+            "raw_line_count": 0,
+            "filtered_line_count": 0,
+            "line_texts": [],
+            "line_probs": [],
+            "raw_id": None,
+        }
+
+    original = page_filter.wait_result(skip.duplicate_of, REQUEST_TIMEOUT * 2)
+    if original is None:
+        return None
+    output = dict(original)
+    output.update({
+        "page_num": page_num,
+        "filename": filename,
+        "timestamp": datetime.now().isoformat(),
+        "skipped": "duplicate",
+        "duplicate_of": skip.duplicate_of,
+        "correlation": round(skip.correlation, 4),
+    })
+    output.pop("image_stats", None)
+    return output
+
+
+def process_single_image(page_num: int, filename: str, prepared=None,
+                         page_filter: PageFilter = None, image_data: bytes = None) -> dict:
     """处理单张图片"""
     image_path = os.path.join(IMAGE_DIR, filename)
 
+    if isinstance(prepared, PageSkip):
+        output = skipped_page_result(page_num, filename, prepared, page_filter)
+        if output is not None:
+            return output
+        # 重复页的原件没有可用结果，改为自己识别
+        prepared = prepare_single_image(page_num, filename, image_data)
+
     # 调用OCR
-    result = ocr_normal(image_path)
+    result = ocr_normal(image_path, prepared=prepared)
 
     # 构建输出
     output = {
@@ -59,6 +117,10 @@ def process_single_image(page_num: int, filename: str) -> dict:
         "timestamp": datetime.now().isoformat(),
     }
 
+    # 图片优化统计（启用 IMAGE_OPTIMIZE 时）
+    if prepared is not None and prepared.image_stats:
+        output["image_stats"] = prepared.image_stats
+
     if result["success"]:
         # 过滤水印
         raw_lines = result["line_texts"]
@@ -67,16 +129,95 @@ def process_single_image(page_num: int, filename: str) -> dict:
         output["raw_line_count"] = len(raw_lines)
         output["filtered_line_count"] = len(filtered_lines)
         output["line_texts"] = filtered_lines
-        output["line_texts_raw"] = raw_lines  # 保留原始数据用于验证
         output["line_probs"] = result["line_probs"]
     else:
         output["error"] = result.get("error", "未知错误")
         output["line_texts"] = []
 
+    # 原始响应（含过滤前的文本行）存到旁路存储，用于验证时按 raw_id 读取
+    output["raw_id"] = save_raw(result.get("raw_response"))
+
+    if page_filter is not None:
+        page_filter.publish(page_num, output)
     return output
 
 
-def run_batch_ocr(start_page: int = None, end_page: int = None, dry_run: bool = False):
+def select_pages(pages: list, retry_failed: bool = False, only_stale: bool = False) -> list:
+    """
+    按任务状态筛选需要识别的页（支持断点续传）
+    默认只处理未处理、中断（进程崩溃后租约过期）和图片已更新的页，失败的页需要 retry_failed
+    """
+    states = page_manifest.job_states("ocr", [page_num for page_num, _ in pages])
+    selected = [(p, f) for p, f in pages if needs_run(states[p], retry_failed, only_stale)]
+    if len(selected) < len(pages):
+        print(f"任务状态: {format_job_states(states)}")
+        if not retry_failed and "failed" in states.values():
+            print("  失败的页可用 --retry-failed 重新识别")
+    return selected
+
+
+def save_page_result(page_num: int, result: dict):
+    """保存单页识别结果（写入页面清单的结果存储，释放任务租约）"""
+    page_manifest.mark(page_num, "ocr", "done" if result["success"] else "failed", record=result,
+                       error=result.get("error"))
+
+
+def ocr_pages(client: OCRClient, files_to_process: list, pdf_path: str = None,
+              raster_options: dict = None, skip_pages: bool = PAGE_SKIP_ENABLED):
+    """
+    并发识别页面，结果一完成就保存
+    skip_pages 为True时空白页、重复页不调用API（结果中 skipped 字段标明原因）
+
+    每页在预处理前领取任务租约，其他进程正在处理的页不识别，结果为None
+
+    Yields:
+        (页码, 文件名, 结果)，按完成顺序
+    """
+    filenames = dict(files_to_process)
+    leased = deque()
+
+    def claim(page_num: int) -> bool:
+        if page_manifest.claim(page_num, "ocr"):
+            return True
+        leased.append(page_num)
+        return False
+
+    def leased_pages():
+        while leased:
+            page_num = leased.popleft()
+            yield page_num, filenames[page_num], None
+
+    if pdf_path:
+        # 边渲染边上传：渲染进程产出的页面直接进入预处理队列
+        # 提交渲染前领取租约，其他进程正在处理的页不渲染
+        from rasterize import rasterize_pages
+        claimed = (page_num for page_num in filenames if claim(page_num))
+        items = ((page_num, filenames[page_num], data)
+                 for page_num, data in rasterize_pages(pdf_path, claimed, **(raster_options or {})))
+    else:
+        items = ((page_num, filename, None) for page_num, filename in files_to_process if claim(page_num))
+
+    page_filter = None
+    if skip_pages:
+        if page_filter_available():
+            page_filter = PageFilter()
+        else:
+            print("未安装 pillow/numpy，不检查空白页/重复页")
+    tasks = client.map_unordered(
+        lambda task, prepared: process_single_image(*task[:2], prepared, page_filter, task[2]),
+        items,
+        prepare=lambda task: prepare_single_image(*task, page_filter=page_filter),
+    )
+    for (page_num, filename, _), result in tasks:
+        save_page_result(page_num, result)
+        yield page_num, filename, result
+        yield from leased_pages()
+    yield from leased_pages()
+
+
+def run_batch_ocr(start_page: int = None, end_page: int = None, dry_run: bool = False,
+                  pdf_path: str = None, raster_options: dict = None, skip_pages: bool = PAGE_SKIP_ENABLED,
+                  retry_failed: bool = False, only_stale: bool = False):
     """
     批量OCR处理
 
@@ -84,10 +225,20 @@ def run_batch_ocr(start_page: int = None, end_page: int = None, dry_run: bool =
         start_page: 起始页码（包含），None表示从头开始
         end_page: 结束页码（包含），None表示到最后
         dry_run: 仅显示计划，不实际执行
+        pdf_path: 指定时直接从PDF多进程渲染页面（Phase 0），页面数据不经过磁盘直接上传
+        raster_options: 渲染参数（dpi / colorspace / workers / save_images），默认取配置
+        skip_pages: 空白页、重复页不调用API
+        retry_failed: 重新识别上次失败的页
+        only_stale: 只重新识别图片已更新的页
     """
     # 获取文件列表
-    all_files = get_image_files()
-    print(f"共找到 {len(all_files)} 个图片文件")
+    if pdf_path:
+        from rasterize import page_count, image_filename
+        all_files = [(p, image_filename(p)) for p in range(1, page_count(pdf_path) + 1)]
+        print(f"PDF共 {len(all_files)} 页")
+    else:
+        all_files = get_image_files()
+        print(f"共找到 {len(all_files)} 个图片文件")
 
     # 筛选范围
     files_to_process = []
@@ -108,60 +259,57 @@ def run_batch_ocr(start_page: int = None, end_page: int = None, dry_run: bool =
             print(f"  ... 还有 {len(files_to_process) - 10} 个文件")
         return
 
-    # 检查已处理的文件（支持断点续传）
-    processed_pages = set()
-    for f in os.listdir(RAW_OCR_DIR):
-        if f.startswith("page_") and f.endswith(".json"):
-            try:
-                page_num = int(f[5:-5])
-                processed_pages.add(page_num)
-            except ValueError:
-                pass
-
-    # 过滤掉已处理的
-    files_to_process = [(p, f) for p, f in files_to_process if p not in processed_pages]
-    if processed_pages:
-        print(f"跳过已处理的 {len(processed_pages)} 个文件")
+    # 按任务状态过滤（支持断点续传）
+    files_to_process = select_pages(files_to_process, retry_failed, only_stale)
     print(f"实际需要处理 {len(files_to_process)} 个文件")
 
     if not files_to_process:
         print("没有需要处理的文件")
         return
 
-    # 开始处理
+    # 开始处理（并发请求，QPS由api模块的令牌桶控制）
     success_count = 0
     fail_count = 0
     start_time = time.time()
+    total = len(files_to_process)
+    image_stats = []
+    skipped_pages = []
+    client = OCRClient(MAX_CONCURRENCY)
+    print(f"并发数: {client.max_in_flight}, 预读: {client.prefetch} 页, QPS上限: {MAX_QPS}")
+
+    tasks = ocr_pages(client, files_to_process, pdf_path, raster_options, skip_pages)
+    for i, (page_num, filename, result) in enumerate(tasks, 1):
+        if result is None:
+            print(f"{filename} -> 其他进程处理中，跳过")
+            continue
+        if result.get("image_stats"):
+            image_stats.append({
+                "page_num": page_num,
+                "original_bytes": result["image_stats"]["original_bytes"],
+                "optimized_bytes": result["image_stats"]["optimized_bytes"],
+            })
 
-    for i, (page_num, filename) in enumerate(files_to_process):
         # 进度显示
-        progress = (i + 1) / len(files_to_process) * 100
+        progress = i / total * 100
         elapsed = time.time() - start_time
-        if i > 0:
-            eta = elapsed / i * (len(files_to_process) - i)
-            eta_str = f"{eta/60:.1f}分钟"
-        else:
-            eta_str = "计算中..."
-
-        print(f"[{progress:5.1f}%] 处理 {filename} (剩余时间: {eta_str})", end="", flush=True)
-
-        # 处理
-        result = process_single_image(page_num, filename)
-
-        # 保存结果
-        output_file = os.path.join(RAW_OCR_DIR, f"page_{page_num:03d}.json")
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
-
-        if result["success"]:
+        eta = elapsed / i * (total - i)
+        if result.get("skipped"):
+            skipped_pages.append({
+                "page_num": page_num,
+                "reason": result["skipped"],
+                "duplicate_of": result.get("duplicate_of"),
+                "ink_ratio": result.get("ink_ratio"),
+                "correlation": result.get("correlation"),
+            })
+            success_count += 1
+            status = "空白页，跳过" if result["skipped"] == "blank" else f"与页 {result['duplicate_of']} 重复，复用结果"
+        elif result["success"]:
             success_count += 1
-            print(f" -> 成功 ({result['filtered_line_count']}行)")
+            status = f"成功 ({result['filtered_line_count']}行)"
         else:
             fail_count += 1
-            print(f" -> 失败: {result.get('error', '未知')}")
-
-        # QPS控制
-        time.sleep(REQUEST_INTERVAL)
+            status = f"失败: {result.get('error', '未知')}"
+        print(f"[{progress:5.1f}%] {filename} -> {status} (剩余时间: {eta/60:.1f}分钟)")
 
     # 统计
     total_time = time.time() - start_time
@@ -171,6 +319,32 @@ def run_batch_ocr(start_page: int = None, end_page: int = None, dry_run: bool =
     print(f"  失败: {fail_count}")
     print(f"  总耗时: {total_time/60:.1f} 分钟")
     print(f"  平均: {total_time/len(files_to_process):.2f} 秒/张")
+    print(f"  吞吐: {len(files_to_process)/total_time:.2f} 张/秒")
+    if skipped_pages:
+        blank_count = sum(1 for s in skipped_pages if s["reason"] == "blank")
+        print(f"  跳过: 空白页 {blank_count} 张, 重复页 {len(skipped_pages) - blank_count} 张")
+    transport_stats = get_transport_stats()
+    print(f"  连接复用: {transport_stats['reused_connections']}/{transport_stats['requests']} "
+          f"({transport_stats['reuse_ratio']:.0%}, {transport_stats['protocol']})")
+    print(f"  上传: {transport_stats['upload_bytes']/1024/1024:.1f} MB")
+    rate_stats = get_rate_stats()
+    if rate_stats["enabled"]:
+        print(f"  自适应限流: 最终QPS {rate_stats['qps']:.1f}, 在途数 {rate_stats['in_flight_limit']}, "
+              f"调整 {rate_stats['decision_count']} 次")
+    retry_stats = get_retry_stats()
+    print(f"  重试: {retry_stats['retries']} 次 (预算拒绝 {retry_stats['retries_denied']} 次, "
+          f"熔断 {retry_stats['circuit_open_count']} 次)")
+    hedge_stats = get_hedge_stats()
+    if hedge_stats["enabled"]:
+        print(f"  对冲请求: {hedge_stats['hedged']} 次 (副本胜出 {hedge_stats['hedge_wins']} 次)")
+    cache_stats = get_cache_stats()
+    if cache_stats["enabled"]:
+        print(f"  缓存命中: {cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']}")
+    if image_stats:
+        original_total = sum(s["original_bytes"] for s in image_stats)
+        optimized_total = sum(s["optimized_bytes"] for s in image_stats)
+        print(f"  图片优化: {original_total/1024/1024:.1f} MB -> {optimized_total/1024/1024:.1f} MB "
+              f"({optimized_total/original_total:.0%})")
 
     # 保存报告
     report = {
@@ -180,12 +354,26 @@ def run_batch_ocr(start_page: int = None, end_page: int = None, dry_run: bool =
         "success_count": success_count,
         "fail_count": fail_count,
         "total_time_seconds": total_time,
+        "max_concurrency": client.max_in_flight,
+        "max_qps": MAX_QPS,
+        "transport": transport_stats,
+        "cache": cache_stats,
+        "rate_control": rate_stats,
+        "retry": retry_stats,
+        "hedge": hedge_stats,
+        "jobs": page_manifest.job_summary("ocr"),
+        "skipped_pages": sorted(skipped_pages, key=lambda s: s["page_num"]),
+        "image_optimization": {
+            "original_bytes": sum(s["original_bytes"] for s in image_stats),
+            "optimized_bytes": sum(s["optimized_bytes"] for s in image_stats),
+            "pages": sorted(image_stats, key=lambda s: s["page_num"]),
+        } if image_stats else None,
         "start_page": files_to_process[0][0] if files_to_process else None,
         "end_page": files_to_process[-1][0] if files_to_process else None,
     }
 
     report_file = os.path.join(REPORTS_DIR, f"phase1_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
-    with open(report_file, 'w', encoding='utf-8') as f:
+    with atomic_open(report_file, checksum=False) as f:
         json.dump(report, f, ensure_ascii=False, indent=2)
     print(f"报告已保存: {report_file}")
 
@@ -197,11 +385,23 @@ if __name__ == "__main__":
     parser.add_argument("--start", type=int, help="起始页码")
     parser.add_argument("--end", type=int, help="结束页码")
     parser.add_argument("--dry-run", action="store_true", help="仅显示计划")
+    parser.add_argument("--no-cache", action="store_true", help="绕过OCR响应缓存")
+    parser.add_argument("--pdf", help="直接从PDF渲染页面（不需要预先转换图片）")
+    parser.add_argument("--no-skip", action="store_true", help="不跳过空白页/重复页")
+    parser.add_argument("--retry-failed", action="store_true", help="重新识别上次失败的页")
+    parser.add_argument("--only-stale", action="store_true", help="只重新识别图片已更新的页")
 
     args = parser.parse_args()
 
+    if args.no_cache:
+        response_cache.enabled = False
+
     run_batch_ocr(
         start_page=args.start,
         end_page=args.end,
-        dry_run=args.dry_run
+        dry_run=args.dry_run,
+        pdf_path=args.pdf,
+        skip_pages=PAGE_SKIP_ENABLED and not args.no_skip,
+        retry_failed=args.retry_failed,
+        only_stale=args.only_stale
     )
@@ -10,10 +10,13 @@ import time
 from datetime import datetime
 
 from config import (
-    IMAGE_DIR, TABLE_OCR_DIR, PROCESSED_DIR, REPORTS_DIR,
-    REQUEST_INTERVAL
+    TABLE_OCR_DIR, PROCESSED_DIR, REPORTS_DIR, SOURCE_PDF
 )
-from api import ocr_pdf
+from api import ocr_pdf, response_cache
+from raw_store import save_raw
+from manifest import page_manifest, needs_run, format_job_states
+from atomic_io import atomic_open, read_json
+from records import TableGroup, dumps_str
 
 
 def load_table_detection():
@@ -24,24 +27,17 @@ def load_table_detection():
         print("请先运行 Phase 2: python phase2_detect_tables.py")
         return None
 
-    with open(detection_file, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    try:
+        return read_json(detection_file)
+    except ValueError as e:
+        print(f"错误: {e}")
+        print("请重新运行 Phase 2: python phase2_detect_tables.py")
+        return None
 
 
 def get_image_path(page_num: int) -> str:
-    """获取页码对应的图片路径"""
-    filename = f"三级历年真题及解析_{page_num:02d}.png"
-    path = os.path.join(IMAGE_DIR, filename)
-    if os.path.exists(path):
-        return path
-
-    # 尝试不带前导零的格式
-    filename = f"三级历年真题及解析_{page_num}.png"
-    path = os.path.join(IMAGE_DIR, filename)
-    if os.path.exists(path):
-        return path
-
-    return None
+    """获取页码对应的图片路径（从页面清单查询）"""
+    return page_manifest.image_path(page_num)
 
 
 def process_table_group(group: list) -> dict:
@@ -57,14 +53,14 @@ def process_table_group(group: list) -> dict:
             "success": bool,
             "markdown_parts": [md1, md2],  # 每页的markdown
             "merged_markdown": str,  # 合并后的markdown
-            "raw_responses": [...]
+            "raw_ids": [...]  # 原始响应在旁路存储中的ID
         }
     """
     result = {
         "pages": group,
         "success": True,
         "markdown_parts": [],
-        "raw_responses": [],
+        "raw_ids": [],
         "errors": [],
     }
 
@@ -81,15 +77,12 @@ def process_table_group(group: list) -> dict:
 
         if ocr_result["success"]:
             result["markdown_parts"].append(ocr_result["markdown"])
-            result["raw_responses"].append(ocr_result["raw_response"])
+            result["raw_ids"].append(save_raw(ocr_result["raw_response"]))
         else:
             result["success"] = False
             result["errors"].append(f"页 {page_num}: {ocr_result.get('error', '未知错误')}")
             result["markdown_parts"].append("")
-            result["raw_responses"].append(ocr_result.get("raw_response"))
-
-        # QPS控制
-        time.sleep(REQUEST_INTERVAL)
+            result["raw_ids"].append(save_raw(ocr_result.get("raw_response")))
 
     # 合并markdown（对于跨页表格）
     result["merged_markdown"] = "\n\n".join(filter(None, result["markdown_parts"]))
@@ -97,8 +90,81 @@ def process_table_group(group: list) -> dict:
     return result
 
 
-def run_table_parsing():
-    """执行表格页解析"""
+def group_job_state(group_id: str, group: list) -> str:
+    """
+    表格组的任务状态（以组首页为键登记在页面清单的 table 阶段）
+    分组变化（页码不同）时视为未处理；旧版本留下的结果文件第一次遇到时导入
+    """
+    key = group[0]
+    state = page_manifest.job_states("table", [key])[key]
+    if state == "new":
+        output_file = os.path.join(TABLE_OCR_DIR, f"{group_id}.json")
+        if os.path.exists(output_file):
+            try:
+                result = read_json(output_file)
+            except ValueError:
+                # 写入时中断的文件，重新解析
+                return state
+            if result.get("pages") == group:
+                page_manifest.mark(key, "table", "done" if result["success"] else "failed", record=result,
+                                   error="; ".join(result.get("errors", [])) or None)
+                return "done" if result["success"] else "failed"
+        return state
+
+    record = page_manifest.record(key, "table")
+    if state in ("done", "failed", "stale") and (record is None or record.get("pages") != group):
+        return "new"
+    return state
+
+
+def load_group_result(group: list) -> dict:
+    """读取已登记的表格组结果"""
+    return page_manifest.record(group[0], "table")
+
+
+def parse_group(group_id: str, group: list, pdf_path: str = None, raster_options: dict = None) -> dict:
+    """
+    领取任务并解析一组表格页，保存结果
+    其他进程正在处理该组时返回None
+    指定 pdf_path 时，没有图片文件的页先从PDF渲染（Phase 1 边渲染边识别时不必保存整本书的图片）
+    """
+    if not page_manifest.claim(group[0], "table"):
+        return None
+    if pdf_path:
+        from rasterize import render_images
+        render_images(pdf_path, group, raster_options)
+    result = process_table_group(group)
+    result["group_id"] = group_id
+    result["timestamp"] = datetime.now().isoformat()
+    save_group_result(group_id, result)
+    return result
+
+
+def save_group_result(group_id: str, result: dict):
+    """保存表格组结果（JSON + Markdown），再登记到页面清单并释放任务租约"""
+    output_file = os.path.join(TABLE_OCR_DIR, f"{group_id}.json")
+    with atomic_open(output_file) as f:
+        f.write(dumps_str(TableGroup.check(result)))
+
+    # 同时保存markdown文件
+    md_file = os.path.join(TABLE_OCR_DIR, f"{group_id}.md")
+    with atomic_open(md_file) as f:
+        f.write(f"<!-- 表格组 {group_id}, 页码: {result['pages']} -->\n\n")
+        f.write(result["merged_markdown"])
+
+    page_manifest.mark(result["pages"][0], "table", "done" if result["success"] else "failed", record=result,
+                       error="; ".join(result["errors"]) or None)
+
+
+def run_table_parsing(retry_failed: bool = False, pdf_path: str = None, raster_options: dict = None):
+    """
+    执行表格页解析
+
+    Args:
+        retry_failed: 重新解析上次失败的组
+        pdf_path: 扫描版PDF，缺少图片文件的表格页从这里按需渲染
+        raster_options: 渲染参数（dpi / colorspace），默认取配置
+    """
     print("Phase 3-4: 智能文档解析（表格页）")
     print("=" * 50)
 
@@ -116,11 +182,9 @@ def run_table_parsing():
     for i, group in enumerate(table_groups):
         print(f"  组{i+1}: 页 {group}")
 
-    # 检查已处理的
-    processed_groups = set()
-    for f in os.listdir(TABLE_OCR_DIR):
-        if f.startswith("table_group_") and f.endswith(".json"):
-            processed_groups.add(f)
+    # 按任务状态决定是否处理（失败的组需要 retry_failed）
+    states = {i: group_job_state(f"table_group_{i+1:03d}", group) for i, group in enumerate(table_groups)}
+    print(f"任务状态: {format_job_states(states)}")
 
     # 开始处理
     results = []
@@ -130,31 +194,23 @@ def run_table_parsing():
 
     for i, group in enumerate(table_groups):
         group_id = f"table_group_{i+1:03d}"
-        output_file = os.path.join(TABLE_OCR_DIR, f"{group_id}.json")
 
         # 检查是否已处理
-        if os.path.exists(output_file):
+        if not needs_run(states[i], retry_failed):
+            if states[i] == "leased":
+                print(f"[{i+1}/{len(table_groups)}] 组 {group} 其他进程处理中，跳过")
+                continue
             print(f"[{i+1}/{len(table_groups)}] 组 {group} 已处理，跳过")
-            with open(output_file, 'r', encoding='utf-8') as f:
-                results.append(json.load(f))
+            results.append(load_group_result(group))
             continue
 
         print(f"[{i+1}/{len(table_groups)}] 处理组 {group}...", end="", flush=True)
 
-        # 处理
-        result = process_table_group(group)
-        result["group_id"] = group_id
-        result["timestamp"] = datetime.now().isoformat()
-
-        # 保存结果
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
-
-        # 同时保存markdown文件
-        md_file = os.path.join(TABLE_OCR_DIR, f"{group_id}.md")
-        with open(md_file, 'w', encoding='utf-8') as f:
-            f.write(f"<!-- 表格组 {group_id}, 页码: {group} -->\n\n")
-            f.write(result["merged_markdown"])
+        # 处理并保存结果
+        result = parse_group(group_id, group, pdf_path, raster_options)
+        if result is None:
+            print(" -> 其他进程处理中，跳过")
+            continue
 
         results.append(result)
 
@@ -192,13 +248,13 @@ def run_table_parsing():
     }
 
     summary_file = os.path.join(PROCESSED_DIR, "table_parsing_summary.json")
-    with open(summary_file, 'w', encoding='utf-8') as f:
+    with atomic_open(summary_file) as f:
         json.dump(summary, f, ensure_ascii=False, indent=2)
     print(f"\n汇总已保存: {summary_file}")
 
     # 保存报告
     report_file = os.path.join(REPORTS_DIR, f"phase3_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
-    with open(report_file, 'w', encoding='utf-8') as f:
+    with atomic_open(report_file, checksum=False) as f:
         json.dump(summary, f, ensure_ascii=False, indent=2)
     print(f"报告已保存: {report_file}")
 
@@ -206,4 +262,15 @@ def run_table_parsing():
 
 
 if __name__ == "__main__":
-    run_table_parsing()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Phase 3-4: 智能文档解析（表格页）")
+    parser.add_argument("--no-cache", action="store_true", help="绕过OCR响应缓存")
+    parser.add_argument("--retry-failed", action="store_true", help="重新解析上次失败的组")
+    parser.add_argument("--pdf", type=str, default=SOURCE_PDF, help="扫描版PDF路径，缺少图片的表格页按需渲染")
+    args = parser.parse_args()
+
+    if args.no_cache:
+        response_cache.enabled = False
+
+    run_table_parsing(retry_failed=args.retry_failed, pdf_path=args.pdf)
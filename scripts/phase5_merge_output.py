@@ -3,34 +3,27 @@
 Phase 5-6: 交叉验证与合并输出
 - 合并通用OCR和智能文档解析的结果
 - 对表格页进行交叉验证
-- 生成最终的结构化输出
+- 生成最终的结构化输出（逐页流式写出，内存占用与页数无关）
 """
 
+import hashlib
 import json
 import os
 import re
+from contextlib import ExitStack
 from datetime import datetime
 
 from config import (
-    RAW_OCR_DIR, TABLE_OCR_DIR, PROCESSED_DIR, REPORTS_DIR,
+    TABLE_OCR_DIR, PROCESSED_DIR, REPORTS_DIR,
     FINAL_OUTPUT_FILE
 )
+from manifest import page_manifest
+from atomic_io import atomic_open, read_json
+from page_index import write_index, index_path
+from records import MergedPage, dumps, dumps_str
+from build_graph import BuildGraph
 
-
-def load_all_ocr_results():
-    """加载所有通用OCR结果"""
-    results = {}
-    pattern = re.compile(r'page_(\d+)\.json')
-
-    for filename in os.listdir(RAW_OCR_DIR):
-        match = pattern.match(filename)
-        if match:
-            page_num = int(match.group(1))
-            filepath = os.path.join(RAW_OCR_DIR, filename)
-            with open(filepath, 'r', encoding='utf-8') as f:
-                results[page_num] = json.load(f)
-
-    return results
+MERGED_MD_FILE = os.path.join(PROCESSED_DIR, "merged_content.md")
 
 
 def load_table_results():
@@ -42,11 +35,14 @@ def load_table_results():
         match = pattern.match(filename)
         if match:
             filepath = os.path.join(TABLE_OCR_DIR, filename)
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # 为每个页码建立映射
-                for page_num in data.get("pages", []):
-                    results[page_num] = data
+            try:
+                data = read_json(filepath)
+            except ValueError as e:
+                print(f"跳过损坏的表格解析结果（重新运行 Phase 3 生成）: {e}")
+                continue
+            # 为每个页码建立映射
+            for page_num in data.get("pages", []):
+                results[page_num] = data
 
     return results
 
@@ -55,11 +51,20 @@ def load_table_detection():
     """加载表格检测结果"""
     detection_file = os.path.join(PROCESSED_DIR, "table_detection.json")
     if os.path.exists(detection_file):
-        with open(detection_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return read_json(detection_file)
     return {"table_pages": [], "detection_details": {}}
 
 
+# 明确的表格指示词
+EXPLICIT_TABLE_KEYWORDS = ["见下表", "如下表", "下表所示", "表格", "调查记录"]
+
+
+def is_real_table_page(detail: dict) -> bool:
+    """只有包含明确表格指示词的才算真正的表格页"""
+    keywords = detail.get("table_keywords_found", [])
+    return any(kw in keywords for kw in EXPLICIT_TABLE_KEYWORDS)
+
+
 def get_real_table_pages(detection: dict) -> set:
     """
     获取真正的表格页（只有包含明确表格指示词的页面）
@@ -69,14 +74,9 @@ def get_real_table_pages(detection: dict) -> set:
     """
     real_table_pages = set()
 
-    # 明确的表格指示词
-    explicit_table_keywords = ["见下表", "如下表", "下表所示", "表格", "调查记录"]
-
     details = detection.get("detection_details", {})
     for page_str, detail in details.items():
-        keywords = detail.get("table_keywords_found", [])
-        # 只有包含明确表格指示词的才算真正的表格页
-        if any(kw in keywords for kw in explicit_table_keywords):
+        if is_real_table_page(detail):
             real_table_pages.add(int(page_str))
 
     return real_table_pages
@@ -259,63 +259,196 @@ def merge_page_content(page_num: int, ocr_result: dict, table_result: dict = Non
     return content
 
 
-def extract_exam_structure(pages_content: list) -> list:
+class ExamStructure:
     """
-    从页面内容中提取考试结构
+    从页面内容中提取考试结构（逐页调用 add，只记录页码，不保留页面内容）
 
     识别年份、题型等信息
     """
-    exams = []
-    current_exam = None
-    current_section = None
 
     # 年份标题模式
     exam_pattern = re.compile(r'(20\d{2})\s*年\s*(\d+)\s*月.*?(?:公共营养师|统考|真题)')
     section_pattern = re.compile(r'([一二三四五六七八九十]+)[、\.]\s*(单项选择题|多项选择题|判断题|简答题|案例)')
 
-    for page in pages_content:
+    def __init__(self):
+        self.exams = []
+        self._exam = None
+        self._section = None
+
+    def add(self, page: dict):
         text = "\n".join(page.get("text", [])) if page.get("text") else page.get("markdown", "")
+        page_num = page["page_num"]
 
         # 检测新考试
-        exam_match = exam_pattern.search(text)
+        exam_match = self.exam_pattern.search(text)
         if exam_match:
-            if current_exam:
-                exams.append(current_exam)
-
             year = exam_match.group(1)
             month = exam_match.group(2)
-            current_exam = {
+            self._exam = {
                 "exam_id": f"{year}-{month.zfill(2)}",
                 "title": exam_match.group(0),
-                "start_page": page["page_num"],
+                "start_page": page_num,
                 "sections": [],
-                "pages": [page["page_num"]],
+                "pages": [page_num],
             }
-            current_section = None
-            continue
+            self.exams.append(self._exam)
+            self._section = None
+            return
 
         # 检测题型
-        section_match = section_pattern.search(text)
-        if section_match and current_exam:
-            section_type = section_match.group(2)
-            current_section = {
-                "type": section_type,
-                "start_page": page["page_num"],
-                "pages": [page["page_num"]],
+        section_match = self.section_pattern.search(text)
+        if section_match and self._exam:
+            self._section = {
+                "type": section_match.group(2),
+                "start_page": page_num,
+                "pages": [page_num],
             }
-            current_exam["sections"].append(current_section)
+            self._exam["sections"].append(self._section)
 
         # 累加页码
-        if current_exam:
-            if page["page_num"] not in current_exam["pages"]:
-                current_exam["pages"].append(page["page_num"])
-            if current_section and page["page_num"] not in current_section["pages"]:
-                current_section["pages"].append(page["page_num"])
+        if self._exam:
+            if self._exam["pages"][-1] != page_num:
+                self._exam["pages"].append(page_num)
+            if self._section and self._section["pages"][-1] != page_num:
+                self._section["pages"].append(page_num)
+
+
+def extract_exam_structure(pages_content: list) -> list:
+    """从页面内容中提取考试结构"""
+    structure = ExamStructure()
+    for page in pages_content:
+        structure.add(page)
+    return structure.exams
+
+
+def page_warning(content: dict) -> dict:
+    """单页的验证警告，没有时返回None"""
+    if not content.get("warning"):
+        return None
+    return {
+        "page": content["page_num"],
+        "warning": content["warning"],
+        "validation": content.get("validation"),
+    }
+
+
+class FinalOutputWriter:
+    """
+    流式写出最终JSON和合并Markdown：每合并一页就追加到两个文件中，
+    考试结构、验证警告和元数据在 close() 时写在页面数组之后，内存占用与页数无关
+
+    最终JSON的页面数组每页占一行（紧凑格式），其余部分缩进2格；
+    同时记下每页的字节偏移，close() 时写页面索引（page_index）
+    两个文件都经 atomic_open 写入，close() 之前中断（或调用 abort()）时保留上次的输出
+    """
+
+    def __init__(self):
+        self._stack = ExitStack()
+        try:
+            self._json = self._stack.enter_context(atomic_open(FINAL_OUTPUT_FILE, 'wb'))
+            self._md = self._stack.enter_context(atomic_open(MERGED_MD_FILE))
+        except BaseException:
+            self._stack.close()
+            raise
+        self._offset = 0
+        self._index = []
+        self._write_json('{\n  "pages": [')
+        self.structure = ExamStructure()
+        self.validation_warnings = []
+        self.page_count = 0
+
+    def _write_json(self, data) -> bytes:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._json.write(data)
+        self._offset += len(data)
+        return data
+
+    def add(self, content: dict):
+        """追加一页合并内容（按页码顺序调用）"""
+        self._write_json("\n    " if self.page_count == 0 else ",\n    ")
+        offset = self._offset
+        data = self._write_json(dumps(MergedPage.check(content)))
+        self._index.append([content["page_num"], offset, len(data), hashlib.sha256(data).hexdigest()])
+        self.page_count += 1
+
+        self._md.write(f"\n\n<!-- ===== 第 {content['page_num']} 页 ===== -->\n\n")
+        if content.get("is_table_page"):
+            self._md.write("[表格页]\n\n")
+        self._md.write(content.get("markdown", ""))
+
+        self.structure.add(content)
+        warning = page_warning(content)
+        if warning:
+            self.validation_warnings.append(warning)
+
+    def abort(self):
+        """放弃本次输出，删除临时文件"""
+        error = RuntimeError("输出中断")
+        self._stack.__exit__(type(error), error, None)
+
+    def close(self, real_table_pages: set, all_detected_table_pages: set) -> dict:
+        """
+        写入考试结构、验证警告和元数据，完成两个文件并保存报告
+
+        Returns:
+            最终JSON中除 pages 以外的部分
+        """
+        validation_warnings = self.validation_warnings
+        if validation_warnings:
+            print(f"\n发现 {len(validation_warnings)} 个验证警告:")
+            for w in validation_warnings[:5]:
+                print(f"  页 {w['page']}: {w['warning']}")
+            if len(validation_warnings) > 5:
+                print(f"  ... 还有 {len(validation_warnings) - 5} 个")
+
+        exams = self.structure.exams
+        print(f"\n识别到 {len(exams)} 套考试:")
+        for exam in exams:
+            print(f"  {exam['exam_id']}: {exam['title'][:30]}... (页 {exam['start_page']}-{exam['pages'][-1]})")
+
+        output = {
+            "exams": exams,
+            "validation_warnings": validation_warnings,
+            "metadata": {
+                "source": "公共营养师三级历年真题",
+                "total_pages": self.page_count,
+                "table_pages": len(real_table_pages),
+                "detected_table_pages": len(all_detected_table_pages),
+                "exam_count": len(exams),
+                "created_at": datetime.now().isoformat(),
+                "ocr_api": "火山引擎",
+            },
+        }
+
+        # 页面数组之后接上其余字段（去掉外层的左花括号）
+        tail = dumps_str(output, indent=True)
+        self._write_json(f"\n  ],\n{tail[2:]}\n")
+        self._stack.close()
+        write_index(FINAL_OUTPUT_FILE, self._index, output)
+        print(f"\n最终输出已保存: {FINAL_OUTPUT_FILE}")
+        print(f"合并Markdown已保存: {MERGED_MD_FILE}")
+
+        # 保存报告
+        report = {
+            "timestamp": datetime.now().isoformat(),
+            "total_pages": self.page_count,
+            "table_pages": len(real_table_pages),
+            "detected_table_pages": len(all_detected_table_pages),
+            "exam_count": len(exams),
+            "validation_warning_count": len(validation_warnings),
+            "exams_summary": [
+                {"exam_id": e["exam_id"], "page_range": f"{e['start_page']}-{e['pages'][-1]}"}
+                for e in exams
+            ],
+        }
 
-    if current_exam:
-        exams.append(current_exam)
+        report_file = os.path.join(REPORTS_DIR, f"phase5_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        with atomic_open(report_file, checksum=False) as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"报告已保存: {report_file}")
 
-    return exams
+        return output
 
 
 def run_merge_output():
@@ -323,8 +456,7 @@ def run_merge_output():
     print("Phase 5-6: 交叉验证与合并输出")
     print("=" * 50)
 
-    # 加载数据
-    ocr_results = load_all_ocr_results()
+    # 加载数据（OCR结果在合并时逐页从页面清单读取）
     table_results = load_table_results()
     table_detection = load_table_detection()
 
@@ -332,98 +464,67 @@ def run_merge_output():
     real_table_pages = get_real_table_pages(table_detection)
     all_detected_table_pages = set(table_detection.get("table_pages", []))
 
-    print(f"加载了 {len(ocr_results)} 页OCR结果")
     print(f"加载了 {len(table_results)} 页表格解析结果")
     print(f"检测到的表格页: {len(all_detected_table_pages)} 页")
     print(f"真正的表格页（含明确指示词）: {len(real_table_pages)} 页")
 
-    # 合并每页内容
-    pages_content = []
-    validation_warnings = []
+    # 合并每页内容（输入没变的页复用上次的结果），这一遍只记下各页结果的哈希
+    graph = BuildGraph("phase5", sources=[__file__])
+    page_hashes = []
 
-    for page_num in sorted(ocr_results.keys()):
-        ocr_result = ocr_results[page_num]
+    for page_num, ocr_result in page_manifest.iter_records("ocr"):
         # 只对真正的表格页使用智能文档解析结果
         is_table_page = page_num in real_table_pages
         table_result = table_results.get(page_num) if is_table_page else None
 
-        content = merge_page_content(
-            page_num, ocr_result, table_result, is_table_page
+        key = f"page:{page_num}"
+        graph.build(
+            key, [ocr_result, table_result, is_table_page],
+            lambda: merge_page_content(page_num, ocr_result, table_result, is_table_page)
         )
-        pages_content.append(content)
-
-        if content.get("warning"):
-            validation_warnings.append({
-                "page": page_num,
-                "warning": content["warning"],
-                "validation": content.get("validation"),
-            })
-
-    print(f"\n合并了 {len(pages_content)} 页内容")
-
-    if validation_warnings:
-        print(f"\n发现 {len(validation_warnings)} 个验证警告:")
-        for w in validation_warnings[:5]:
-            print(f"  页 {w['page']}: {w['warning']}")
-        if len(validation_warnings) > 5:
-            print(f"  ... 还有 {len(validation_warnings) - 5} 个")
-
-    # 提取考试结构
-    exams = extract_exam_structure(pages_content)
-    print(f"\n识别到 {len(exams)} 套考试:")
-    for exam in exams:
-        print(f"  {exam['exam_id']}: {exam['title'][:30]}... (页 {exam['start_page']}-{exam['pages'][-1]})")
-
-    # 生成最终输出
-    output = {
-        "metadata": {
-            "source": "公共营养师三级历年真题",
-            "total_pages": len(pages_content),
-            "table_pages": len(real_table_pages),
-            "detected_table_pages": len(all_detected_table_pages),
-            "exam_count": len(exams),
-            "created_at": datetime.now().isoformat(),
-            "ocr_api": "火山引擎",
-        },
-        "exams": exams,
-        "pages": pages_content,
-        "validation_warnings": validation_warnings,
-    }
+        page_hashes.append([page_num, graph.output_hash(key)])
 
-    # 保存最终输出
-    with open(FINAL_OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
-    print(f"\n最终输出已保存: {FINAL_OUTPUT_FILE}")
-
-    # 生成合并后的Markdown文件
-    merged_md_file = os.path.join(PROCESSED_DIR, "merged_content.md")
-    with open(merged_md_file, 'w', encoding='utf-8') as f:
-        for page in pages_content:
-            f.write(f"\n\n<!-- ===== 第 {page['page_num']} 页 ===== -->\n\n")
-            if page.get("is_table_page"):
-                f.write(f"[表格页]\n\n")
-            f.write(page.get("markdown", ""))
-    print(f"合并Markdown已保存: {merged_md_file}")
-
-    # 保存报告
-    report = {
-        "timestamp": datetime.now().isoformat(),
-        "total_pages": len(pages_content),
-        "table_pages": len(real_table_pages),
-        "detected_table_pages": len(all_detected_table_pages),
-        "exam_count": len(exams),
-        "validation_warning_count": len(validation_warnings),
-        "exams_summary": [
-            {"exam_id": e["exam_id"], "page_range": f"{e['start_page']}-{e['pages'][-1]}"}
-            for e in exams
-        ],
-    }
+    print(f"\n合并了 {len(page_hashes)} 页内容（{graph.summary()}）")
+
+    # 写出时再逐页从构建记录中取回合并结果
+    pages = (graph.result(f"page:{page_num}") for page_num, _ in page_hashes)
+    return write_final_output(pages, real_table_pages, all_detected_table_pages, inputs=page_hashes)
 
-    report_file = os.path.join(REPORTS_DIR, f"phase5_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
-    with open(report_file, 'w', encoding='utf-8') as f:
-        json.dump(report, f, ensure_ascii=False, indent=2)
-    print(f"报告已保存: {report_file}")
 
+def write_final_output(pages, real_table_pages: set, all_detected_table_pages: set, inputs=None) -> dict:
+    """
+    把逐页合并内容流式写入最终JSON和合并Markdown，并保存报告
+
+    Args:
+        pages: 按页码排序的合并内容，可以是生成器
+        inputs: 各页结果的哈希；给出时与上次相同、且输出文件完好则不重写，返回None
+
+    Returns:
+        最终JSON中除 pages 以外的部分（考试结构、验证警告、元数据）
+    """
+    output = None
+
+    def write():
+        nonlocal output
+        writer = FinalOutputWriter()
+        try:
+            for content in pages:
+                writer.add(content)
+        except BaseException:
+            writer.abort()
+            raise
+        output = writer.close(real_table_pages, all_detected_table_pages)
+
+    if inputs is None:
+        write()
+        return output
+
+    BuildGraph("phase5", sources=[__file__]).build(
+        "file:final", [inputs, real_table_pages, all_detected_table_pages],
+        write, outputs=[FINAL_OUTPUT_FILE, MERGED_MD_FILE, index_path(FINAL_OUTPUT_FILE)]
+    )
+    if output is None:
+        print(f"\n内容没有变化，沿用上次的输出: {FINAL_OUTPUT_FILE}")
     return output
 
 
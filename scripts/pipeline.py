@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+流式流水线：各阶段按页并行推进，不再等上一阶段全部完成
+
+    OCR ──> 表格检测/分组 ──> 智能文档解析（表格组）
+                │                      │
+                └──────> 逐页合并 <─────┘
+
+- 阶段之间用有界队列连接，下游慢时上游自动等待，内存占用由队列长度决定
+- 表格检测按页码顺序进行（OCR结果乱序到达时先缓存），跨页表格分组只看上一页
+- 任一阶段出错时置停止标志，各阶段的队列读写轮询该标志后退出，不会卡在已无人读写的队列上
+- 总耗时约等于最慢的阶段，而不是各阶段之和
+- 各阶段的输出文件与分阶段执行时相同，中断后可以继续用 main.py --phase 执行
+
+使用方法:
+    python main.py --stream
+    python main.py --stream --pdf book.pdf
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import chain
+
+from config import MAX_CONCURRENCY, STREAM_QUEUE_SIZE
+from manifest import page_manifest, needs_run
+from ocr_client import OCRClient
+from phase1_batch_ocr import get_image_files, select_pages, ocr_pages
+from phase2_detect_tables import detect_table_from_features, TableGroupStream, save_detection
+from table_features import features_for
+from phase3_parse_tables import group_job_state, load_group_result, parse_group
+from phase5_merge_output import merge_page_content, is_real_table_page, FinalOutputWriter
+
+_END = object()
+
+# 阶段间队列读写的等待间隔（秒），每次超时后检查停止标志
+_POLL_SECONDS = 0.5
+
+
+class _Stopped(Exception):
+    """其他阶段出错，流水线停止"""
+
+
+def _load_page(page_num: int) -> dict:
+    """读取已保存的单页OCR结果（其他进程正在识别、还没有结果时按失败处理）"""
+    return page_manifest.record(page_num, "ocr") or {
+        "page_num": page_num, "success": False, "error": "没有识别结果", "line_texts": []}
+
+
+class StreamPipeline:
+    """
+    流式流水线
+
+    Args:
+        pages: [(页码, 文件名), ...]
+        pdf_path: 指定时OCR阶段直接从PDF渲染页面
+        raster_options: 渲染参数
+        queue_size: 阶段间队列长度
+        retry_failed: 重新处理上次失败的页和表格组
+        only_stale: OCR阶段只重新识别图片已更新的页
+    """
+
+    def __init__(self, pages: list, pdf_path: str = None, raster_options: dict = None,
+                 queue_size: int = STREAM_QUEUE_SIZE, retry_failed: bool = False, only_stale: bool = False):
+        self.pages = sorted(pages)
+        self.pdf_path = pdf_path
+        self.raster_options = raster_options
+        self.retry_failed = retry_failed
+        self.only_stale = only_stale
+        self.ocr_queue = queue.Queue(queue_size)
+        self.table_queue = queue.Queue(queue_size)
+        # 合并阶段同时接收页面（来自检测阶段）和表格组结果（来自解析阶段）
+        self.merge_queue = queue.Queue(queue_size)
+        self.queue_size = queue_size
+        self.stop = threading.Event()
+        self.error = None
+        self.stats = {"ocr": 0, "detected": 0, "table_groups": 0, "merged": 0}
+
+    def _run_stage(self, name: str, func):
+        """执行一个阶段，出错时记录异常并通知其他阶段停止"""
+        try:
+            func()
+        except _Stopped:
+            pass
+        except Exception as e:
+            if self.error is None:
+                self.error = f"{name}: {e}"
+                print(f"[流水线] {self.error}")
+            self.stop.set()
+
+    def _put(self, q: queue.Queue, item):
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+        raise _Stopped()
+
+    def _get(self, q: queue.Queue):
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                pass
+        raise _Stopped()
+
+    def _drain(self):
+        """清空各队列（停止后阻塞在 put 上的阶段能尽快退出）"""
+        for q in (self.ocr_queue, self.table_queue, self.merge_queue):
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+
+    # ==================== 阶段1: OCR ====================
+
+    def _ocr_stage(self):
+        todo = select_pages(self.pages, self.retry_failed, self.only_stale)
+        todo_pages = {page_num for page_num, _ in todo}
+        for page_num, _ in self.pages:
+            if page_num not in todo_pages:
+                # 不需要识别的页只传页码，检测阶段轮到时再读盘
+                self._put(self.ocr_queue, (page_num, None))
+        if len(todo) < len(self.pages):
+            print(f"[OCR] 已有结果 {len(self.pages) - len(todo)} 页，需要识别 {len(todo)} 页")
+
+        if todo:
+            client = OCRClient(MAX_CONCURRENCY)
+            tasks = ocr_pages(client, todo, self.pdf_path, self.raster_options)
+            try:
+                for page_num, filename, result in tasks:
+                    if result is None:
+                        # 其他进程正在识别的页，检测阶段轮到时读取已保存的结果
+                        print(f"[OCR] 页 {page_num} 其他进程处理中，跳过")
+                    else:
+                        self.stats["ocr"] += 1
+                        if not result["success"]:
+                            print(f"[OCR] 页 {page_num} 失败: {result.get('error', '未知')}")
+                    self._put(self.ocr_queue, (page_num, result))
+            finally:
+                tasks.close()
+        self._put(self.ocr_queue, _END)
+
+    # ==================== 阶段2: 表格检测与分组 ====================
+
+    def _detect_stage(self):
+        grouper = TableGroupStream()
+        table_pages = []
+        table_groups = []
+        detection_details = {}
+        arrived = {}
+        order = iter(page_num for page_num, _ in self.pages)
+        next_page = next(order, None)
+
+        def emit(page_num: int, result: dict):
+            features = features_for(page_num, result)
+            detection = detect_table_from_features(features)
+            detection_details[page_num] = detection
+            if detection["has_table"]:
+                table_pages.append(page_num)
+            closed = grouper.add(page_num, features, detection["has_table"])
+            if closed:
+                # 先交出结束的分组，再交出当前页，合并阶段等待的表格结果总能先得到处理
+                table_groups.append(closed)
+                self._put(self.table_queue, closed)
+            self._put(self.merge_queue, ("page", page_num, result, detection))
+            self.stats["detected"] += 1
+
+        def emit_arrived(page_num: int):
+            result = arrived.pop(page_num, None)
+            emit(page_num, result if result is not None else _load_page(page_num))
+
+        while True:
+            item = self._get(self.ocr_queue)
+            if item is _END:
+                break
+            page_num, result = item
+            arrived[page_num] = result
+            # OCR按完成顺序到达，按页码顺序检测
+            while next_page is not None and next_page in arrived:
+                emit_arrived(next_page)
+                next_page = next(order, None)
+
+        # OCR阶段结束后仍未到达的页按已保存的结果处理，不丢页
+        if next_page is not None:
+            for page_num in chain([next_page], order):
+                emit_arrived(page_num)
+
+        closed = grouper.flush()
+        if closed:
+            table_groups.append(closed)
+            self._put(self.table_queue, closed)
+        self._put(self.table_queue, _END)
+        self._put(self.merge_queue, _END)
+
+        if self.error is None:
+            save_detection(len(detection_details), table_pages, table_groups, detection_details)
+
+    # ==================== 阶段3: 智能文档解析 ====================
+
+    def _parse_group(self, group_id: str, group: list) -> dict:
+        if needs_run(group_job_state(group_id, group), self.retry_failed):
+            result = parse_group(group_id, group, self.pdf_path, self.raster_options)
+        else:
+            result = load_group_result(group)
+            if result is not None:
+                return result
+        if result is None:
+            print(f"[表格] 组 {group} 其他进程处理中，跳过")
+            return {"pages": group, "success": False, "errors": ["其他进程处理中"], "merged_markdown": ""}
+
+        status = "成功" if result["success"] else f"失败: {result['errors']}"
+        print(f"[表格] 组 {group} -> {status}")
+        return result
+
+    def _table_stage(self):
+        # 分组按检测顺序编号，多个分组并发解析（QPS与OCR阶段共用同一个限流器）
+        # 解析完的组立即交给合并阶段，不等下一组到达（不用 map_unordered：它交出结果前要先取到下一个输入）
+        pending = set()
+        count = 0
+        finished = False
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+            try:
+                while not finished or pending:
+                    if self.stop.is_set():
+                        raise _Stopped()
+                    for future in [f for f in pending if f.done()]:
+                        pending.remove(future)
+                        self.stats["table_groups"] += 1
+                        self._put(self.merge_queue, ("table", future.result()))
+                    if finished or len(pending) >= MAX_CONCURRENCY:
+                        wait(pending, timeout=_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                        continue
+                    try:
+                        group = self.table_queue.get(timeout=_POLL_SECONDS if not pending else 0.05)
+                    except queue.Empty:
+                        continue
+                    if group is _END:
+                        finished = True
+                    else:
+                        count += 1
+                        pending.add(executor.submit(self._parse_group, f"table_group_{count:03d}", group))
+            finally:
+                for future in pending:
+                    future.cancel()
+        self._put(self.merge_queue, _END)
+
+    # ==================== 阶段4: 逐页合并 ====================
+
+    def _merge_stage(self):
+        # 合并结果直接流式写入最终文件，不在内存中累积
+        writer = FinalOutputWriter()
+        real_table_pages = set()
+        detected_table_pages = set()
+        try:
+            self._merge_pages(writer, real_table_pages, detected_table_pages)
+        except BaseException:
+            writer.abort()
+            raise
+
+        if self.error is not None:
+            writer.abort()
+            return
+        print(f"\n合并了 {writer.page_count} 页内容")
+        writer.close(real_table_pages, detected_table_pages)
+
+    def _merge_pages(self, writer, real_table_pages: set, detected_table_pages: set):
+        table_results = {}
+        # 按页码顺序排队，表格页等到所在组解析完成再合并
+        # 超过队列长度的排队页只记页码，轮到时再读已保存的OCR结果，排队再长内存也不随页数增长
+        waiting = deque()
+        ends = 0
+        while ends < 2:
+            item = self._get(self.merge_queue)
+            if item is _END:
+                ends += 1
+            elif item[0] == "table":
+                for page_num in item[1].get("pages", []):
+                    table_results[page_num] = item[1]
+            else:
+                _, page_num, result, detection = item
+                is_table_page = detection["has_table"] and is_real_table_page(detection)
+                if detection["has_table"]:
+                    detected_table_pages.add(page_num)
+                if is_table_page:
+                    real_table_pages.add(page_num)
+                waiting.append((page_num, result if len(waiting) < self.queue_size else None, is_table_page))
+
+            # 上游结束时不再等待表格结果
+            while waiting and (not waiting[0][2] or waiting[0][0] in table_results or ends == 2):
+                page_num, result, is_table_page = waiting.popleft()
+                if result is None:
+                    result = _load_page(page_num)
+                writer.add(merge_page_content(page_num, result, table_results.pop(page_num, None), is_table_page))
+                self.stats["merged"] += 1
+                if self.stats["merged"] % 20 == 0:
+                    print(f"[流水线] 已合并 {self.stats['merged']}/{len(self.pages)} 页 "
+                          f"(OCR {self.stats['ocr']}, 表格组 {self.stats['table_groups']}, "
+                          f"队列 {self.ocr_queue.qsize()}/{self.table_queue.qsize()}/{self.merge_queue.qsize()})")
+
+    def run(self):
+        start_time = time.time()
+        stages = [
+            ("OCR", self._ocr_stage),
+            ("表格检测", self._detect_stage),
+            ("智能文档解析", self._table_stage),
+        ]
+        threads = [threading.Thread(target=self._run_stage, args=stage, daemon=True) for stage in stages]
+        for thread in threads:
+            thread.start()
+        # 合并阶段在当前线程执行
+        self._run_stage("合并", self._merge_stage)
+        if self.error is not None:
+            self.stop.set()
+            self._drain()
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.time() - start_time
+        print(f"\n流水线{'中断' if self.error else '完成'}: 耗时 {elapsed / 60:.1f} 分钟, "
+              f"OCR {self.stats['ocr']} 页, 表格组 {self.stats['table_groups']}, 合并 {self.stats['merged']} 页")
+        return self.error is None
+
+
+def run_pipeline(start_page: int = None, end_page: int = None, pdf_path: str = None,
+                 raster_options: dict = None, retry_failed: bool = False, only_stale: bool = False) -> bool:
+    """执行流式流水线"""
+    print("流式流水线: OCR → 表格检测 → 智能文档解析 → 合并")
+    print("=" * 50)
+
+    if pdf_path:
+        from rasterize import page_count, image_filename
+        pages = [(p, image_filename(p)) for p in range(1, page_count(pdf_path) + 1)]
+    else:
+        pages = get_image_files()
+    pages = [(p, f) for p, f in pages
+             if (not start_page or p >= start_page) and (not end_page or p <= end_page)]
+    print(f"共 {len(pages)} 页，阶段间队列长度 {STREAM_QUEUE_SIZE}")
+
+    if not pages:
+        print("没有需要处理的页面")
+        return True
+    return StreamPipeline(pages, pdf_path, raster_options, retry_failed=retry_failed, only_stale=only_stale).run()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Phase 0: PDF转图片
+多进程并行渲染扫描版PDF的每一页，页面PNG数据直接交给OCR上传，保存图片文件可选
+（不保存时 Phase 3 用 render_images 按需渲染表格页）
+
+渲染后端（按顺序尝试）：
+- PyMuPDF:   pip install pymupdf
+- pypdfium2: pip install pypdfium2
+
+使用方法:
+    python rasterize.py book.pdf              # 渲染全部页面到 IMAGE_DIR
+    python rasterize.py book.pdf --dpi 200    # 指定分辨率
+"""
+
+import io
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from config import (
+    IMAGE_DIR, RASTER_DPI, RASTER_COLORSPACE, RASTER_WORKERS, RASTER_SAVE_IMAGES
+)
+from manifest import IMAGE_NAME_FORMAT, page_manifest
+from atomic_io import write_bytes, fsync_dir
+
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf  # 旧版PyMuPDF
+    except ImportError:
+        pymupdf = None
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+
+def _require_backend():
+    if pymupdf is None and pypdfium2 is None:
+        raise RuntimeError("PDF渲染需要安装 PyMuPDF 或 pypdfium2: pip install pymupdf")
+
+
+def image_filename(page_num: int) -> str:
+    return IMAGE_NAME_FORMAT.format(page_num)
+
+
+def page_count(pdf_path: str) -> int:
+    """PDF总页数"""
+    _require_backend()
+    if pymupdf is not None:
+        with pymupdf.open(pdf_path) as doc:
+            return doc.page_count
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+# ==================== 渲染进程 ====================
+# 每个进程只打开一次PDF，之后按页渲染
+
+_worker = {}
+
+
+def _init_worker(pdf_path: str, dpi: int, colorspace: str, save_dir: str):
+    _worker["dpi"] = dpi
+    _worker["gray"] = colorspace == "gray"
+    _worker["save_dir"] = save_dir
+    if pymupdf is not None:
+        _worker["doc"] = pymupdf.open(pdf_path)
+    else:
+        _worker["doc"] = pypdfium2.PdfDocument(pdf_path)
+
+
+def _render_page(page_num: int) -> tuple:
+    """渲染一页（页码从1开始），返回 (页码, PNG数据)"""
+    doc = _worker["doc"]
+    dpi = _worker["dpi"]
+
+    if pymupdf is not None:
+        colorspace = pymupdf.csGRAY if _worker["gray"] else pymupdf.csRGB
+        pix = doc[page_num - 1].get_pixmap(dpi=dpi, colorspace=colorspace, alpha=False)
+        pix.set_dpi(dpi, dpi)
+        data = pix.tobytes("png")
+    else:
+        bitmap = doc[page_num - 1].render(scale=dpi / 72, grayscale=_worker["gray"])
+        buf = io.BytesIO()
+        bitmap.to_pil().save(buf, format="PNG", dpi=(dpi, dpi))
+        data = buf.getvalue()
+
+    # 在渲染进程里直接落盘，不占主进程时间
+    if _worker["save_dir"]:
+        # 图片内容哈希由页面清单记录，这里不另外登记
+        write_bytes(os.path.join(_worker["save_dir"], image_filename(page_num)), data, checksum=False)
+
+    return page_num, data
+
+
+def rasterize_pages(pdf_path: str, page_nums: list, dpi: int = RASTER_DPI,
+                    colorspace: str = RASTER_COLORSPACE, workers: int = RASTER_WORKERS,
+                    save_images: bool = RASTER_SAVE_IMAGES):
+    """
+    多进程渲染指定页面
+
+    Args:
+        pdf_path: PDF文件路径
+        page_nums: 要渲染的页码（从1开始），可以是生成器（提交渲染时才取下一页）
+        dpi: 渲染分辨率
+        colorspace: "gray" 灰度 / "rgb" 彩色
+        workers: 进程数，0为CPU核数
+        save_images: 是否同时保存PNG到 IMAGE_DIR
+
+    Yields:
+        (页码, PNG数据)，按 page_nums 的顺序
+        最多领先消费方 workers*2 页，渲染速度快于OCR时不会把整本书堆在内存里
+    """
+    _require_backend()
+    workers = workers or os.cpu_count() or 1
+    window = workers * 2
+    page_nums = iter(page_nums)
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(pdf_path, dpi, colorspace, IMAGE_DIR if save_images else None)) as executor:
+        try:
+            for page_num in page_nums:
+                pending.append(executor.submit(_render_page, page_num))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # 提前退出时取消尚未开始的渲染
+            for future in pending:
+                future.cancel()
+            # 渲染进程退出时不会执行批量刷盘，由主进程补刷图片目录
+            if save_images:
+                fsync_dir(IMAGE_DIR)
+
+
+# 按需渲染在当前进程中进行，多个线程共用一个已打开的文档
+_render_lock = threading.Lock()
+
+
+def render_images(pdf_path: str, page_nums: list, raster_options: dict = None) -> list:
+    """
+    在当前进程中渲染少量页面并保存到 IMAGE_DIR（已有图片的页跳过）
+    Phase 3 只需要表格页的图片，按需渲染，不必在 Phase 1 保存整本书的图片
+
+    Args:
+        raster_options: 渲染参数（dpi / colorspace），默认取配置
+
+    Returns:
+        新渲染的页码
+    """
+    missing = [p for p in page_nums if page_manifest.image_path(p) is None]
+    if not missing:
+        return []
+    _require_backend()
+    options = raster_options or {}
+    dpi = options.get("dpi", RASTER_DPI)
+    colorspace = options.get("colorspace", RASTER_COLORSPACE)
+    with _render_lock:
+        if _worker.get("source") != (pdf_path, dpi, colorspace):
+            _init_worker(pdf_path, dpi, colorspace, IMAGE_DIR)
+            _worker["source"] = (pdf_path, dpi, colorspace)
+        for page_num in missing:
+            _render_page(page_num)
+    fsync_dir(IMAGE_DIR)
+    return missing
+
+
+def rasterize_pdf(pdf_path: str, dpi: int = RASTER_DPI, colorspace: str = RASTER_COLORSPACE,
+                  workers: int = RASTER_WORKERS, start_page: int = None, end_page: int = None):
+    """
+    Phase 0: 把PDF页面渲染为PNG保存到 IMAGE_DIR（已存在的页跳过）
+    """
+    total = page_count(pdf_path)
+    first = start_page or 1
+    last = min(end_page or total, total)
+    existing = {p for p, _ in page_manifest.image_files()}
+    page_nums = [p for p in range(first, last + 1) if p not in existing]
+
+    print(f"PDF共 {total} 页，本次渲染 {len(page_nums)} 页 (DPI {dpi}, {colorspace})")
+    if not page_nums:
+        return
+
+    start_time = time.time()
+    for i, _ in enumerate(rasterize_pages(pdf_path, page_nums, dpi, colorspace, workers, save_images=True), 1):
+        if i % 20 == 0 or i == len(page_nums):
+            elapsed = time.time() - start_time
+            print(f"  渲染进度: {i}/{len(page_nums)} ({i / elapsed:.1f} 页/秒)")
+
+    page_manifest.refresh()
+    print(f"渲染完成，图片保存在 {IMAGE_DIR}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Phase 0: PDF转图片")
+    parser.add_argument("pdf", help="扫描版PDF路径")
+    parser.add_argument("--dpi", type=int, default=RASTER_DPI, help="渲染分辨率")
+    parser.add_argument("--colorspace", choices=["gray", "rgb"], default=RASTER_COLORSPACE, help="颜色空间")
+    parser.add_argument("--workers", type=int, default=RASTER_WORKERS, help="进程数，0为CPU核数")
+    args = parser.parse_args()
+
+    rasterize_pdf(args.pdf, args.dpi, args.colorspace, args.workers)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+请求限流模块
+令牌桶限流器，保证并发请求下整体QPS不超过API配额
+AIMD自适应控制器，根据限流错误、超时和延迟在运行时调整QPS与在途请求数
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class TokenBucket:
+    """
+    令牌桶限流器（线程安全）
+
+    按 rate 个/秒的速度补充令牌，桶容量为 capacity。
+    每次请求前调用 acquire() 取走一个令牌，令牌不足时阻塞等待，
+    不再需要在每次请求后固定 sleep。
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """按流逝时间补充令牌（调用方需持有锁）"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """尝试取走令牌，不阻塞；成功返回True"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1):
+        """取走令牌，令牌不足时阻塞直到可用"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate: float):
+        """运行时调整补充速率"""
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+
+
+class LatencyTracker:
+    """
+    请求延迟统计（按action分别记录最近N次）
+    用于自适应限流的延迟信号，以及对冲请求的触发阈值
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, action: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(action)
+            if samples is None:
+                samples = self._samples[action] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def count(self, action: str) -> int:
+        with self._lock:
+            return len(self._samples.get(action, ()))
+
+    def percentile(self, action: str, p: float) -> float:
+        """第p百分位延迟（秒），无样本时返回None"""
+        with self._lock:
+            samples = sorted(self._samples.get(action, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * p / 100))
+        return samples[index]
+
+
+class ConcurrencyLimit:
+    """可在运行时调整上限的信号量"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def set_limit(self, limit: int):
+        with self._cond:
+            self.limit = limit
+            self._cond.notify_all()
+
+
+class AdaptiveController:
+    """
+    AIMD自适应限流
+
+    - 加性增：连续 increase_interval 秒没有限流/超时且延迟正常，QPS +qps_step、在途数 +1
+    - 乘性减：遇到限流错误或超时，QPS与在途数乘以 decrease_factor（cooldown 秒内只减一次，
+      避免同一波限流被并发请求重复计数）
+    - 延迟信号：p90延迟超过目标值时在途数 -1（QPS不变）
+
+    Args:
+        bucket: 被调节的令牌桶
+        min_qps/max_qps: QPS调节范围（max_qps为API真实上限）
+        min_in_flight/max_in_flight: 在途请求数调节范围
+        latency_target: p90延迟目标（秒），为0时取观测到的最低p50的3倍
+        enabled: False时只做固定限流，不调节
+    """
+
+    def __init__(self, bucket: TokenBucket, min_qps: float, max_qps: float,
+                 min_in_flight: int, max_in_flight: int, latency_target: float = 0,
+                 enabled: bool = True, increase_interval: float = 5.0, qps_step: float = 0.5,
+                 decrease_factor: float = 0.75, cooldown: float = 2.0):
+        self.bucket = bucket
+        self.min_qps = min_qps
+        self.max_qps = max_qps
+        self.min_in_flight = max(1, min_in_flight)
+        self.max_in_flight = max(self.min_in_flight, max_in_flight)
+        self.latency_target = latency_target
+        self.enabled = enabled
+        self.increase_interval = increase_interval
+        self.qps_step = qps_step
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self.concurrency = ConcurrencyLimit(self.max_in_flight)
+        self.latency = LatencyTracker(window=50)
+        self.decisions = []
+        self._lock = threading.Lock()
+        now = time.monotonic()
+        self._last_increase = now
+        self._last_decrease = 0.0
+        self._best_p50 = None
+
+    @property
+    def qps(self) -> float:
+        return self.bucket.rate
+
+    @property
+    def in_flight_limit(self) -> int:
+        return self.concurrency.limit
+
+    def acquire(self):
+        """发送前调用：占用在途名额并取令牌"""
+        self.concurrency.acquire()
+        self.bucket.acquire()
+
+    def release(self, action: str, outcome: str, latency: float):
+        """
+        请求结束后调用
+
+        Args:
+            outcome: "success"（包括业务错误等正常响应）/ "throttled" / "timeout" / "error"
+            latency: 请求耗时（秒）
+        """
+        self.concurrency.release()
+        if outcome == "success":
+            self.latency.record(action, latency)
+        if not self.enabled:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            if outcome in ("throttled", "timeout"):
+                if now - self._last_decrease >= self.cooldown:
+                    self._decrease(now, f"{'限流' if outcome == 'throttled' else '超时'}")
+                return
+
+            if outcome != "success":
+                return
+
+            p50 = self.latency.percentile(action, 50)
+            p90 = self.latency.percentile(action, 90)
+            if self.latency.count(action) >= 20:
+                if self._best_p50 is None or p50 < self._best_p50:
+                    self._best_p50 = p50
+                target = self.latency_target or self._best_p50 * 3
+                if p90 > target and now - self._last_decrease >= self.increase_interval:
+                    # 延迟上升：服务端排队，减少在途数
+                    new_limit = max(self.min_in_flight, self.concurrency.limit - 1)
+                    if new_limit != self.concurrency.limit:
+                        self.concurrency.set_limit(new_limit)
+                        self._last_decrease = now
+                        self._log(f"p90延迟 {p90:.2f}s 超过目标 {target:.2f}s，在途数降为 {new_limit}")
+                    return
+
+            if now - self._last_increase >= self.increase_interval and now - self._last_decrease >= self.increase_interval:
+                self._increase(now)
+
+    def _increase(self, now: float):
+        """加性增（调用方需持有锁）"""
+        self._last_increase = now
+        new_qps = min(self.max_qps, self.bucket.rate + self.qps_step)
+        new_limit = min(self.max_in_flight, self.concurrency.limit + 1)
+        if new_qps == self.bucket.rate and new_limit == self.concurrency.limit:
+            return
+        self.bucket.set_rate(new_qps)
+        self.concurrency.set_limit(new_limit)
+        self._log(f"运行平稳，QPS升至 {new_qps:.1f}，在途数 {new_limit}")
+
+    def _decrease(self, now: float, reason: str):
+        """乘性减（调用方需持有锁）"""
+        self._last_decrease = now
+        new_qps = max(self.min_qps, self.bucket.rate * self.decrease_factor)
+        new_limit = max(self.min_in_flight, int(self.concurrency.limit * self.decrease_factor))
+        self.bucket.set_rate(new_qps)
+        self.concurrency.set_limit(new_limit)
+        self._log(f"遇到{reason}，QPS降至 {new_qps:.1f}，在途数 {new_limit}")
+
+    def _log(self, message: str):
+        self.decisions.append({
+            "time": time.time(),
+            "qps": self.bucket.rate,
+            "in_flight": self.concurrency.limit,
+            "message": message,
+        })
+        print(f"[自适应限流] {message}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "qps": self.bucket.rate,
+            "in_flight_limit": self.concurrency.limit,
+            "decision_count": len(self.decisions),
+            "decisions": self.decisions[-50:],
+        }
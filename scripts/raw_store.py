@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+API原始响应旁路存储
+原始响应体积大、后续阶段基本不读，不再内嵌到每页结果JSON中，
+而是压缩后按内容寻址单独存放，结果文件只记录 raw_id
+
+- raw_id = SHA256(规范化JSON)，相同响应只存一份
+- 安装了 zstandard 时使用zstd压缩（.zst），否则回退到zlib（.zz）
+- 文件按 raw_id 前两位分目录，避免单目录文件过多
+- raw_id 本身就是内容哈希，读取时解压后直接校验
+"""
+
+import hashlib
+import os
+import zlib
+
+from config import RAW_STORE_DIR, RAW_STORE_COMPRESS_LEVEL
+from atomic_io import write_bytes, ChecksumError
+from records import dumps, loads
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _path(raw_id: str, ext: str) -> str:
+    return os.path.join(RAW_STORE_DIR, raw_id[:2], raw_id + ext)
+
+
+def _compress(data: bytes) -> tuple:
+    """压缩数据，返回 (压缩后数据, 扩展名)"""
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=RAW_STORE_COMPRESS_LEVEL).compress(data), ".zst"
+    return zlib.compress(data, min(RAW_STORE_COMPRESS_LEVEL, 9)), ".zz"
+
+
+def save_raw(response) -> str:
+    """
+    保存一条原始响应
+
+    Args:
+        response: API响应（可JSON序列化），None时不保存
+
+    Returns:
+        raw_id，response为None时返回None
+    """
+    if response is None:
+        return None
+
+    data = dumps(response, sort_keys=True)
+    raw_id = hashlib.sha256(data).hexdigest()
+
+    # 已存在（任一压缩格式）则不再写入
+    if os.path.exists(_path(raw_id, ".zst")) or os.path.exists(_path(raw_id, ".zz")):
+        return raw_id
+
+    compressed, ext = _compress(data)
+    path = _path(raw_id, ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 原子写入，并发写同一条响应时不会读到半个文件
+    write_bytes(path, compressed, checksum=False)
+    return raw_id
+
+
+def _decode(raw_id: str, decompress, compressed: bytes):
+    """解压并按 raw_id 校验内容"""
+    try:
+        data = decompress(compressed)
+    except Exception as e:
+        raise ChecksumError(f"原始响应解压失败（文件已损坏）: {raw_id}") from e
+    if hashlib.sha256(data).hexdigest() != raw_id:
+        raise ChecksumError(f"原始响应校验失败（文件已损坏）: {raw_id}")
+    return loads(data)
+
+
+def load_raw(raw_id: str):
+    """
+    读取一条原始响应
+
+    Raises:
+        FileNotFoundError: raw_id 不存在
+        RuntimeError: 响应以zstd保存但未安装 zstandard
+        ChecksumError: 文件已损坏
+    """
+    path = _path(raw_id, ".zst")
+    if os.path.exists(path):
+        if zstandard is None:
+            raise RuntimeError(f"原始响应 {raw_id} 使用zstd压缩，请先安装: pip install zstandard")
+        with open(path, 'rb') as f:
+            return _decode(raw_id, zstandard.ZstdDecompressor().decompress, f.read())
+
+    path = _path(raw_id, ".zz")
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return _decode(raw_id, zlib.decompress, f.read())
+
+    raise FileNotFoundError(f"原始响应不存在: {raw_id}")
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+OCR响应缓存
+按内容寻址：键为 SHA256(图片字节 + action + version + 请求参数)，
+同一张图片无论文件名、路径如何，也无论哪个脚本发起，相同请求只付费一次
+存储在SQLite中，按总大小做LRU淘汰
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+from records import dumps, loads
+
+# 按块读取图片计算哈希
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ResponseCache:
+    """
+    SQLite响应缓存（线程安全）
+
+    Args:
+        db_path: 数据库文件路径
+        max_bytes: 缓存总大小上限（压缩后），超出时淘汰最久未访问的条目
+        enabled: 是否启用，False时 get 总是未命中、put 不写入
+    """
+
+    def __init__(self, db_path: str, max_bytes: int, enabled: bool = True):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._total_bytes = 0
+
+    def _connect(self):
+        """首次使用时打开数据库（调用方需持有锁）"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    action TEXT,
+                    value BLOB,
+                    size INTEGER,
+                    created_at REAL,
+                    accessed_at REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed_at)")
+            row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+            self._total_bytes = row[0]
+        return self._conn
+
+    @staticmethod
+    def make_key(image_path: str, action: str, version: str, params: dict,
+                 image_data: bytes = None) -> str:
+        """计算缓存键：SHA256(图片字节 + action + version + 参数)，图片可以是文件或内存数据"""
+        hasher = hashlib.sha256()
+        if image_data is not None:
+            hasher.update(image_data)
+        else:
+            with open(image_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+        hasher.update(b"\0" + action.encode('utf-8'))
+        hasher.update(b"\0" + version.encode('utf-8'))
+        hasher.update(b"\0" + json.dumps(params, sort_keys=True).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def get(self, key: str) -> dict:
+        """查询缓存，未命中返回None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.hits += 1
+        return loads(zlib.decompress(row[0]))
+
+    def put(self, key: str, action: str, response: dict):
+        """写入缓存（只应写入成功的响应）"""
+        if not self.enabled:
+            return
+        value = zlib.compress(dumps(response))
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            old = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, action, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, action, value, len(value), now, now)
+            )
+            self._total_bytes += len(value) - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn):
+        """按LRU淘汰到上限的90%（调用方需持有锁）"""
+        target = self.max_bytes * 0.9
+        rows = conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if self._total_bytes <= target:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """命中统计"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0,
+            "evictions": self.evictions,
+            "total_bytes": self._total_bytes,
+        }
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+重试策略模块
+- 错误分类：可重试 / 限流 / 致命
+- 指数退避 + 随机抖动
+- 全局重试预算：重试次数不超过请求数的一定比例，故障期间不让重试堆积
+- 熔断器：连续失败过多时暂停派发，冷却后放一个探测请求
+"""
+
+import random
+import threading
+import time
+
+RETRYABLE = "retryable"  # 超时、连接错误、服务端5xx：退避后重试
+THROTTLED = "throttled"  # 限流：退避更久后重试，不计入熔断
+FATAL = "fatal"          # 参数/文件/签名错误：重试也不会成功
+
+
+def classify_error(error_code, status_code: int, throttle_codes, fatal_codes) -> str:
+    """
+    对API返回的错误分类
+
+    Args:
+        error_code: 响应中的错误码（数字或字符串）
+        status_code: HTTP状态码
+        throttle_codes: 限流错误码
+        fatal_codes: 不需要重试的错误码
+    """
+    if error_code in throttle_codes or status_code == 429:
+        return THROTTLED
+    if error_code in fatal_codes:
+        return FATAL
+    # 4xx：请求本身有问题（签名、参数等）
+    if 400 <= status_code < 500:
+        return FATAL
+    return RETRYABLE
+
+
+def backoff_delay(attempt: int, kind: str, base: float, cap: float) -> float:
+    """
+    指数退避 + 全抖动：在 [0, min(cap, base * 2^attempt)] 中均匀取值
+    限流错误的基数加倍，给服务端更多恢复时间
+    """
+    if kind == THROTTLED:
+        base *= 2
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RetryBudget:
+    """
+    全局重试预算（线程安全）
+    每个新请求存入 ratio 个令牌，每次重试消耗1个；令牌耗尽时不再重试
+    """
+
+    def __init__(self, ratio: float, minimum: float):
+        self.ratio = ratio
+        self.minimum = minimum
+        self._tokens = float(minimum)
+        self._lock = threading.Lock()
+        self.spent = 0
+        self.denied = 0
+
+    def on_request(self):
+        with self._lock:
+            # 上限：不让长时间平稳运行攒下过多预算
+            self._tokens = min(self._tokens + self.ratio, self.minimum + 100 * self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.spent += 1
+                return True
+            self.denied += 1
+            return False
+
+
+class CircuitBreaker:
+    """
+    熔断器（线程安全）
+
+    closed:    正常派发
+    open:      连续 failure_threshold 次可重试类失败后打开，cooldown 秒内所有请求等待
+    half_open: 冷却结束后只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.open_count = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._cond = threading.Condition()
+
+    def wait_ready(self):
+        """派发前调用，熔断打开时阻塞到允许发送"""
+        with self._cond:
+            while True:
+                if self.state == "closed":
+                    return
+                if self.state == "open":
+                    remaining = self._opened_at + self.cooldown - time.monotonic()
+                    if remaining > 0:
+                        self._cond.wait(remaining)
+                        continue
+                    self.state = "half_open"
+                    print("[熔断] 冷却结束，发送探测请求")
+                if self.state == "half_open" and not self._probing:
+                    self._probing = True
+                    return
+                self._cond.wait()
+
+    def on_success(self):
+        with self._cond:
+            self._failures = 0
+            if self.state != "closed":
+                print("[熔断] 探测成功，恢复派发")
+            self.state = "closed"
+            self._probing = False
+            self._cond.notify_all()
+
+    def on_failure(self):
+        with self._cond:
+            self._failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self.open_count += 1
+                print(f"[熔断] 连续失败 {self._failures} 次，暂停派发 {self.cooldown:.0f} 秒")
+                self._cond.notify_all()
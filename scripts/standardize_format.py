@@ -8,6 +8,10 @@ import re
 import os
 from pathlib import Path
 
+from atomic_io import atomic_open
+from build_graph import BuildGraph
+from manifest import file_sha256
+
 # 干扰内容模式
 INTERFERENCE_PATTERNS = [
     r'小象教育',
@@ -98,7 +102,7 @@ def process_file(input_path: Path, output_path: Path) -> dict:
     # 确保输出目录存在
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(output_path, 'w', encoding='utf-8') as f:
+    with atomic_open(output_path) as f:
         f.write(standardized_content)
 
     return {
@@ -121,6 +125,8 @@ def main():
 
     reports = []
     total_changes = 0
+    # 输入文件内容没变的跳过（沿用上次的修改记录）
+    graph = BuildGraph("standardize", sources=[__file__])
 
     print("=" * 60)
     print("格式标准化处理开始")
@@ -128,7 +134,8 @@ def main():
 
     for file_path in files:
         output_path = final_dir / file_path.name
-        report = process_file(file_path, output_path)
+        report = graph.build(f"file:{file_path.name}", [file_sha256(str(file_path))],
+                             lambda: process_file(file_path, output_path), outputs=[str(output_path)])
         reports.append(report)
         total_changes += report['changes_count']
 
@@ -136,12 +143,12 @@ def main():
         print(f"[{'修复' if report['changes_count'] > 0 else '完成'}] {report['file']}: {status}")
 
     print("=" * 60)
-    print(f"处理完成: 共 {len(files)} 个文件, {total_changes} 处修改")
+    print(f"处理完成: 共 {len(files)} 个文件, {total_changes} 处修改（{graph.summary()}）")
     print("=" * 60)
 
     # 生成详细报告
     report_path = final_dir / 'standardization_report.md'
-    with open(report_path, 'w', encoding='utf-8') as f:
+    with atomic_open(report_path, checksum=False) as f:
         f.write("# 格式标准化报告\n\n")
         f.write(f"## 处理统计\n\n")
         f.write(f"- 处理文件数: {len(files)}\n")
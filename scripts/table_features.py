@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+表格检测用的逐页文本特征
+每页的特征只计算一次，缓存在页面清单中该页OCR记录的旁边（records.features 列），
+OCR记录重写时自动作废。调整 TABLE_SHORT_LINE_RATIO 等阈值后重新执行 Phase 2 不必重新扫描文本
+
+特征（与阈值无关）：
+    line_count      行数
+    line_lengths    逐行字符数（短行比例由它和 TABLE_SHORT_LINE_LENGTH 算出）
+    text_len        "\\n".join(行) 的字符数
+    digit_count     数字字符数（与 str.isdigit 一致）
+    keywords        命中的表格关键词（TABLE_KEYWORDS 的顺序）
+    similar_count   相邻两行长度差异<30%的组数（不足5行时为0）
+    opens_new       首行是标题或题号（不是上一页表格的延续）
+
+批量计算时把所有页拼成一个码点数组，用NumPy向量化统计；没有安装numpy时逐页计算，结果相同
+TABLE_KEYWORDS 变化时缓存的特征作废，自动重新计算
+"""
+
+import hashlib
+import re
+from itertools import chain
+
+from config import TABLE_KEYWORDS
+from manifest import page_manifest
+from records import dumps
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 特征的计算方式变化时加1，使已缓存的特征作废
+FEATURES_VERSION = 1
+FEATURES_KEY = hashlib.sha256(dumps([FEATURES_VERSION, TABLE_KEYWORDS])).hexdigest()[:16]
+
+# 首行为题号/大题号，或含标题特征时，说明不是上一页内容的延续
+HEADING_PATTERN = re.compile(r'^[\d一二三四五六七八九十]+[\.、]')
+TITLE_MARKERS = ["《", "》", "真题", "答案"]
+
+
+# 码点 -> 是否为数字字符（str.isdigit），按语料中出现的最大码点按需扩展
+_digit_table = None
+
+
+def _is_digit(codes):
+    global _digit_table
+    size = int(codes.max()) + 1 if len(codes) else 0
+    if _digit_table is None or size > len(_digit_table):
+        _digit_table = np.fromiter((chr(code).isdigit() for code in range(size)), dtype=bool, count=size)
+    return _digit_table[codes]
+
+
+def opens_new(line: str) -> bool:
+    """一行是否为新标题/新题目的开始"""
+    return bool(HEADING_PATTERN.match(line)) or any(kw in line for kw in TITLE_MARKERS)
+
+
+def _similar_count(lengths: list) -> int:
+    if len(lengths) < 5:
+        return 0
+    return sum(1 for i in range(len(lengths) - 1)
+               if lengths[i] > 0 and abs(lengths[i] - lengths[i + 1]) / lengths[i] < 0.3)
+
+
+def _page_features(lines: list) -> dict:
+    """逐页计算（没有numpy时使用，也是向量化实现的参照）"""
+    text = "\n".join(lines)
+    lengths = [len(line) for line in lines]
+    return {
+        "key": FEATURES_KEY,
+        "line_count": len(lines),
+        "line_lengths": lengths,
+        "text_len": len(text),
+        "digit_count": sum(1 for c in text if c.isdigit()),
+        "keywords": [kw for kw in TABLE_KEYWORDS if kw in text],
+        "similar_count": _similar_count(lengths),
+        "opens_new": opens_new(lines[0]) if lines else False,
+    }
+
+
+def _batch_features(pages: dict) -> dict:
+    """所有页拼成一个语料缓冲区，向量化统计"""
+    page_nums = list(pages)
+    lines_list = [pages[p] for p in page_nums]
+    texts = ["\n".join(lines) for lines in lines_list]
+    count = len(texts)
+
+    # 各页之间用 \0 分隔，关键词不会跨页匹配
+    corpus = "\0".join(texts)
+    codes = np.frombuffer(corpus.encode('utf-32-le'), dtype=np.uint32)
+    text_len = np.array([len(text) for text in texts], dtype=np.int64)
+    starts = np.zeros(count, dtype=np.int64)
+    np.cumsum(text_len[:-1] + 1, out=starts[1:])
+    ends = starts + text_len
+
+    # 数字字符（查表，与 str.isdigit 一致，含全角数字、①等）
+    cumulative = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(_is_digit(codes), out=cumulative[1:])
+    digit_count = cumulative[ends] - cumulative[starts]
+
+    # 关键词：每个关键词在整个语料上搜索一次，按位置归到页
+    keywords = [[] for _ in range(count)]
+    for kw in TABLE_KEYWORDS:
+        positions = [m.start() for m in re.finditer(re.escape(kw), corpus)]
+        if positions:
+            for index in np.unique(np.searchsorted(starts, positions, side='right') - 1).tolist():
+                keywords[index].append(kw)
+
+    # 相邻两行长度差异<30%的组数（不跨页）
+    line_count = np.array([len(lines) for lines in lines_list], dtype=np.int64)
+    total_lines = int(line_count.sum())
+    line_len = np.fromiter(map(len, chain.from_iterable(lines_list)), dtype=np.int64, count=total_lines)
+    line_page = np.repeat(np.arange(count), line_count)
+    prev_len = line_len[:-1]
+    diff_ratio = np.divide(np.abs(prev_len - line_len[1:]), prev_len, out=np.ones(len(prev_len)), where=prev_len > 0)
+    similar = (prev_len > 0) & (diff_ratio < 0.3) & (line_page[:-1] == line_page[1:])
+    similar_count = np.bincount(line_page[:-1][similar], minlength=count)
+    similar_count[line_count < 5] = 0
+
+    line_starts = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(line_count, out=line_starts[1:])
+    line_len = line_len.tolist()
+
+    return {
+        page_num: {
+            "key": FEATURES_KEY,
+            "line_count": int(line_count[i]),
+            "line_lengths": line_len[line_starts[i]:line_starts[i + 1]],
+            "text_len": int(text_len[i]),
+            "digit_count": int(digit_count[i]),
+            "keywords": keywords[i],
+            "similar_count": int(similar_count[i]),
+            "opens_new": opens_new(lines_list[i][0]) if lines_list[i] else False,
+        }
+        for i, page_num in enumerate(page_nums)
+    }
+
+
+def compute_features(pages: dict) -> dict:
+    """
+    计算特征（不读写缓存）
+
+    Args:
+        pages: {页码: 文本行列表}
+    """
+    if np is None or not pages:
+        return {page_num: _page_features(lines) for page_num, lines in pages.items()}
+    return _batch_features(pages)
+
+
+def load_features(stage: str = "ocr", pages: list = None, records: dict = None) -> tuple:
+    """
+    读取各页特征，缓存中没有（或已作废）的页批量计算后写回缓存
+
+    Args:
+        pages: 只读取这些页，默认为该阶段全部有结果的页
+        records: 已在内存中的结果记录 {页码: 记录}，缺特征的页优先从这里取文本
+
+    Returns:
+        ({页码: 特征}, 新计算的页数)
+    """
+    features = page_manifest.record_features(stage, pages)
+    missing = [page_num for page_num, value in features.items()
+               if value is None or value.get("key") != FEATURES_KEY]
+    if not missing:
+        return features, 0
+
+    texts = {}
+    if records is None and len(missing) > 1:
+        # 缺的页多时按页码顺序分批读出，不逐页查询
+        wanted = set(missing)
+        for page_num, record in page_manifest.iter_records(stage):
+            if page_num in wanted:
+                texts[page_num] = record.get("line_texts", [])
+    else:
+        for page_num in missing:
+            record = (records or {}).get(page_num) or page_manifest.record(page_num, stage) or {}
+            texts[page_num] = record.get("line_texts", [])
+    computed = compute_features(texts)
+    page_manifest.set_record_features(stage, computed)
+    features.update(computed)
+    return features, len(computed)
+
+
+def features_for(page_num: int, record: dict, stage: str = "ocr") -> dict:
+    """单页的特征（流式流水线逐页调用）：有缓存时直接返回，否则计算并缓存"""
+    features, _ = load_features(stage, [page_num], records={page_num: record})
+    if page_num in features:
+        return features[page_num]
+    # 还没有保存结果记录的页（例如占位的失败结果）只计算不缓存
+    return compute_features({page_num: record.get("line_texts", [])})[page_num]
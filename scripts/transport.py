@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+HTTP传输层
+持久化、线程安全的连接池，复用TCP/TLS连接，避免每页重新握手
+默认使用 requests.Session；开启HTTP/2时使用 httpx（需 pip install httpx[http2]）
+"""
+
+import threading
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+Response = namedtuple("Response", ["status_code", "content"])
+
+
+class TransportError(Exception):
+    """请求发送失败（连接错误等）"""
+
+
+class TransportTimeout(TransportError):
+    """请求超时"""
+
+
+class Transport:
+    """
+    连接池传输层
+
+    Args:
+        pool_size: 连接池大小（建议不小于并发数）
+        keepalive_expiry: 空闲连接保留秒数（仅httpx后端支持，
+                          requests后端由urllib3自动检测失效连接）
+        http2: 是否启用HTTP/2
+    """
+
+    def __init__(self, pool_size: int = 10, keepalive_expiry: float = 30, http2: bool = False):
+        self.pool_size = pool_size
+        self.http2 = False
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._new_connections = 0
+        self._upload_bytes = 0
+
+        if http2:
+            try:
+                import httpx
+                self._client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_connections=pool_size,
+                        max_keepalive_connections=pool_size,
+                        keepalive_expiry=keepalive_expiry,
+                    ),
+                    headers={"Accept-Encoding": "gzip, deflate"},
+                )
+                self._httpx = httpx
+                self.http2 = True
+            except ImportError:
+                print("警告: 未安装 httpx[http2]，回退到 HTTP/1.1 连接池")
+
+        if not self.http2:
+            self._session = requests.Session()
+            self._session.headers.update({
+                "Accept-Encoding": "gzip, deflate",
+                "Connection": "keep-alive",
+            })
+            self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self._session.mount("https://", self._adapter)
+            self._session.mount("http://", self._adapter)
+
+    def _trace(self, event_name, info):
+        """httpx连接事件回调，统计新建连接"""
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self._new_connections += 1
+
+    def post(self, url: str, headers: dict, data, timeout: float) -> Response:
+        """
+        发送POST请求，返回 Response(status_code, content)
+        data 可以是 bytes/str，或带 read() 和 __len__ 的类文件对象（分块发送，不整体拷贝）
+        """
+        with self._lock:
+            self._requests += 1
+            self._upload_bytes += len(data)
+
+        if self.http2:
+            httpx = self._httpx
+            if hasattr(data, "read"):
+                headers = dict(headers, **{"Content-Length": str(len(data))})
+                data = _iter_blocks(data)
+            try:
+                resp = self._client.post(url, headers=headers, content=data, timeout=timeout,
+                                         extensions={"trace": self._trace})
+                return Response(resp.status_code, resp.content)
+            except httpx.TimeoutException as e:
+                raise TransportTimeout(str(e)) from e
+            except httpx.HTTPError as e:
+                raise TransportError(str(e)) from e
+
+        try:
+            resp = self._session.post(url, headers=headers, data=data, timeout=timeout)
+            return Response(resp.status_code, resp.content)
+        except requests.exceptions.Timeout as e:
+            raise TransportTimeout(str(e)) from e
+        except requests.exceptions.RequestException as e:
+            raise TransportError(str(e)) from e
+
+    def stats(self) -> dict:
+        """连接复用统计"""
+        if not self.http2:
+            # urllib3连接池自带计数
+            pools = self._adapter.poolmanager.pools
+            new_connections = sum(pools[key].num_connections for key in list(pools.keys()))
+        else:
+            new_connections = self._new_connections
+
+        requests_sent = self._requests
+        reused = max(0, requests_sent - new_connections)
+        return {
+            "protocol": "HTTP/2" if self.http2 else "HTTP/1.1",
+            "pool_size": self.pool_size,
+            "requests": requests_sent,
+            "new_connections": new_connections,
+            "reused_connections": reused,
+            "reuse_ratio": reused / requests_sent if requests_sent else 0,
+            "upload_bytes": self._upload_bytes,
+        }
+
+    def close(self):
+        """关闭连接池"""
+        if self.http2:
+            self._client.close()
+        else:
+            self._session.close()
+
+
+def _iter_blocks(reader, block_size: int = 64 * 1024):
+    """将类文件对象转为bytes块迭代器（httpx不接受memoryview）"""
+    while True:
+        block = reader.read(block_size)
+        if not len(block):
+            return
+        yield bytes(block)